@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the Motor Control Server wire protocols: pickle versus binary frames for the hot verbs
+Reports bytes per command (request and reply) and messages per second, for the codec alone and end-to-end over
+loopback against a MotorControlServer on a SimulatedPicoBorgRev
+Usage:
+    benchmarks/protocol.py [calls]
+"""
+import pickle
+import sys
+import time
+from os import path
+from threading import Thread
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from motor_server import (MotorControlServer, MotorController, SimulatedPicoBorgRev, PROTOCOL_BINARY, PROTOCOL_PICKLE,
+                          OPCODES, decode_reply, decode_request, encode_reply, encode_request)
+
+PORT = 19092  # loopback port of the benchmark server
+TOKEN = 'benchmark'  # authkey of the benchmark server, so that it runs without /home/pi/.motor_server
+CALLS = (  # (verb, args, reply) of the hot verbs
+    ('set_velocity', (0.5, -0.25), (('linear', 0.5), ('angular', -0.25), ('motorA', 42), ('motorB', 127))),
+    ('set_led', (1,), (('led', 'ON'),)),
+    ('get_velocity', (), (('motorA', 42), ('motorB', 127))),
+)
+
+
+def rate(func, calls):
+    """return calls per second of func()"""
+    start = time.perf_counter()
+    for _ in range(calls): func()
+    return calls / (time.perf_counter() - start)
+
+
+def codec(verb, args, reply, calls):
+    """return bytes per command and round trips per second of encoding and decoding request and reply"""
+    opcode = OPCODES[verb]
+
+    def pickled():
+        pickle.loads(pickle.dumps((verb, args, {})))
+        pickle.loads(pickle.dumps(reply))
+
+    def binary():
+        decode_request(encode_request(verb, args, {}))
+        decode_reply(encode_reply(opcode, None, reply))
+
+    return ((len(pickle.dumps((verb, args, {}))) + len(pickle.dumps(reply)), rate(pickled, calls)),
+            (len(encode_request(verb, args, {})) + len(encode_reply(opcode, None, reply)), rate(binary, calls)))
+
+
+def end_to_end(protocol, verb, args, calls):
+    """return RPC calls per second of verb(*args) over loopback"""
+    with MotorController('127.0.0.1', PORT, TOKEN, protocol=protocol) as mc:
+        return rate(lambda: getattr(mc, verb)(*args), calls)
+
+
+if __name__ == '__main__':
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    server = MotorControlServer('127.0.0.1', PORT, token=TOKEN, bus=SimulatedPicoBorgRev())
+    thread = Thread(target=server.start)
+    thread.daemon = True
+    thread.start()
+    time.sleep(0.5)
+    print('{:<14s}{:>10s}{:>14s}{:>14s}{:>10s}{:>14s}{:>14s}'.format(
+        'verb', 'pickle B', 'codec msg/s', 'rpc msg/s', 'binary B', 'codec msg/s', 'rpc msg/s'))
+    for verb, args, reply in CALLS:
+        (p_bytes, p_codec), (b_bytes, b_codec) = codec(verb, args, reply, calls)
+        p_rpc, b_rpc = [end_to_end(protocol, verb, args, calls) for protocol in (PROTOCOL_PICKLE, PROTOCOL_BINARY)]
+        print('{:<14s}{:>10d}{:>14.0f}{:>14.0f}{:>10d}{:>14.0f}{:>14.0f}'.format(
+            verb, p_bytes, p_codec, p_rpc, b_bytes, b_codec, b_rpc))
+    with MotorController('127.0.0.1', PORT, TOKEN) as mc:
+        mc.stop()
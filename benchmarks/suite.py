@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite for the DiddyBorg servers, runs without hardware
+    rpc       - N concurrent MotorController client processes calling set_velocity and status over loopback against a
+                MotorControlServer (or AsyncMotorControlServer) on a SimulatedPicoBorgRev: call rate and tail latency
+    heartbeat - heartbeat period jitter of that server while under the rpc load, from its metrics verb
+    camera    - M viewers of /stream.mjpg served by AsyncStreamingServer (or StreamingServer) from a StreamingOutput fed synthetic JPEG frames:
+                frames and bytes delivered per viewer
+    imports   - milliseconds a fresh interpreter spends importing the modules clients and CLI calls load
+Results are written as JSON, and compared with a previous run
+Usage:
+    benchmarks/suite.py [--clients N] [--viewers M] [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from multiprocessing import Pool
+from threading import Thread
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from motor_server import MotorControlServer, MotorController, SimulatedPicoBorgRev
+
+RPC_PORT, CAMERA_PORT = 19092, 19080  # loopback ports of the benchmark servers
+TOKEN = 'benchmark'  # authkey of the motor server, so that it runs without /home/pi/.motor_server
+JPEG_SIZE = 48 * 1024  # bytes of a synthetic 800x600 MJPEG frame
+IMPORTS = ('motor_client', 'wiimote', 'motor_server')  # modules whose import time is measured
+
+
+def percentile(values, q):
+    """return the q quantile of sorted values"""
+    return values[min(int(q * len(values)), len(values) - 1)] if values else 0.0
+
+
+def rpc_client(args):
+    """client process: wait until start_at, then call verbs in turn for duration seconds, return latencies"""
+    protocol, start_at, duration = args
+    latencies = []
+    with MotorController('127.0.0.1', RPC_PORT, TOKEN, protocol=protocol) as mc:
+        calls = ((mc.set_velocity, (0.5, 0.1)), (mc.status, ()), (mc.set_velocity, (0.0, 0.0)))
+        time.sleep(max(0.0, start_at - time.time()))
+        end = time.perf_counter() + duration
+        while True:
+            for call, call_args in calls:
+                start = time.perf_counter()
+                call(*call_args)
+                latencies.append(time.perf_counter() - start)
+            if start > end: return latencies
+
+
+def bench_rpc(options):
+    """return rpc and heartbeat results of options.clients concurrent clients against a simulated motor server"""
+    bus = SimulatedPicoBorgRev(latency=options.i2c_latency)
+    if options.server == 'asyncio':
+        from motor_server_asyncio import AsyncMotorControlServer
+        server = AsyncMotorControlServer('127.0.0.1', RPC_PORT, token=TOKEN, bus=bus)
+    else:
+        server = MotorControlServer('127.0.0.1', RPC_PORT, token=TOKEN, bus=bus)
+    thread = Thread(target=server.start)
+    thread.daemon = True
+    thread.start()
+    time.sleep(0.5)
+    with Pool(options.clients) as pool:
+        start_at = time.time() + 1.0
+        runs = pool.map(rpc_client, [(options.protocol, start_at, options.duration)] * options.clients)
+    latencies = sorted(latency for run in runs for latency in run)
+    with MotorController('127.0.0.1', RPC_PORT, TOKEN) as mc:
+        metrics = dict(mc.metrics())
+        mc.stop()
+    thread.join(2 * options.duration)
+    return {
+        'clients': options.clients, 'server': options.server, 'protocol': options.protocol, 'calls': len(latencies),
+        'calls_per_s': len(latencies) / options.duration,
+        'p50_us': 1e6 * percentile(latencies, 0.50), 'p95_us': 1e6 * percentile(latencies, 0.95),
+        'p99_us': 1e6 * percentile(latencies, 0.99), 'max_us': 1e6 * latencies[-1],
+    }, dict(dict(metrics['heartbeat_jitter']), watchdog_trips=metrics['watchdog_trips'])
+
+
+def synthetic_frame(n):
+    """return a JPEG-framed byte string of JPEG_SIZE bytes, distinct for each n"""
+    body = (n.to_bytes(4, 'big') * (JPEG_SIZE // 4))[:JPEG_SIZE - 4]
+    return b'\xff\xd8' + body + b'\xff\xd9'
+
+
+def viewer(port, duration, result):
+    """read /stream.mjpg for duration seconds, store frames and bytes received in result"""
+    sock = socket.create_connection(('127.0.0.1', port))
+    sock.sendall(b'GET /stream.mjpg HTTP/1.1\r\nHost: localhost\r\n\r\n')
+    sock.settimeout(1.0)  # the frames may stop before duration is up
+    frames = received = 0
+    end = time.perf_counter() + duration
+    try:
+        while time.perf_counter() < end:
+            data = sock.recv(65536)
+            if not data: break
+            received += len(data)
+            frames += data.count(b'--FRAME\r\n')
+    except socket.timeout:
+        pass
+    finally:
+        sock.close()
+    result.update(frames=frames, bytes=received)
+
+
+def bench_camera(options):
+    """return fan-out results of options.viewers viewers of synthetic frames at options.fps"""
+    from camera import AsyncStreamingServer, StreamingHandler, StreamingOutput, StreamingServer
+    output = StreamingOutput()
+    if options.camera_server == 'asyncio':
+        server = AsyncStreamingServer(('127.0.0.1', CAMERA_PORT), output)
+    else:
+        server = StreamingServer(('127.0.0.1', CAMERA_PORT), StreamingHandler, output)
+    Thread(target=server.serve_forever, daemon=True).start()
+    time.sleep(0.2)
+    results = [{} for _ in range(options.viewers)]
+    viewers = [Thread(target=viewer, args=(CAMERA_PORT, options.duration, r), daemon=True) for r in results]
+    for v in viewers: v.start()
+    frames, written, period = 0, 0, 1.0 / options.fps
+    deadline = start = time.perf_counter()
+    while deadline - start < options.duration:
+        frame = synthetic_frame(frames)
+        write_start = time.perf_counter()
+        output.write(frame)
+        written += time.perf_counter() - write_start
+        frames += 1
+        deadline += period
+        time.sleep(max(0.0, deadline - time.perf_counter()))
+    for v in viewers: v.join(options.duration)
+    if options.camera_server == 'thread':
+        server.shutdown()
+        server.server_close()
+    delivered = [r.get('frames', 0) for r in results]
+    return {
+        'viewers': options.viewers, 'server': options.camera_server, 'fps': options.fps, 'frames_written': frames,
+        'encoder_write_us': 1e6 * written / frames,
+        'frames_per_viewer': sum(delivered) / len(delivered), 'min_frames_per_viewer': min(delivered),
+        'mbytes_per_s': sum(r.get('bytes', 0) for r in results) / options.duration / 1e6,
+    }
+
+
+def bench_imports(options):
+    """return the median milliseconds of options.import_runs fresh interpreters importing each of IMPORTS, less the
+    startup of an interpreter that imports nothing"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    def median_ms(code):
+        times = []
+        for _ in range(options.import_runs):
+            start = time.perf_counter()
+            subprocess.check_call([sys.executable, '-c', code], cwd=root)
+            times.append(time.perf_counter() - start)
+        return 1000 * sorted(times)[len(times) // 2]
+
+    results = {'interpreter_ms': median_ms('pass')}
+    for module in IMPORTS: results[module + '_ms'] = median_ms('import ' + module) - results['interpreter_ms']
+    return results
+
+
+def compare(baseline, results, prefix=''):
+    """print numeric results next to their baseline value and relative change"""
+    for key, value in sorted(results.items()):
+        old = baseline.get(key) if isinstance(baseline, dict) else None
+        if isinstance(value, dict):
+            compare(old or {}, value, prefix + key + '.')
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and isinstance(old, (int, float)):
+            change = 100.0 * (value - old) / old if old else 0.0
+            print('{:<40s}{:>14.1f}{:>14.1f}{:>+9.1f}%'.format(prefix + key, old, value, change))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=4, help='concurrent motor clients')
+    parser.add_argument('--server', choices=('thread', 'asyncio'), default='thread', help='motor server flavour')
+    parser.add_argument('--protocol', type=int, default=1, help='wire protocol, 0 pickle, 1 binary')
+    parser.add_argument('--i2c-latency', type=float, default=0.0002, help='seconds per simulated i2c transaction')
+    parser.add_argument('--viewers', type=int, default=8, help='concurrent camera viewers')
+    parser.add_argument('--camera-server', choices=('thread', 'asyncio'), default='asyncio', help='camera server flavour')
+    parser.add_argument('--fps', type=float, default=30.0, help='synthetic camera frame rate')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds per benchmark')
+    parser.add_argument('--import-runs', type=int, default=11, help='interpreters started per import measurement')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--compare', help='compare results with this JSON file')
+    options = parser.parse_args()
+
+    rpc, heartbeat = bench_rpc(options)
+    results = {
+        'environment': {'python': platform.python_version(), 'machine': platform.machine(), 'cpus': os.cpu_count(),
+                        'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+        'rpc': rpc, 'heartbeat': heartbeat, 'camera': bench_camera(options), 'imports': bench_imports(options),
+    }
+    print(json.dumps(results, indent=2, sort_keys=True))
+    if options.output:
+        with open(options.output, 'w') as outfile: json.dump(results, outfile, indent=2, sort_keys=True)
+    if options.compare:
+        with open(options.compare) as infile: baseline = json.load(infile)
+        print('{:<40s}{:>14s}{:>14s}{:>10s}'.format('result', 'baseline', 'current', 'change'))
+        compare(baseline, results)
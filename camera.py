@@ -3,13 +3,39 @@
 """
 Remote Camera Server
 Source official PiCamera package: http://picamera.readthedocs.io/en/latest/recipes2.html#web-streaming
+The camera records only while /stream.mjpg has viewers, and for a grace period after the last one leaves
+Frames are also published on the shared memory frame bus for local vision processes, see frame_bus.py
+Usage:
+    camera.py [fake] [grace] [preroll]  -> serve on port 80, with synthetic frames instead of the camera if fake,
+                                           recording continuously to the pre-roll ring if preroll, see preroll.py
 """
+import asyncio
 import io
-import picamera
+import json
 import logging
 import socketserver
-from threading import Condition
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import Condition, Event, Lock, Thread, Timer
+from time import monotonic, sleep
 from http import server
+from os import urandom
+from urllib.parse import parse_qs, urlsplit
+
+try:
+    import picamera
+except ImportError:  # streaming frames from another source, e.g. benchmarks
+    picamera = None
+try:
+    from PIL import Image
+except ImportError:  # renditions are not available, every viewer gets the source frames
+    Image = None
+
+PREROLL_SECONDS = 10.0  # seconds of video POST /preroll exports by default
+SNAPSHOT_TIMEOUT = 5.0  # seconds /snapshot.jpg waits for a frame
+QUALITY = 75  # JPEG quality of a rendition requested by size only
+MAX_SIZE = 1920  # largest rendition width or height
+NONCE = urandom(4).hex()  # distinguishes entity tags of this process from those of earlier ones
 
 PAGE = """\
 <html>
@@ -37,75 +63,582 @@ PAGE = """\
 
 
 class StreamingOutput(object):
-    def __init__(self):
-        self.frame = None
-        self.buffer = io.BytesIO()
+    """ring of preallocated frame slots written by the camera encoder and read by the streaming handlers
+    Every complete frame gets the next sequence number. A handler pins the newest frame and writes it from a memoryview
+    of its slot, while the encoder fills a slot that is neither pinned nor newest, so no frame is copied or allocated
+    after the slots have grown to the largest frame. If every slot is pinned the encoder drops the frame.
+    """
+
+    def __init__(self, slots=6, slot_size=256 * 1024):
+        """
+        :param slots: number of frame slots, at least two
+        :param slot_size: initial bytes per slot, a slot grows if a frame does not fit
+        """
+        self.slots = [bytearray(slot_size) for _ in range(max(2, slots))]
+        self.lengths = [0] * len(self.slots)
+        self.pins = [0] * len(self.slots)
+        self.seq, self.newest, self.dropped = 0, None, 0
+        self.slot, self.length = 0, 0
         self.condition = Condition()
+        self.listeners = []
 
     def write(self, buf):
-        if buf.startswith(b'\xff\xd8'):
-            # New frame, copy the existing buffer's content and notify all
-            # clients it's available
-            self.buffer.truncate()
-            with self.condition:
-                self.frame = self.buffer.getvalue()
+        """append a chunk of mjpeg output, a chunk starting with a JPEG SOI marker starts a new frame"""
+        if buf.startswith(b'\xff\xd8'): self.flush()
+        if self.slot is not None:
+            end, slot = self.length + len(buf), self.slots[self.slot]
+            if end > len(slot): slot.extend(bytes(end - len(slot)))
+            slot[self.length:end] = buf
+            self.length = end
+        return len(buf)
+
+    def flush(self):
+        """publish the frame being written and pick the slot of the next one, picamera calls this on stop_recording"""
+        with self.condition:
+            published = self.slot is not None and self.length
+            if published:
+                self.seq += 1
+                self.newest, self.lengths[self.slot] = self.slot, self.length
                 self.condition.notify_all()
-            self.buffer.seek(0)
-        return self.buffer.write(buf)
+            self.slot = next((i for i, pins in enumerate(self.pins) if not pins and i != self.newest), None)
+            if self.slot is None: self.dropped += 1
+        self.length = 0
+        if published:
+            for listener in self.listeners: listener(self.seq)
+
+    def acquire(self, after=0, timeout=None):
+        """wait for a frame newer than sequence number after and pin it, release the frame when done with it
+        :param after: sequence number of the last frame seen, 0 for none
+        :param timeout: seconds to wait for a newer frame, None to wait forever
+        :return: sequence number and memoryview of the newest frame, or (after, None) on timeout
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.seq > after, timeout): return after, None
+            self.pins[self.newest] += 1
+            return self.seq, memoryview(self.slots[self.newest])[:self.lengths[self.newest]]
+
+    def subscribe(self, listener):
+        """call listener with the sequence number of every new frame, from the encoder thread, so it must not block"""
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        """stop calling listener"""
+        self.listeners.remove(listener)
+
+    def release(self, frame):
+        """unpin a frame returned by acquire"""
+        slot = next(i for i, s in enumerate(self.slots) if s is frame.obj)
+        frame.release()
+        with self.condition:
+            self.pins[slot] -= 1
+
+
+def rendition(query):
+    """return the (width, height, quality) rendition requested by a query string, None for the source frames
+    :param query: query string, e.g. 'size=320x240&quality=50', either parameter may be omitted
+    :raise ValueError: if size is not WIDTHxHEIGHT within MAX_SIZE or quality is not within 1..95
+    """
+    params = parse_qs(query)
+    if 'size' not in params and 'quality' not in params: return None
+    width, height = (int(i) for i in params['size'][0].lower().split('x')) if 'size' in params else (0, 0)
+    quality = int(params['quality'][0]) if 'quality' in params else QUALITY
+    if not (0 <= width <= MAX_SIZE and 0 <= height <= MAX_SIZE and (width > 0) == (height > 0) and 1 <= quality <= 95):
+        raise ValueError('bad rendition {!r}'.format(query))
+    return width, height, quality
+
+
+class RenditionCache(object):
+    """scaled and recompressed renditions of the newest frame, each made once per source frame however many viewers
+    Holds the newest frame of up to capacity renditions, the least recently requested rendition is evicted first.
+    Without PIL every rendition is the source frame.
+    """
+
+    def __init__(self, capacity=4):
+        """:param capacity: number of renditions kept"""
+        self.capacity = capacity
+        self.renditions = OrderedDict()  # (width, height, quality) -> (sequence number, Future of the JPEG bytes)
+        self.hits = self.misses = self.evictions = 0
+        self.encode_time = 0.0
+        self.lock = Lock()
+
+    def get(self, seq, frame, key):
+        """return frame number seq in rendition key, encoding it if this is the first request for it, outside the lock,
+        so that other renditions are served meanwhile and requests for this one wait for its encoding
+        :param seq: sequence number of frame
+        :param frame: source JPEG frame
+        :param key: (width, height, quality) rendition, or None for the source frame
+        """
+        if key is None or Image is None: return frame
+        with self.lock:
+            cached = self.renditions.get(key)
+            hit = cached is not None and cached[0] == seq
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+                cached = self.renditions[key] = seq, Future()
+                while len(self.renditions) > self.capacity:
+                    self.renditions.popitem(last=False)
+                    self.evictions += 1
+            self.renditions.move_to_end(key)
+        if hit: return cached[1].result()
+        start = monotonic()
+        try:
+            cached[1].set_result(self.encode(frame, key))
+        except Exception as e:  # e.g. a frame PIL cannot decode, raised to the requests waiting for it too
+            cached[1].set_exception(e)
+            with self.lock:
+                if self.renditions.get(key) is cached: del self.renditions[key]
+            raise
+        finally:
+            with self.lock: self.encode_time += monotonic() - start
+        return cached[1].result()
+
+    @staticmethod
+    def encode(frame, key):
+        """return frame scaled to fit width x height, when given, and compressed at quality"""
+        width, height, quality = key
+        image = Image.open(io.BytesIO(frame))
+        if width: image.draft('RGB', (width, height))  # let the JPEG decoder downscale by up to 8 for free
+        if width: image.thumbnail((width, height))
+        out = io.BytesIO()
+        image.save(out, 'JPEG', quality=quality)
+        return out.getvalue()
+
+    @property
+    def stats(self):
+        """return cache hits, misses, evictions, total encoding seconds and the cached renditions"""
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'encode_seconds': round(self.encode_time, 6), 'transcoding': Image is not None,
+                    'renditions': ['{}x{}q{}'.format(*key) for key in self.renditions]}
+
+
+def snapshot(output, capture, cache, key, timeout=SNAPSHOT_TIMEOUT):
+    """return sequence number and bytes of the newest frame in rendition key, (None, None) if there is none in time
+    If capture is idle, recording starts and a frame recorded since is returned. The grace period of capture then
+    keeps recording for pollers.
+    """
+    seq = output.seq
+    started = capture is not None and capture.acquire()
+    try:
+        seq, frame = output.acquire(seq if started else 0, timeout)
+        if frame is None: return None, None
+        try:
+            return seq, bytes(cache.get(seq, frame, key))
+        finally:
+            output.release(frame)
+    finally:
+        if capture is not None: capture.release()
+
+
+def etag(seq, key):
+    """return the entity tag of frame seq in rendition key, frame sequence numbers restart with the process"""
+    return '"{}-{}"'.format(NONCE, seq) if key is None else '"{}-{}-{}x{}q{}"'.format(NONCE, seq, *key)
+
+
+def stream_stats(output, cache, capture, viewers):
+    """return the /stats.json document"""
+    return json.dumps({
+        'seq': output.seq, 'dropped': output.dropped, 'viewers': viewers, 'cache': cache.stats,
+        'recording': None if capture is None else capture.recording}).encode('utf-8')
+
+
+class PiCameraBackend(object):
+    """Raspberry Pi camera recording mjpeg, the camera is opened on the first start and kept open when idle"""
+
+    def __init__(self, resolution='800x600', framerate=30):
+        self.resolution, self.framerate = resolution, framerate
+        self.camera = None
+
+    def start(self, output):
+        """start recording mjpeg frames to output"""
+        if self.camera is None: self.camera = picamera.PiCamera(resolution=self.resolution, framerate=self.framerate)
+        self.camera.start_recording(output, format='mjpeg')
+
+    def stop(self):
+        """stop recording, the encoder idles"""
+        self.camera.stop_recording()
+
+    def close(self):
+        """release the camera"""
+        if self.camera is not None: self.camera.close()
+        self.camera = None
+
+
+class FakeCameraBackend(object):
+    """frame source for running without a camera, writes numbered JPEG-framed payloads at framerate"""
+
+    def __init__(self, framerate=30, size=48 * 1024):
+        self.framerate, self.size = framerate, size
+        self.frames = 0
+        self.running = Event()
+        self.thread = None
+
+    def start(self, output):
+        """start writing frames to output"""
+        self.running.set()
+        self.thread = Thread(target=self.record, args=(output,), daemon=True)
+        self.thread.start()
+
+    def record(self, output):
+        """write frames until stopped, then flush the last one"""
+        deadline = monotonic()
+        while self.running.is_set():
+            payload = self.frames.to_bytes(4, 'big') * ((self.size - 4) // 4)
+            output.write(b'\xff\xd8' + payload + b'\xff\xd9')
+            self.frames += 1
+            deadline += 1.0 / self.framerate
+            sleep(max(0.0, deadline - monotonic()))
+        output.flush()
+
+    def stop(self):
+        """stop writing frames"""
+        self.running.clear()
+        self.thread.join()
+
+    def close(self):
+        """nothing to release"""
+
+
+class CaptureManager(object):
+    """reference counted capture, the backend records while there are viewers and for grace seconds after the last
+    Example:
+    capture = CaptureManager(PiCameraBackend(), output)
+    capture.acquire()  # first viewer starts recording
+    capture.release()  # last viewer, recording stops after grace seconds unless another viewer arrives
+    """
+
+    def __init__(self, backend, output, grace=5.0):
+        """
+        :param backend: PiCameraBackend, FakeCameraBackend or any object with start(output), stop() and close()
+        :param output: StreamingOutput the backend records to
+        :param grace: seconds to keep recording after the last viewer leaves
+        """
+        self.backend, self.output, self.grace = backend, output, grace
+        self.viewers, self.recording, self.starts, self.stops = 0, False, 0, 0
+        self.lock = Lock()
+        self.timer = None
+
+    def acquire(self):
+        """count a viewer in, start recording if idle
+        :return: True if this started recording
+        """
+        with self.lock:
+            self.viewers += 1
+            if self.timer is not None: self.timer.cancel()
+            self.timer = None
+            if not self.recording:
+                self.backend.start(self.output)
+                self.recording, self.starts = True, self.starts + 1
+                return True
+        return False
+
+    def release(self):
+        """count a viewer out, the last one arms the grace timer"""
+        with self.lock:
+            self.viewers -= 1
+            if self.viewers == 0 and self.recording:
+                self.timer = Timer(self.grace, self.idle)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def idle(self):
+        """stop recording unless a viewer arrived during the grace period"""
+        with self.lock:
+            if self.viewers or not self.recording: return
+            self.timer = None
+            self.backend.stop()
+            self.recording, self.stops = False, self.stops + 1
+
+    def close(self):
+        """stop recording now and release the backend"""
+        with self.lock:
+            if self.timer is not None: self.timer.cancel()
+            if self.recording: self.backend.stop()
+            self.recording = False
+            self.backend.close()
 
 
 class StreamingHandler(server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # persistent connections, so every response but the stream has a Content-Length
+
     def do_GET(self):
-        if self.path == '/':
+        path, _, query = self.path.partition('?')
+        if path == '/':
             self.send_response(301)
             self.send_header('Location', '/index.html')
+            self.send_header('Content-Length', 0)
             self.end_headers()
-        elif self.path == '/index.html':
+        elif path == '/index.html':
             content = PAGE.encode('utf-8')
             self.send_response(200)
             self.send_header('Content-Type', 'text/html')
             self.send_header('Content-Length', len(content))
             self.end_headers()
             self.wfile.write(content)
-        elif self.path == '/stream.mjpg':
+        elif path == '/stats.json':
+            content = stream_stats(self.server.output, self.server.cache, self.server.capture, self.server.viewers)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', len(content))
+            self.end_headers()
+            self.wfile.write(content)
+        elif path == '/snapshot.jpg':
+            try:
+                key = rendition(query)
+            except ValueError:
+                return self.send_error(400)
+            seq, content = snapshot(self.server.output, self.server.capture, self.server.cache, key)
+            if content is None: return self.send_error(503, 'No frame')
+            tag = etag(seq, key)
+            self.send_response(304 if tag == self.headers.get('If-None-Match') else 200)
+            self.send_header('ETag', tag)
+            self.send_header('Cache-Control', 'no-cache')
+            if tag == self.headers.get('If-None-Match'): return self.end_headers()
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Content-Length', len(content))
+            self.end_headers()
+            self.wfile.write(content)
+        elif path == '/stream.mjpg':
+            try:
+                key = rendition(query)
+            except ValueError:
+                return self.send_error(400)
             self.send_response(200)
             self.send_header('Age', 0)
             self.send_header('Cache-Control', 'no-cache, private')
             self.send_header('Pragma', 'no-cache')
             self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=FRAME')
+            self.send_header('Connection', 'close')
             self.end_headers()
+            self.close_connection = True
+            output, capture, cache, skipped = self.server.output, self.server.capture, self.server.cache, 0
+            if capture is not None: capture.acquire()
+            self.server.viewers += 1
+            seq = start = output.seq
             try:
                 while True:
-                    with output.condition:
-                        output.condition.wait()
-                        frame = output.frame
-                    self.wfile.write(b'--FRAME\r\n')
-                    self.send_header('Content-Type', 'image/jpeg')
-                    self.send_header('Content-Length', len(frame))
-                    self.end_headers()
-                    self.wfile.write(frame)
-                    self.wfile.write(b'\r\n')
+                    frame_seq, frame = output.acquire(seq)
+                    try:
+                        data = cache.get(frame_seq, frame, key)
+                        self.wfile.write(b'--FRAME\r\n')
+                        self.send_header('Content-Type', 'image/jpeg')
+                        self.send_header('Content-Length', len(data))
+                        self.end_headers()
+                        self.wfile.write(data)
+                        self.wfile.write(b'\r\n')
+                    finally:
+                        output.release(frame)
+                    if seq != start: skipped += frame_seq - seq - 1
+                    seq = frame_seq
             except Exception as e:
                 logging.warning(
-                    'Removed streaming client %s: %s',
-                    self.client_address, str(e))
+                    'Removed streaming client %s: %s, skipped %d frames',
+                    self.client_address, str(e), skipped)
+            finally:
+                self.server.viewers -= 1
+                if capture is not None: capture.release()
         else:
             self.send_error(404)
-            self.end_headers()
+
+    def do_POST(self):
+        path, _, query = self.path.partition('?')
+        if path != '/preroll' or self.server.preroll is None: return self.send_error(404)
+        try:
+            seconds = float(parse_qs(query).get('seconds', [PREROLL_SECONDS])[0])
+        except ValueError:
+            return self.send_error(400)
+        content = json.dumps({'clip': self.server.preroll.trigger(seconds)}).encode('utf-8')
+        self.send_response(202)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', len(content))
+        self.end_headers()
+        self.wfile.write(content)
 
 
 class StreamingServer(socketserver.ThreadingMixIn, server.HTTPServer):
     allow_reuse_address = True
     daemon_threads = True
 
+    def __init__(self, server_address, RequestHandlerClass, output, capture=None, cache=None, preroll=None):
+        self.output, self.capture, self.cache = output, capture, RenditionCache() if cache is None else cache
+        self.preroll = preroll
+        self.viewers = 0
+        super().__init__(server_address, RequestHandlerClass)
 
-if __name__ == '__main__':
-    with picamera.PiCamera(resolution='800x600', framerate=30) as camera:
-        output = StreamingOutput()
-        camera.start_recording(output, format='mjpeg')
+
+class AsyncStreamingServer(object):
+    """MJPEG streaming server serving every viewer on one asyncio event loop
+    Each new frame is copied once out of the frame ring, since transports keep unsent data by reference, and written
+    to every viewer, always the newest frame. Renditions are encoded on executor threads, off the event loop, and a
+    rendition still encoding an older frame skips the new one. A viewer still holding more than max_buffer unsent bytes
+    skips the frame rather than queueing it, so a slow link costs that viewer frames but never delays the encoder or the
+    other viewers.
+    """
+
+    def __init__(self, server_address, output, capture=None, cache=None, preroll=None, max_buffer=256 * 1024):
+        """
+        :param server_address: (host, port) to listen on
+        :param output: StreamingOutput the camera records to
+        :param capture: CaptureManager recording only while there are viewers, None if the camera always records
+        :param cache: RenditionCache of the renditions viewers ask for, a new one if None
+        :param preroll: PrerollRecorder exporting a clip on POST /preroll, None to disable the route
+        :param max_buffer: unsent bytes above which a viewer skips frames
+        """
+        self.server_address, self.output, self.capture, self.preroll = server_address, output, capture, preroll
+        self.cache, self.max_buffer = RenditionCache() if cache is None else cache, max_buffer
+        self.viewers = {}  # writer -> [sequence number of last frame sent, frames skipped, rendition]
+        self.loop, self.pending, self.seq = None, False, 0
+        self.encoding = set()  # renditions being encoded on an executor thread
+
+    def serve_forever(self):
+        """serve viewers on the event loop of the calling thread"""
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        """listen for viewers and stream frames to them until cancelled"""
+        self.loop = asyncio.get_running_loop()
+        self.output.subscribe(self.notify)
         try:
-            address = ('0.0.0.0', 80)
-            server = StreamingServer(address, StreamingHandler)
-            server.serve_forever()
+            server = await asyncio.start_server(self.client, *self.server_address)
+            async with server:
+                await server.serve_forever()
         finally:
-            camera.stop_recording()
+            self.output.unsubscribe(self.notify)
+
+    def notify(self, seq):
+        """encoder thread: schedule one broadcast, frames arriving before it runs are coalesced into it"""
+        if not self.pending:
+            self.pending = True
+            self.loop.call_soon_threadsafe(self.broadcast)
+
+    def broadcast(self):
+        """copy the newest frame out of the ring, write it to the viewers of the source frames, and start encoding the
+        renditions other viewers asked for"""
+        self.pending = False
+        seq, frame = self.output.acquire(self.seq, timeout=0)
+        if frame is None: return
+        try:
+            keys = set(state[2] for state in self.viewers.values())
+            data = bytes(frame) if keys else None
+        finally:
+            self.output.release(frame)
+        self.seq = seq
+        for key in keys:
+            if key is None or Image is None:
+                self.send(seq, key, data)
+            elif key not in self.encoding:  # a rendition still encoding an older frame skips this one
+                self.encoding.add(key)
+                self.loop.create_task(self.render(seq, data, key))
+
+    async def render(self, seq, frame, key):
+        """encode frame seq in rendition key on an executor thread and send it, skip it if it cannot be encoded"""
+        try:
+            data = await self.loop.run_in_executor(None, self.cache.get, seq, frame, key)
+        except Exception as e:  # e.g. a frame PIL cannot decode
+            logging.warning('Skipped frame %d in rendition %s: %s', seq, key, e)
+            return
+        finally:
+            self.encoding.discard(key)
+        self.send(seq, key, data)
+
+    def send(self, seq, key, data):
+        """write frame seq in rendition key to its viewers with room in their transport buffer"""
+        header = 'Content-Type: image/jpeg\r\nContent-Length: {}\r\n\r\n'.format(len(data)).encode('ascii')
+        for writer, state in self.viewers.items():
+            if state[2] != key or state[0] >= seq or writer.transport.get_write_buffer_size() > self.max_buffer:
+                continue
+            writer.writelines((b'--FRAME\r\n', header, data, b'\r\n'))
+            if state[0]: state[1] += seq - state[0] - 1
+            state[0] = seq
+
+    async def client(self, reader, writer):
+        """answer requests until the client closes the connection, /stream.mjpg streams until the viewer disconnects"""
+        try:
+            while True:
+                lines = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+                method, target, version = (lines[0].split(' ') + ['', '', ''])[:3]
+                headers = dict((k.strip().lower(), v.strip()) for k, _, v in (line.partition(':') for line in lines[1:]))
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                if not await self.respond(reader, writer, method, urlsplit(target), headers, keep_alive): break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, reader, writer, method, target, headers, keep_alive):
+        """answer one request, return True if the connection stays open for another one"""
+        def reply(status, fields=(), content=b''):
+            fields = list(fields) + [('Content-Length', len(content))] + ([] if keep_alive else [('Connection', 'close')])
+            writer.write('HTTP/1.1 {}\r\n{}\r\n'.format(status, ''.join(
+                '{}: {}\r\n'.format(*field) for field in fields)).encode('latin-1') + content)
+            return keep_alive
+
+        path = target.path
+        if method == 'POST':
+            if path != '/preroll' or self.preroll is None: return reply('404 Not Found')
+            try:
+                seconds = float(parse_qs(target.query).get('seconds', [PREROLL_SECONDS])[0])
+            except ValueError:
+                return reply('400 Bad Request')
+            clip = await asyncio.get_running_loop().run_in_executor(None, self.preroll.trigger, seconds)
+            return reply('202 Accepted', [('Content-Type', 'application/json')], json.dumps({'clip': clip}).encode('utf-8'))
+        if path == '/':
+            return reply('301 Moved Permanently', [('Location', '/index.html')])
+        elif path == '/index.html':
+            return reply('200 OK', [('Content-Type', 'text/html')], PAGE.encode('utf-8'))
+        elif path == '/stats.json':
+            content = stream_stats(self.output, self.cache, self.capture, len(self.viewers))
+            return reply('200 OK', [('Content-Type', 'application/json')], content)
+        elif path not in ('/snapshot.jpg', '/stream.mjpg'):
+            return reply('404 Not Found')
+        try:
+            key = rendition(target.query)
+        except ValueError:
+            return reply('400 Bad Request')
+        if path == '/snapshot.jpg':
+            seq, content = await asyncio.get_running_loop().run_in_executor(
+                None, snapshot, self.output, self.capture, self.cache, key)
+            if content is None: return reply('503 Service Unavailable')
+            tag = etag(seq, key)
+            if tag == headers.get('if-none-match'):
+                writer.write('HTTP/1.1 304 Not Modified\r\nETag: {}\r\nCache-Control: no-cache\r\n{}\r\n'.format(
+                    tag, '' if keep_alive else 'Connection: close\r\n').encode('latin-1'))
+                return keep_alive
+            return reply('200 OK', [('Content-Type', 'image/jpeg'), ('ETag', tag), ('Cache-Control', 'no-cache')],
+                         content)
+        writer.write(b'HTTP/1.1 200 OK\r\nAge: 0\r\nCache-Control: no-cache, private\r\nPragma: no-cache\r\n'
+                     b'Content-Type: multipart/x-mixed-replace; boundary=FRAME\r\nConnection: close\r\n\r\n')
+        if self.capture is not None: await asyncio.get_running_loop().run_in_executor(None, self.capture.acquire)
+        state = self.viewers[writer] = [0, 0, key]
+        try:
+            while await reader.read(4096): pass
+        finally:
+            del self.viewers[writer]
+            if self.capture is not None: self.capture.release()
+        logging.warning('Removed streaming client %s, skipped %d frames', writer.get_extra_info('peername'), state[1])
+        return False
+
+
+if __name__ == '__main__':
+    from sys import argv
+    from frame_bus import FrameBusWriter
+    from preroll import PrerollRecorder, PrerollRing
+
+    options = argv[1:]
+    backend = FakeCameraBackend() if 'fake' in options else PiCameraBackend(resolution='800x600', framerate=30)
+    output = StreamingOutput()
+    grace = [float(option) for option in options if option.replace('.', '', 1).isdigit()]
+    capture = CaptureManager(backend, output, grace=grace[0] if grace else 5.0)
+    bus = FrameBusWriter(output, capture)
+    preroll = PrerollRecorder(output, PrerollRing(), capture) if 'preroll' in options else None
+    try:
+        address = ('0.0.0.0', 80)
+        server = AsyncStreamingServer(address, output, capture, preroll=preroll)
+        server.serve_forever()
+    finally:
+        if preroll is not None: preroll.close()
+        bus.close()
+        capture.close()
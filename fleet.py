@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fleet controller, commands several DiddyBorgs at once
+Every robot keeps one authenticated MotorController connection, opened on first use and reused by later calls. A
+broadcast runs the verb on every robot concurrently, each with its own timeout, so an unresponsive robot costs one
+timeout and never delays the others. A robot whose connection fails is reconnected on a later call, after a backoff
+that doubles with every consecutive failure.
+Example:
+from fleet import Fleet
+with Fleet(['192.168.1.21', '192.168.1.22:1092']) as fleet:
+    for name, result in fleet.set_velocity(0.5, 0.0): print(name, result)
+    fleet.set_velocity(0.0, 0.0)
+Usage:
+    fleet.py simulate [n]               -> broadcast to n local motor servers on a simulated PicoBorgRev, and one that
+                                           does not answer, sharing the token of a --token token option, see motor_server
+    fleet.py host[:port],... cmd [nums] -> RPC execute cmd(*nums) on every robot concurrently and print the results
+"""
+from concurrent.futures import ThreadPoolExecutor, wait
+from threading import Lock
+from time import monotonic
+
+from motor_client import PORT, AuthenticationError, MotorController
+
+TIMEOUT = 1.0  # seconds a robot has to connect or reply
+BACKOFF, MAX_BACKOFF = 0.5, 30.0  # seconds before the first reconnection attempt, and the most between attempts
+
+
+def robot_address(robot):
+    """return (host, port) of a 'host', 'host:port' or (host, port) robot"""
+    if isinstance(robot, tuple): return robot
+    host, _, port = robot.partition(':')
+    return host, int(port) if port else PORT
+
+
+class Robot(object):
+    """connection to the motor server of one robot, reconnected with backoff when it fails"""
+
+    def __init__(self, address, token=None, timeout=TIMEOUT, backoff=BACKOFF, max_backoff=MAX_BACKOFF):
+        """
+        :param address: (host, port) of the motor server
+        :param token: authkey of the motor server, default is read from /home/pi/.motor_server
+        :param timeout: seconds to connect or reply before the call fails and the connection is dropped
+        :param backoff: seconds to wait before reconnecting after the first failure, doubled by each further one
+        :param max_backoff: most seconds to wait before reconnecting
+        """
+        self.address, self.token, self.timeout = address, token, timeout
+        self.backoff, self.max_backoff = backoff, max_backoff
+        self.controller, self.lock = None, Lock()
+        self.delay, self.retry_at = 0.0, 0.0
+        self.connects = self.calls = self.failures = 0
+
+    def call(self, verb, args, kwargs):
+        """return the result of verb(*args, **kwargs) on the robot, or the exception it raised or that reaching the
+        robot raised"""
+        with self.lock:
+            try:
+                if self.controller is None:
+                    if monotonic() < self.retry_at:
+                        return IOError('{}:{} unreachable, retrying in {:.1f} s'.format(
+                            self.address[0], self.address[1], self.retry_at - monotonic()))
+                    self.controller = MotorController(self.address[0], self.address[1], self.token,
+                                                      timeout=self.timeout)
+                    self.connects += 1
+                self.calls += 1
+                result = self.controller.call(verb, args, kwargs)  # exceptions of the verb on the server are returned
+            except (IOError, EOFError, AuthenticationError) as e:  # includes socket.timeout, which leaves it out of step
+                self.failed()
+                return e
+            except Exception as e:  # e.g. arguments the wire format cannot encode
+                return e
+            self.delay = 0.0
+            return result
+
+    def failed(self):
+        """drop the connection and wait longer before the next attempt"""
+        self.failures += 1
+        if self.controller is not None:
+            try:
+                self.controller.connection.close()
+            except (IOError, EOFError):
+                pass
+        self.controller = None
+        self.delay = min(self.max_backoff, 2 * self.delay if self.delay else self.backoff)
+        self.retry_at = monotonic() + self.delay
+
+    @property
+    def stats(self):
+        """return whether the robot is connected, and its connections, calls and failures"""
+        return (('connected', self.controller is not None), ('connects', self.connects), ('calls', self.calls),
+                ('failures', self.failures))
+
+    def close(self):
+        """say bye to the motor server and drop the connection"""
+        with self.lock:
+            if self.controller is not None: self.controller.close()
+            self.controller = None
+
+
+class Fleet(object):
+    """pool of robot connections, verbs called on the fleet are broadcast to every robot
+    fleet.verb(*args, **kwargs) returns ((name, result), ...) in robot order, where result is what the robot returned
+    or the exception that it raised, or that reaching it raised
+    """
+
+    def __init__(self, robots, token=None, timeout=TIMEOUT, backoff=BACKOFF, max_backoff=MAX_BACKOFF):
+        """
+        :param robots: 'host', 'host:port' or (host, port) of each robot, or a dict of robot names to those
+        :param token: authkey shared by the motor servers, default is read from /home/pi/.motor_server
+        :param timeout: seconds each robot has to connect or reply
+        :param backoff: seconds before reconnecting to a robot after a failure, doubled by each further failure
+        :param max_backoff: most seconds between reconnection attempts
+        """
+        if not isinstance(robots, dict): robots = dict((str(robot), robot) for robot in robots)
+        self.robots = dict((name, Robot(robot_address(robot), token, timeout, backoff, max_backoff))
+                           for name, robot in robots.items())
+        self.names = sorted(self.robots)
+        self.executor = ThreadPoolExecutor(max_workers=len(self.robots), thread_name_prefix='fleet')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def broadcast(self, verb, *args, **kwargs):
+        """run verb(*args, **kwargs) on every robot concurrently, return ((name, result or exception), ...)"""
+        futures = [self.executor.submit(self.robots[name].call, verb, args, kwargs) for name in self.names]
+        wait(futures)  # every call is bounded by the robot timeout
+        return tuple((name, future.result()) for name, future in zip(self.names, futures))
+
+    def __getattr__(self, item):
+        """fleet.verb(*args, **kwargs) = broadcast(verb, *args, **kwargs)"""
+        if item.startswith('__'): raise AttributeError(item)
+        return lambda *args, **kwargs: self.broadcast(item, *args, **kwargs)
+
+    @property
+    def stats(self):
+        """return ((name, robot stats), ...)"""
+        return tuple((name, self.robots[name].stats) for name in self.names)
+
+    def close(self):
+        """close every robot connection"""
+        wait([self.executor.submit(self.robots[name].close) for name in self.names])
+        self.executor.shutdown()
+
+
+if __name__ == '__main__':
+    from sys import argv
+
+    if argv[1:2] == ['simulate']:
+        from socket import socket
+        from threading import Thread
+        from motor_server import MotorControlServer, SimulatedPicoBorgRev, simulation_args
+
+        args, token = simulation_args(argv[2:])
+        ports = range(19400, 19400 + (int(args[0]) if args else 3))
+        servers = [MotorControlServer('127.0.0.1', port, token=token, bus=SimulatedPicoBorgRev(0.0002), local=False)
+                   for port in ports]
+        for server in servers: Thread(target=server.start, daemon=True).start()
+        silent = socket()  # accepts connections but never answers the handshake
+        silent.bind(('127.0.0.1', 0))
+        silent.listen(8)
+        robots = ['127.0.0.1:{}'.format(port) for port in ports] + ['127.0.0.1:{}'.format(silent.getsockname()[1])]
+        with Fleet(robots, token, timeout=0.5) as fleet:
+            for verb, args in (('set_velocity', (0.5, 0.1)), ('get_velocity', ()), ('set_velocity', (0.0, 0.0))):
+                start = monotonic()
+                results = fleet.broadcast(verb, *args)
+                print('{}{} in {:.1f} ms'.format(verb, args, 1000 * (monotonic() - start)))
+                for name, result in results: print('    {0:<24s}{1}'.format(name, result))
+            for name, stats in fleet.stats: print('{0:<28s}{1}'.format(name, ' '.join('{}={}'.format(*s) for s in stats)))
+            fleet.stop()
+    elif len(argv) > 2:
+        with Fleet(argv[1].split(',')) as fleet:
+            for name, result in fleet.broadcast(argv[2], *[float(i) for i in argv[3:]]):
+                print('{0:<24s}{1}'.format(name, result))
+    else:
+        print(__doc__)
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared memory frame bus, camera frames for vision processes on the same Pi without HTTP
+The camera server copies each new frame into a named shared memory ring, and notifies connected readers of its
+sequence number over a unix seqpacket socket. A reader maps the ring and reads the newest frame in place.
+Ring layout:
+    header  - magic, version, slots, slot size, sequence number of the newest frame
+    slots   - per slot a seqlock generation (odd while being written, 2 x sequence number when complete), frame length
+              and monotonic timestamp, then the frame bytes
+Example:
+from frame_bus import FrameBusReader
+with FrameBusReader() as bus:
+    seq = 0
+    while True:
+        frame = bus.wait(seq)
+        if frame is None: continue
+        process(frame.data)  # memoryview into the ring, valid until the writer laps it
+        if frame.valid(): seq = frame.seq  # the frame was not overwritten while processing
+        frame.release()
+The ring and the socket are readable and writable by the owner and group of the writer, and when the writer runs as
+root, as the camera server does, they are handed to the pi group so vision processes need not run as root. The socket
+is made in SOCKET_DIR, which only the writer may write to, RuntimeDirectory=camera makes it for the camera service.
+Usage:
+    frame_bus.py read [name]    -> print sequence number, size and age of every frame published
+"""
+import grp
+import os
+import select
+import socket
+from multiprocessing import shared_memory
+from struct import Struct
+from threading import Lock, Thread
+from time import monotonic
+
+NAME = 'piborg-frames'  # shared memory name, the notification socket is SOCKET_DIR/<name>.sock
+SOCKET_DIR = '/run/camera'  # directory of the notification sockets, owned by the writer
+MODE, GROUP = 0o660, 'pi'  # permissions of the ring and the socket, and their group when the writer runs as root
+DIR_MODE = 0o750  # permissions of SOCKET_DIR, readers in its group may reach the sockets in it
+MAGIC, VERSION = b'PBFB', 1
+HEADER = Struct('<4sIIIQ')  # magic, version, slots, slot size, newest sequence number
+SLOT = Struct('<QId')  # generation, frame length, timestamp
+HEADER_SIZE = SLOT_HEADER_SIZE = 64  # frame bytes start cache line aligned
+NOTIFY = Struct('<Q')  # sequence number of a new frame
+SEQ_OFFSET = HEADER.size - NOTIFY.size
+
+
+def socket_path(name):
+    """return the notification socket path of bus name"""
+    return os.path.join(SOCKET_DIR, name + '.sock')
+
+
+def socket_dir(group):
+    """make SOCKET_DIR if there is none yet, and raise PermissionError unless the writer owns it and others may not
+    write to it, so no other user can replace the notification socket
+    :param group: group given the directory when running as root, None keeps root
+    """
+    try:
+        os.mkdir(SOCKET_DIR, DIR_MODE)
+    except FileExistsError:  # e.g. made by systemd RuntimeDirectory=camera
+        pass
+    status = os.stat(SOCKET_DIR)
+    if status.st_uid != os.geteuid() or status.st_mode & 0o022:
+        raise PermissionError('{} is not owned by {} or is writable by others'.format(SOCKET_DIR, os.geteuid()))
+    FrameBusWriter.share(SOCKET_DIR, DIR_MODE, group)
+
+
+class FrameBusWriter(object):
+    """publish every frame of a StreamingOutput into a shared memory ring and notify readers
+    Connected readers count as viewers of capture, so the camera records while a vision process is reading.
+    """
+
+    def __init__(self, output, capture=None, name=NAME, slots=4, slot_size=512 * 1024, mode=MODE, group=GROUP):
+        """
+        :param output: StreamingOutput to publish the frames of
+        :param capture: CaptureManager to hold while readers are connected, None if the camera always records
+        :param name: shared memory name
+        :param slots: frames in the ring, a reader has slots - 1 frame periods to use a frame in place
+        :param slot_size: largest frame published, larger frames are counted and skipped
+        :param mode: permissions of the ring and the socket, readers need read and write permission
+        :param group: group given the ring and the socket when running as root, None keeps root
+        """
+        self.output, self.capture, self.name = output, capture, name
+        self.slots, self.slot_size = slots, slot_size
+        socket_dir(group)
+        size = HEADER_SIZE + slots * (SLOT_HEADER_SIZE + slot_size)
+        try:
+            self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:  # left behind by a writer that crashed
+            shared_memory.SharedMemory(name).unlink()
+            self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+        self.share(os.path.join('/dev/shm', name), mode, group)
+        HEADER.pack_into(self.shm.buf, 0, MAGIC, VERSION, slots, slot_size, 0)
+        self.readers, self.lock = [], Lock()
+        self.published = self.oversized = 0
+        if os.path.exists(socket_path(name)): os.unlink(socket_path(name))
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.listener.bind(socket_path(name))
+        self.share(socket_path(name), mode, group)
+        self.listener.listen(8)
+        self.running = True
+        Thread(target=self.serve, daemon=True).start()
+        output.subscribe(self.notify)
+
+    @staticmethod
+    def share(path, mode, group):
+        """set the permissions of path, and its group if running as root and the group exists"""
+        os.chmod(path, mode)
+        if group is None or os.geteuid() != 0: return
+        try:
+            os.chown(path, -1, grp.getgrnam(group).gr_gid)
+        except KeyError:  # not on a Pi
+            pass
+
+    def notify(self, seq):
+        """encoder thread: copy frame seq into the ring and tell the readers"""
+        seq, frame = self.output.acquire(seq - 1, timeout=0)
+        if frame is None: return
+        try:
+            self.publish(seq, frame)
+        finally:
+            self.output.release(frame)
+
+    def publish(self, seq, frame, timestamp=None):
+        """copy frame into its slot under the seqlock and send its sequence number to every reader"""
+        if len(frame) > self.slot_size:
+            self.oversized += 1
+            return
+        buf, offset = self.shm.buf, HEADER_SIZE + (seq % self.slots) * (SLOT_HEADER_SIZE + self.slot_size)
+        SLOT.pack_into(buf, offset, 2 * seq + 1, 0, 0.0)
+        buf[offset + SLOT_HEADER_SIZE:offset + SLOT_HEADER_SIZE + len(frame)] = frame
+        SLOT.pack_into(buf, offset, 2 * seq, len(frame), monotonic() if timestamp is None else timestamp)
+        NOTIFY.pack_into(buf, SEQ_OFFSET, seq)
+        self.published += 1
+        message = NOTIFY.pack(seq)
+        with self.lock:
+            for reader in self.readers:
+                try:
+                    reader.send(message, socket.MSG_DONTWAIT)
+                except BlockingIOError:  # the reader has unread notifications, it will read the newest frame anyway
+                    pass
+                except OSError:  # gone, serve removes it
+                    pass
+
+    def serve(self):
+        """accept readers, and count them in and out of capture"""
+        while self.running:
+            with self.lock:
+                readers = list(self.readers)
+            try:
+                ready = select.select([self.listener] + readers, [], [], 1.0)[0]
+            except (OSError, ValueError):
+                break
+            for sock in ready:
+                if sock is self.listener:
+                    try:
+                        reader = self.listener.accept()[0]
+                    except OSError:  # closed
+                        break
+                    if self.capture is not None: self.capture.acquire()
+                    with self.lock:
+                        self.readers.append(reader)
+                elif not self.received(sock):
+                    with self.lock:
+                        if sock not in self.readers: continue  # disconnected by close
+                        self.readers.remove(sock)
+                    sock.close()
+                    if self.capture is not None: self.capture.release()
+
+    @staticmethod
+    def received(sock):
+        """return what reader sock sent, nothing once it is gone, reset if it left with notifications unread"""
+        try:
+            return sock.recv(16)
+        except OSError:
+            return b''
+
+    @property
+    def stats(self):
+        """return frames published, frames too large for a slot and connected readers"""
+        return {'published': self.published, 'oversized': self.oversized, 'readers': len(self.readers)}
+
+    def close(self):
+        """stop publishing, disconnect readers and remove the ring and the socket"""
+        self.output.unsubscribe(self.notify)
+        self.running = False
+        self.listener.close()
+        with self.lock:
+            for reader in self.readers:
+                reader.close()
+                if self.capture is not None: self.capture.release()
+            self.readers = []
+        os.unlink(socket_path(self.name))
+        self.shm.close()
+        self.shm.unlink()
+
+
+class Frame(object):
+    """a frame read in place from the ring"""
+
+    def __init__(self, bus, seq, timestamp, data):
+        self.bus, self.seq, self.timestamp, self.data = bus, seq, timestamp, data
+
+    def valid(self):
+        """return True if the writer has not started overwriting the frame, check after using data"""
+        return self.bus.generation(self.seq) == 2 * self.seq
+
+    def release(self):
+        """release the memoryview into the ring"""
+        self.data.release()
+
+
+class FrameBusReader(object):
+    """map the shared memory ring of a FrameBusWriter and read its newest frame without copying"""
+
+    def __init__(self, name=NAME):
+        """:param name: shared memory name of the bus"""
+        try:
+            self.shm = shared_memory.SharedMemory(name, track=False)
+        except TypeError:  # before python 3.13 attaching registers the segment, and the tracker unlinks it at exit
+            from multiprocessing import resource_tracker
+            self.shm = shared_memory.SharedMemory(name)
+            resource_tracker.unregister(self.shm._name, 'shared_memory')
+        magic, version, self.slots, self.slot_size, _ = HEADER.unpack_from(self.shm.buf, 0)
+        if (magic, version) != (MAGIC, VERSION): raise ValueError('{} is not a version {} frame bus'.format(name, VERSION))
+        self.notifications = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.notifications.connect(socket_path(name))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def generation(self, seq):
+        """return the seqlock generation of the slot of frame seq"""
+        return SLOT.unpack_from(self.shm.buf, HEADER_SIZE + (seq % self.slots) * (SLOT_HEADER_SIZE + self.slot_size))[0]
+
+    def newest(self):
+        """return the newest complete Frame, or None if nothing was published yet"""
+        buf = self.shm.buf
+        while True:
+            seq, = NOTIFY.unpack_from(buf, SEQ_OFFSET)
+            if not seq: return None
+            offset = HEADER_SIZE + (seq % self.slots) * (SLOT_HEADER_SIZE + self.slot_size)
+            generation, length, timestamp = SLOT.unpack_from(buf, offset)
+            if generation == 2 * seq:  # otherwise the writer lapped this slot since reading seq, read the header again
+                start = offset + SLOT_HEADER_SIZE
+                return Frame(self, seq, timestamp, buf[start:start + length])
+
+    def wait(self, after=0, timeout=None):
+        """block until a frame newer than sequence number after is published
+        :param after: sequence number of the last frame used
+        :param timeout: seconds to wait, None to wait forever
+        :return: the newest Frame, or None on timeout
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        while NOTIFY.unpack_from(self.shm.buf, SEQ_OFFSET)[0] <= after:
+            remaining = None if deadline is None else deadline - monotonic()
+            if remaining is not None and remaining <= 0: return None
+            if not select.select([self.notifications], [], [], remaining)[0]: return None
+            while True:  # drain, only the newest frame matters
+                try:
+                    if not self.notifications.recv(NOTIFY.size, socket.MSG_DONTWAIT): raise EOFError('frame bus closed')
+                except BlockingIOError:
+                    break
+        return self.newest()
+
+    def close(self):
+        """disconnect from the bus, release every Frame first"""
+        self.notifications.close()
+        self.shm.close()
+
+
+if __name__ == '__main__':
+    from sys import argv
+
+    if argv[1:2] == ['read']:
+        with FrameBusReader(*argv[2:3]) as bus:
+            last = 0
+            while True:
+                frame = bus.wait(last)
+                print('{:8d} {:8d} bytes {:6.1f} ms'.format(frame.seq, len(frame.data),
+                                                            1000 * (monotonic() - frame.timestamp)))
+                last = frame.seq
+                frame.release()
+    else:
+        print(__doc__)
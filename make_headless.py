@@ -13,12 +13,17 @@ StandardOutput=journal
 StandardError=journal
 Restart=always
 User={user}
-
+{runtime_directory}
 [Install]
 WantedBy=multi-user.target"""
 
+runtime_template = """RuntimeDirectory={runtime_directory}
+RuntimeDirectoryMode=0750
+"""
+
 
-def setup_service_unit(executable_file: str, exec_args: str = '', user: str = 'pi') -> None:
+def setup_service_unit(executable_file: str, exec_args: str = '', user: str = 'pi',
+                       runtime_directory: str = '') -> None:
     executable_file = path.abspath(executable_file)
     unit_name = path.splitext(path.basename(executable_file))[0]
     working_dir = path.dirname(executable_file)
@@ -26,7 +31,9 @@ def setup_service_unit(executable_file: str, exec_args: str = '', user: str = 'p
     chmod(executable_file, 0O755)
     with open(unit_file, 'w') as outfile:
         outfile.write(unit_template.format(exec_start=executable_file, exec_args=exec_args, unit_name=unit_name,
-                                           working_dir=working_dir, user=user))
+                                           working_dir=working_dir, user=user,
+                                           runtime_directory=runtime_directory and runtime_template.format(
+                                               runtime_directory=runtime_directory)))
     for cmd in ('enable', 'start', 'status'):
         system('/bin/systemctl {} {}'.format(cmd, unit_name))
     print('{unit_name} will start headless\nto view logs use journalctl -f -u {unit_name}.service --since now'.format(
@@ -60,9 +67,9 @@ if __name__ == '__main__':
 
     if len(argv) == 2:  # use defaults for targets
         targets = (
-            {'executable_file': 'motor_server.py', 'exec_args': 'start', },
+            {'executable_file': 'motor_server.py', 'exec_args': 'start', 'runtime_directory': 'motor_server'},
             {'executable_file': 'wiimote.py', 'exec_args': 'start-wii-controller'},
-            {'executable_file': 'camera.py', 'user': 'root', },
+            {'executable_file': 'camera.py', 'user': 'root', 'runtime_directory': 'camera'},
         )
     else:  # use command line arguments for targets
         targets = (
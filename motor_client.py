@@ -0,0 +1,515 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+""" Motor controller client for DiddyBorg
+The wire protocol and MotorController without the server, its i2c bus or its key setup, so clients start in
+milliseconds. Connections speak the multiprocessing.connection handshake and framing over a plain socket.
+Usage:
+    motor_client.py                 -> display CLI usage
+    motor_client.py help            -> display the commands of the Motor Control Server
+    motor_client.py metrics         -> print latency and throughput metrics of the Motor Control Server
+    motor_client.py cmd [nums]      -> RPC execute cmd(*nums) on Motor Control Server and print returned object
+    motor_client.py batch           -> execute the cmd [nums] lines read from stdin over one connection, print each result
+"""
+import hashlib
+from collections import OrderedDict
+from hmac import compare_digest, new as hmac_new
+from os import urandom
+from pickle import dumps, loads
+from socket import socket, create_connection, AF_INET, AF_UNIX, SOCK_DGRAM, SOCK_STREAM, IPPROTO_TCP, TCP_NODELAY
+from struct import Struct, error as StructError
+
+TIMEOUT = 20  # silence interval after which the server switches off the motors
+IP, PORT = '0.0.0.0', 1092  # Default address on which to listen for drive commands
+UDP_PORT = 1092  # Default udp port of the drive channel, when enabled
+LOCAL_HOSTS = ('', '0.0.0.0', '127.0.0.1', 'localhost', '::1')  # addresses of a server on the same Pi
+SOCKET_DIR = '/run/motor_server'  # directory of the unix sockets, owned by the server user
+PROTOCOL_PICKLE, PROTOCOL_BINARY, PROTOCOL_PIPELINE = 0, 1, 2  # wire protocols, each includes the previous ones
+PICKLE_PROTOCOL = 2  # highest pickle protocol python2 clients can load
+OPCODE, SEQ = Struct('!B'), Struct('!I')  # binary frames start with an opcode, pipelined frames follow it with a seq
+SEQUENCED, NO_ACK, OP_ERROR = 0x40, 0x20, 0x1f  # opcode flags of pipelined requests, reply opcode of an exception
+FRAMES = {  # binary opcode: (verb, request parameters, request format, reply format, values of a reply, reply of values)
+    1: ('set_velocity', ('linear', 'angular'), 'dd', 'ddhh',
+        lambda reply: (reply[0][1], reply[1][1], reply[2][1], reply[3][1]),
+        lambda linear, angular, a, b: (('linear', linear), ('angular', angular), ('motorA', a), ('motorB', b))),
+    2: ('set_led', ('on_off_num',), 'd', 'B', lambda reply: (LED_VALUES[reply[0][1]],),
+        lambda led: (('led', LED_STATES[led]),)),
+    3: ('get_velocity', (), '', 'hh', lambda reply: (reply[0][1], reply[1][1]),
+        lambda a, b: (('motorA', a), ('motorB', b))),
+}
+OPCODES = dict((frame[0], opcode) for opcode, frame in FRAMES.items())
+ENCODERS = dict((frame[0], (opcode, frame[1], Struct('!B' + frame[2]).pack, Struct('!BI' + frame[2]).pack))
+                for opcode, frame in FRAMES.items())  # verb: (opcode, parameters, pack frame, pack pipelined frame)
+# opcode byte: (opcode, verb, unpack, frame size, flags, ack) of each request frame
+REQUESTS = dict((OPCODE.pack(opcode | flags), (opcode, frame[0], Struct(('!I' if flags else '!') + frame[2]).unpack_from,
+                                               Struct(('!BI' if flags else '!B') + frame[2]).size, flags,
+                                               not flags & NO_ACK))
+                for opcode, frame in FRAMES.items() for flags in (0, SEQUENCED, SEQUENCED | NO_ACK))
+REPLY_ENCODERS = dict((opcode, (frame[4], Struct('!B' + frame[3]).pack, Struct('!BI' + frame[3]).pack))
+                      for opcode, frame in FRAMES.items())  # opcode: (values of a reply, pack reply, pack pipelined)
+REPLIES = dict((OPCODE.pack(opcode | flags), (frame[5], Struct(('!I' if flags else '!') + frame[3]).unpack_from, flags))
+               for opcode, frame in FRAMES.items() for flags in (0, SEQUENCED))  # opcode byte: (reply, unpack, flags)
+DRIVE, DRIVE_MAC = Struct('!QQdd'), 16  # udp drive datagram: session, seq, linear, angular, and truncated HMAC size
+ERRORS = OPCODE.pack(OP_ERROR), OPCODE.pack(OP_ERROR | SEQUENCED)
+DEFAULTS = {'set_velocity': {'angular': 0.0}}  # default values of optional request parameters
+LED_STATES, LED_VALUES = ('OFF', 'ON'), {'OFF': 0, 'ON': 1}  # led state names, binary frames carry their index
+AUTH_KEY_FILE = '/home/pi/.motor_server'  # Default authkey for the connection, created by the server
+CHALLENGE, WELCOME, FAILURE = b'#CHALLENGE#', b'#WELCOME#', b'#FAILURE#'  # multiprocessing.connection handshake
+MESSAGE_LENGTH, MD5_LENGTH = 20, 16  # legacy challenge and HMAC-MD5 response lengths, understood by every peer
+DIGESTS = (b'md5', b'sha256', b'sha384', b'sha3_256', b'sha3_384')  # digests a {digest} prefixed message may use
+LENGTH, LONG_LENGTH = Struct('!i'), Struct('!Q')  # message length prefix, and the length of messages over 2 GiB
+
+
+def authkey(token):
+    """return token as the bytes authkey expected by multiprocessing.connection"""
+    return token if isinstance(token, bytes) else token.encode('utf-8')
+
+
+def encode_request(verb, args, kwargs, seq=None, ack=True):
+    """return the binary frame of a verb(*args, **kwargs) request, or None if it has to be pickled
+    pipelined requests carry seq, and ask for no reply when ack is False
+    """
+    encoder = ENCODERS.get(verb)
+    if encoder is None: return None
+    opcode, params, pack, pack_pipelined = encoder
+    if kwargs or len(args) != len(params):
+        values = dict(DEFAULTS.get(verb, {}), **kwargs)
+        values.update(zip(params, args))
+        if len(args) > len(params) or set(values) != set(params): return None
+        args = [values[p] for p in params]
+    try:
+        if seq is None: return pack(opcode, *args)
+        return pack_pipelined(opcode | (SEQUENCED if ack else SEQUENCED | NO_ACK), seq, *args)
+    except (StructError, TypeError):
+        return None
+
+
+def decode_request(data):
+    """return (opcode, seq, ack, verb, args, kwargs) of a binary or pickled request
+    opcode is None for pickled requests, seq is None for requests that are not pipelined
+    pipelined pickled requests are (seq, ack, verb, args, kwargs) tuples
+    """
+    frame = REQUESTS.get(data[:1])
+    if frame is None or len(data) != frame[3]:
+        request = loads(data)
+        return (None, None, True) + request if len(request) == 3 else (None,) + request
+    opcode, verb, unpack, size, flags, ack = frame
+    values = unpack(data, 1)
+    if flags: return opcode, values[0], ack, verb, values[1:], {}
+    return opcode, None, True, verb, values, {}
+
+
+def encode_reply(opcode, seq, result):
+    """return the reply frame carrying the result object or exception of a request decoded by decode_request"""
+    if opcode is None: return dumps(result if seq is None else (seq, result), PICKLE_PROTOCOL)
+    if not isinstance(result, Exception):
+        try:
+            values, pack, pack_pipelined = REPLY_ENCODERS[opcode]
+            if seq is None: return pack(opcode, *values(result))
+            return pack_pipelined(opcode | SEQUENCED, seq, *values(result))
+        except (StructError, TypeError, LookupError) as e:
+            result = e
+    if seq is None: return ERRORS[0] + dumps(result, PICKLE_PROTOCOL)
+    return ERRORS[1] + SEQ.pack(seq) + dumps(result, PICKLE_PROTOCOL)
+
+
+def decode_reply(data, sequenced=False):
+    """return (seq, result) of a reply frame, result is an object or exception, seq is None if not pipelined
+    pickled replies are (seq, result) tuples when sequenced, otherwise the result
+    """
+    frame = REPLIES.get(data[:1])
+    if frame is not None:
+        reply, unpack, flags = frame
+        values = unpack(data, 1)
+        if flags: return values[0], reply(*values[1:])
+        return None, reply(*values)
+    if data[:1] == ERRORS[0]: return None, loads(data[1:])
+    if data[:1] == ERRORS[1]: return SEQ.unpack(data[1:5])[0], loads(data[5:])
+    return loads(data) if sequenced else (None, loads(data))
+
+
+def drive_key(token):
+    """return the HMAC key of udp drive datagrams, derived from token"""
+    return hmac_new(authkey(token), b'motor_server udp drive', hashlib.sha256).digest()
+
+
+def encode_drive(key, session, seq, linear, angular):
+    """return the authenticated udp drive datagram of set_velocity(linear, angular)"""
+    data = DRIVE.pack(session, seq, linear, angular)
+    return data + hmac_new(key, data, hashlib.sha256).digest()[:DRIVE_MAC]
+
+
+def decode_drive(key, data):
+    """return (session, seq, linear, angular) of a udp drive datagram, or None if it is malformed or not authentic"""
+    if len(data) != DRIVE.size + DRIVE_MAC: return None
+    mac = hmac_new(key, data[:DRIVE.size], hashlib.sha256).digest()[:DRIVE_MAC]
+    if not compare_digest(mac, data[DRIVE.size:]): return None
+    return DRIVE.unpack(data[:DRIVE.size])
+
+
+class AuthenticationError(Exception):
+    """the server rejected the token, or failed to prove it holds it"""
+
+
+def load_token(path=AUTH_KEY_FILE):
+    """return the token saved in path by the Motor Control Server"""
+    with open(path, 'r') as auth_file: return auth_file.read().replace('\n', '')
+
+
+def unix_socket_path(port):
+    """return the path of the unix socket of the server listening on tcp port, for clients on the same Pi, in
+    SOCKET_DIR where only the user of the server may create it"""
+    return '{}/motor_server-{}.sock'.format(SOCKET_DIR, port)
+
+
+def split_digest(message):
+    """return digest name and payload of a handshake message, legacy messages have no {digest} prefix and use md5"""
+    if len(message) in (MESSAGE_LENGTH, MD5_LENGTH):
+        return 'md5', message
+    end = message.find(b'}', 1, max(len(d) for d in DIGESTS) + 2)
+    if message.startswith(b'{') and message[1:end] in DIGESTS:
+        return message[1:end].decode('ascii'), message[end + 1:]
+    raise AuthenticationError('unsupported digest in handshake')
+
+
+def connect(address, key, timeout=None):
+    """return a SocketConnection to a Listener at address, after both sides proved they hold key
+    Same handshake as multiprocessing.connection.Client, without importing multiprocessing
+    :param timeout: seconds each socket operation may take, also of the connection later, None to wait forever
+    """
+    sock = create_connection(address, timeout)
+    sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+    conn = SocketConnection(sock)
+    try:
+        conn.answer_challenge(key)
+        conn.deliver_challenge(key)
+    except:
+        conn.close()
+        raise
+    return conn
+
+
+def connect_unix(path, timeout=None):
+    """return a SocketConnection to the unix socket of a server on the same Pi, which lets the client in by its user
+    or group instead of a token, timeout as for connect"""
+    sock = socket(AF_UNIX, SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+    except:
+        sock.close()
+        raise
+    conn = SocketConnection(sock)
+    if conn.recv_bytes(256) != WELCOME:
+        conn.close()
+        raise AuthenticationError('the server does not let this user in over {}'.format(path))
+    return conn
+
+
+class SocketConnection(object):
+    """multiprocessing.connection.Connection framing (4 byte length prefix and pickle) over a blocking socket"""
+
+    def __init__(self, sock):
+        self.sock, self.reader = sock, sock.makefile('rb')
+
+    def __read__(self, size):
+        data = self.reader.read(size)
+        if len(data) < size: raise EOFError('connection closed')
+        return data
+
+    def recv_bytes(self, maxlength=None):
+        """receive one length prefixed message"""
+        size, = LENGTH.unpack(self.__read__(LENGTH.size))
+        if size == -1: size, = LONG_LENGTH.unpack(self.__read__(LONG_LENGTH.size))
+        if maxlength is not None and size > maxlength: raise IOError('bad message length')
+        return self.__read__(size)
+
+    def recv(self):
+        """receive one pickled object"""
+        return loads(self.recv_bytes())
+
+    def send_bytes(self, buf):
+        """send one length prefixed message"""
+        header = LENGTH.pack(len(buf)) if len(buf) <= 0x7fffffff else LENGTH.pack(-1) + LONG_LENGTH.pack(len(buf))
+        self.sock.sendall(header + buf)
+
+    def send(self, obj):
+        """send one pickled object"""
+        self.send_bytes(dumps(obj, PICKLE_PROTOCOL))
+
+    def close(self):
+        """close the socket"""
+        self.reader.close()
+        self.sock.close()
+
+    def deliver_challenge(self, key):
+        """challenge the server to prove it holds key, raise AuthenticationError if it does not"""
+        message = urandom(MESSAGE_LENGTH)
+        self.send_bytes(CHALLENGE + message)
+        digest, response = split_digest(self.recv_bytes(256))
+        if not compare_digest(hmac_new(key, message, getattr(hashlib, digest)).digest(), response):
+            self.send_bytes(FAILURE)
+            raise AuthenticationError('digest received was wrong')
+        self.send_bytes(WELCOME)
+
+    def answer_challenge(self, key):
+        """answer the challenge of the server, raise AuthenticationError if it does not welcome the answer"""
+        message = self.recv_bytes(256)
+        if not message.startswith(CHALLENGE): raise AuthenticationError('message = {!r}'.format(message))
+        message = message[len(CHALLENGE):]
+        digest = split_digest(message)[0]
+        response = hmac_new(key, message, getattr(hashlib, digest)).digest()
+        self.send_bytes(response if len(message) == MESSAGE_LENGTH else b'{' + digest.encode('ascii') + b'}' + response)
+        if self.recv_bytes(256) != WELCOME: raise AuthenticationError('digest sent was rejected')
+
+
+class PendingReply(object):
+    """Reply to a request sent by a pipelined MotorController, result() waits for it"""
+
+    def __init__(self, controller, seq):
+        self.controller, self.seq = controller, seq
+        self.value, self.__done__ = None, False
+
+    def resolve(self, value):
+        """set the result object or exception received for the request"""
+        self.value, self.__done__ = value, True
+
+    def done(self):
+        """return True when the reply has been received"""
+        return self.__done__
+
+    def result(self):
+        """wait for the reply and return the received object or raise the received exception"""
+        while not self.__done__: self.controller.__receive__()
+        if isinstance(self.value, Exception): raise self.value
+        return self.value
+
+
+class MotorController(object):
+    """Client for Motor Control Server for DiddyBorg
+    Example:
+    from motor_client import MotorController
+    try:
+        list_steps = [(1.0,0),(-1.0,0),(0,1.0),(0,-1.0),(0,0)] # forward, reverse, spin clockwise, spin counter, stop
+        with MotorController() as mc:
+            mc.set_led(1)
+            for linear, angular in list_steps:
+                mc.set_velocity(linear, angular)
+                time.sleep(1)
+            mc.set_led(0)
+    Except Exception as e:
+        print(e.msg)
+
+    Example: the same steps timed by the server, one second each, without drift
+    from motor_client import MotorController
+    with MotorController() as mc:
+        mc.run_sequence([(1.0, 0, 1), (-1.0, 0, 1), (0, 1.0, 1), (0, -1.0, 1)])
+        while dict(mc.sequence_status())['running']: time.sleep(1)
+
+    Example:
+    from motor_client import MotorController
+    remote_host='192.168.1.1'
+    token='shared authToken'
+    try:
+        with MotorController(remote_host, 1092, token) as mc:
+            print(mc.help())
+            mc.set_velocity(0.0,0.0)
+    Except Exception as e:
+        print(e.msg)
+
+    Example: pipelined, calls return a PendingReply without waiting for the server, set_velocity is not acknowledged
+    from motor_client import MotorController
+    with MotorController(pipelined=True, ack_velocity=False) as mc:
+        for i in range(100):
+            mc.set_velocity(i / 100.0, 0.0)
+            time.sleep(0.01)
+        velocity = mc.get_velocity()
+        print(velocity.result())
+
+    Example: on the Pi of the server, the connection is made over a unix socket, without the token handshake
+    from motor_client import MotorController
+    with MotorController('localhost') as mc:
+        mc.set_velocity(0.5, 0.0)
+
+    Example: set_velocity over the udp drive channel, latest command wins
+    from motor_client import MotorController
+    with MotorController(udp_port=UDP_PORT) as mc:
+        mc.drive(0.5, 0.0)
+    """
+
+    def __init__(self, ip_address=IP, ip_port=PORT, token=None, protocol=PROTOCOL_BINARY, pipelined=False,
+                 ack_velocity=True, window=64, udp_port=None, local=True, timeout=None):
+        """connect to Motor Control Server at ip_address:ip_port using AuthKey token
+        :param ip_address: IP address (localhost or external IP address), default is 127.0.0.1
+        :param ip_port: port number, default is 1092
+        :param token: authkey, default is read from /home/pi/.motor_server
+        :param protocol: highest wire protocol to negotiate, default is PROTOCOL_BINARY, falls back to PROTOCOL_PICKLE
+        :param pipelined: send requests without waiting for the reply, calls return a PendingReply, default is False
+                          negotiates PROTOCOL_PIPELINE, falls back to waiting for each reply
+        :param ack_velocity: whether pipelined set_velocity requests are acknowledged (return a PendingReply) or not
+                             (return None), default is True
+        :param window: most pipelined requests awaiting a reply, further calls wait for the oldest, default is 64
+        :param udp_port: udp port of the server drive channel used by drive(), default is None (no udp drive channel)
+        :param local: whether to connect over the unix socket of a server on the same Pi, falling back to tcp if it
+                      is not there or does not let this user in, default is True
+        :param timeout: seconds to wait for the server to connect or reply before raising socket.timeout, the
+                        connection is unusable after a timeout, default is None (wait forever)
+        """
+        self.protocol, self.pipelined = PROTOCOL_PICKLE, False
+        self.__udp__, self.connection = None, None
+        if local and ip_address in LOCAL_HOSTS:
+            try:
+                self.connection = connect_unix(unix_socket_path(ip_port), timeout)
+            except (IOError, EOFError, AuthenticationError):  # no unix socket, or not let in over it
+                pass
+        if token is None and (self.connection is None or udp_port is not None):
+            try:
+                token = load_token()
+            except IOError as e:
+                e.msg = 'failed to read the token, the server saves the default token at {}'.format(AUTH_KEY_FILE)
+                raise
+        if udp_port is not None:
+            self.__udp__, self.__udp_address__ = socket(AF_INET, SOCK_DGRAM), (ip_address, udp_port)
+            self.__drive_key__, self.__drive_seq__ = drive_key(token), 0
+        self.__seq__, self.__pending__ = 0, OrderedDict()
+        self.__ack_velocity__, self.__window__ = ack_velocity, window
+        try:
+            if self.connection is None: self.connection = connect((ip_address, ip_port), authkey(token), timeout)
+        except AuthenticationError as e:
+            e.msg = 'failed to authenticate, check the token used by the client is the same as that used by the server ... default token is saved at /home/pi/.motor_server'
+            raise
+        except IOError as e:
+            e.msg = 'failed to connect to the server, default server is 127.0.0.1:1092'
+            raise
+        if pipelined: protocol = max(protocol, PROTOCOL_PIPELINE)
+        if protocol > PROTOCOL_PICKLE:
+            try:
+                self.protocol = dict(self.__getattr__('protocol')(protocol))['protocol']
+            except KeyError:  # server without protocol negotiation
+                pass
+        if udp_port is not None: self.__session__ = dict(self.__getattr__('drive_session')())['session']
+        self.pipelined = pipelined and self.protocol >= PROTOCOL_PIPELINE
+
+    def __enter__(self):
+        """definition of __enter__ for use by context mangaer"""
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """definition of __exit__ for use by context manager"""
+        return self.close()
+
+    def close(self):
+        """close connection with Motor Control Server and return False"""
+        try:
+            if self.__udp__ is not None: self.__udp__.close()
+            self.connection.send(('bye', None, None))
+            self.connection.close()
+        except:
+            pass
+        finally:
+            return False
+
+    def drive(self, linear, angular=0.0):
+        """send set_velocity(linear, angular) over the udp drive channel, without reply; the server applies only the
+        newest command received, so a late datagram never overrides a newer one, and only of the drive session it
+        issued to this controller, so datagrams captured before a server restart are not replayed"""
+        if self.__udp__ is None: raise IOError('no udp drive channel, connect with udp_port')
+        self.__drive_seq__ += 1
+        self.__udp__.sendto(encode_drive(self.__drive_key__, self.__session__, self.__drive_seq__, linear, angular),
+                            self.__udp_address__)
+
+    def __getattr__(self, item):
+        """custom attribute getter
+        attribute(args) = RPC(args)
+        RPC: send attribute and arguments to Motor Control Server over connection and return received object or raise received exception
+        """
+
+        def attribute(*args, **kwargs):
+            val = self.call(item, args, kwargs)
+            if isinstance(val, Exception): raise val
+            return val
+
+        return attribute
+
+    def call(self, verb, args=(), kwargs=None):
+        """RPC verb(*args, **kwargs) and return the received object, or the received exception without raising it, so
+        that what is raised always comes from the connection; pipelined, return the PendingReply"""
+        kwargs = {} if kwargs is None else kwargs
+        if self.pipelined: return self.__send__(verb, args, kwargs)
+        frame = encode_request(verb, args, kwargs) if self.protocol >= PROTOCOL_BINARY else None
+        if frame is None:
+            self.connection.send((verb, args, kwargs))
+            return self.connection.recv()
+        self.connection.send_bytes(frame)
+        return decode_reply(self.connection.recv_bytes())[1]
+
+    def __send__(self, verb, args, kwargs):
+        """send a pipelined request, return its PendingReply or None when it is not acknowledged"""
+        while len(self.__pending__) >= self.__window__: self.__receive__()
+        self.__seq__ = (self.__seq__ + 1) & 0xffffffff
+        ack = self.__ack_velocity__ or verb != 'set_velocity'
+        frame = encode_request(verb, args, kwargs, self.__seq__, ack)
+        if frame is None:
+            self.connection.send((self.__seq__, ack, verb, args, kwargs))
+        else:
+            self.connection.send_bytes(frame)
+        if ack:
+            self.__pending__[self.__seq__] = PendingReply(self, self.__seq__)
+            return self.__pending__[self.__seq__]
+
+    def __receive__(self):
+        """receive one pipelined reply and resolve its PendingReply"""
+        seq, val = decode_reply(self.connection.recv_bytes(), sequenced=True)
+        self.__pending__.pop(seq).resolve(val)
+
+    def flush(self):
+        """wait for the replies to all pipelined requests, return their objects or exceptions in request order"""
+        pending = list(self.__pending__.values())
+        while self.__pending__: self.__receive__()
+        return tuple(reply.value for reply in pending)
+
+
+def cli(args):
+    """print the result of the Motor Control Server command in args, e.g. ['set_velocity', '0.5'], 'help' and
+    'metrics' are formatted one item per line, 'batch' runs the commands on the lines of stdin over one connection"""
+    try:
+        with MotorController() as m:
+            if args[0] == 'batch':
+                from sys import stdin, stdout
+                for line in iter(stdin.readline, ''):
+                    if line.split() and not line.startswith('#'): command(m, line.split())
+                    stdout.flush()
+            else:
+                command(m, args)
+    except Exception as e:
+        print(str(e))
+
+
+def command(m, args):
+    """print the result of args run on MotorController m, or the exception raised"""
+    try:
+        if args[0] in ('h', '-h', 'help'):
+            for item in m.help(): print('    {0:<30s}-> {1}'.format(*item))
+        elif args[0] == 'metrics':
+            for name, value in m.metrics():
+                if name == 'verbs':
+                    print(name)
+                    for verb, stats in value: print('    {0:<28s}{1}'.format(verb, ' '.join('{}={}'.format(*s) for s in stats)))
+                elif isinstance(value, tuple):
+                    print('{0:<32s}{1}'.format(name, ' '.join('{}={}'.format(*s) for s in value)))
+                else:
+                    print('{0:<32s}{1}'.format(name, value))
+        else:
+            print(getattr(m, args[0])(*[float(i) for i in args[1:]]))
+    except (EOFError, IOError):  # connection lost
+        raise
+    except Exception as e:
+        print(str(e))
+
+
+if __name__ == '__main__':
+    from sys import argv
+
+    if len(argv) == 1:
+        print(__doc__)
+    else:
+        cli(argv[1:])
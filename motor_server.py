@@ -1,15 +1,45 @@
 #!/usr/bin/env python2
 # -*- coding: utf-8 -*-
-""" Motor controller module for DiddyBorg """
-from multiprocessing.connection import Listener, Client, AuthenticationError
-from os import getpid, path, system
+""" Motor controller module for DiddyBorg
+The server side, the wire protocol and MotorController live in motor_client and are re-exported here
+"""
+from base64 import b64encode
+from collections import OrderedDict
+from errno import EEXIST
+from multiprocessing.connection import Listener, AuthenticationError
+from os import (O_CREAT, O_EXCL, O_WRONLY, chmod, fdopen, getgid, getpid, getuid, mkdir, open as os_open, path, stat,
+                unlink, urandom)
 from signal import signal, SIGTERM
-from threading import Thread, Event, active_count
+from socket import (socket, AF_INET, AF_UNIX, SOCK_DGRAM, SOCK_STREAM, SOL_SOCKET, error as SocketError,
+                    timeout as SocketTimeout)
+from struct import Struct
+from threading import Thread, Event, Lock, active_count
+from math import sqrt
+from time import sleep
 
-from smbus import SMBus
+try:
+    from time import monotonic
+except ImportError:  # python2
+    from time import time as monotonic
+try:
+    from socket import SO_PEERCRED
+except ImportError:  # python2
+    SO_PEERCRED = 17  # linux value
+
+from motor_client import (AUTH_KEY_FILE, DEFAULTS, DRIVE, DRIVE_MAC, FAILURE, FRAMES, IP, LED_STATES, LED_VALUES,
+                          OPCODES, PICKLE_PROTOCOL, PORT, PROTOCOL_BINARY, PROTOCOL_PICKLE, PROTOCOL_PIPELINE, TIMEOUT,
+                          UDP_PORT, WELCOME, MotorController, PendingReply, SocketConnection, authkey, decode_drive,
+                          decode_reply, decode_request, drive_key, encode_drive, encode_reply, encode_request, load_token,
+                          unix_socket_path)
+from telemetry_log import MOTOR_LOG, TelemetryLog
 
 I2CBUS, I2CADDRESS = 1, 0x44  # i2cbus number and address of the PiBorgReverse (PBR) board
-HEARTBEAT, TIMEOUT = 0.2, 20  # Time interval to send heartbeat to PBR and silence interval before switching off motors
+HEARTBEAT = 0.2  # Time interval to send heartbeat to PBR, motors are switched off after TIMEOUT of silence
+LEASE_VERBS = ('lease',)  # verbs passed the Lease of the calling client
+MOTION_VERBS = ('set_velocity', 'set_target_velocity', 'run_sequence')  # verbs whose caller owns the motor commands
+CONTROL_RATE = 50  # steps per second of a motion profile towards a target velocity
+SEQUENCE_STEPS = 1000  # most steps in a run_sequence upload
+ACCEL, JERK = 2.0, 20.0  # default limits of motion profiles, in full scale velocity per second and per second squared
 PWM_MAX = int(255.0 * 12.0 / 18.0)  # Max value of PWM to scale down 18 V input to max 12 V
 I2C_MAX_LEN = 4  # Max length of PBR response
 I2C_ID_PICOBORG_REV = 0x15  # PBR identifer value
@@ -21,20 +51,20 @@ GET_A = 5  # Get motor 2 direction and PWM rate
 SET_B_FWD = 6  # Set motor 1 PWM rate in a forwards direction
 SET_B_REV = 7  # Set motor 1 PWM rate in a reverse direction
 GET_B = 8  # Get motor 1 direction and PWM rate
+GET_EPO = 9  # Get the EPO latched flag
 RESET_EPO = 10  # Resets the EPO flag, use after EPO has been tripped and switch is now clear
 SET_FAILSAFE = 17  # Set the failsafe flag, turns the motors off if communication is interrupted
 GET_FAILSAFE = 18  # Get the failsafe flag
 GET_ID = 0x99  # Get the board identifier
+FAILSAFE_TIMEOUT = 0.25  # PBR switches the motors off when the failsafe is set and no command arrives in this interval
 A_DIR = (0, -1, 1)
 B_DIR = (0, 1, -1)
+REGISTERS = {SET_A_FWD: GET_A, SET_A_REV: GET_A, SET_B_FWD: GET_B, SET_B_REV: GET_B, SET_LED: GET_LED}  # write -> state
+OFF_CMDS = (SET_A_FWD, 0), (SET_B_FWD, 0), (SET_LED, 0)  # motor A, motor B and LED switched off
 
-IP, PORT = '0.0.0.0', 1092  # Default address on which to listen for drive commands
-AUTH_KEY_FILE = '/home/pi/.motor_server'  # Default authkey for the connection
-if not path.exists(AUTH_KEY_FILE):
-    system('/usr/bin/openssl rand -base64 -out {} 512'.format(AUTH_KEY_FILE))
-with open(AUTH_KEY_FILE, 'r') as auth_file: TOKEN = auth_file.read().replace('\n', '')
-
-i2c_bus = SMBus(I2CBUS)  # i2c bus used
+DRIVE_SESSIONS = 64  # udp drive sessions accepted, the most recently used, whose last seq is remembered
+SESSION = Struct('!Q')  # udp drive session number
+PEERCRED = Struct('3i')  # pid, uid and gid of the peer of a unix socket
 
 
 def is_norm_one(n):
@@ -42,24 +72,579 @@ def is_norm_one(n):
     return -1.0 <= n <= 1.0
 
 
+def server_token(path=AUTH_KEY_FILE):
+    """return the token saved in path, saving a random one only the owner may read if there is none yet"""
+    try:
+        fd = os_open(path, O_WRONLY | O_CREAT | O_EXCL, 0o600)
+    except OSError as e:
+        if e.errno != EEXIST: raise
+    else:
+        with fdopen(fd, 'w') as auth_file: auth_file.write(b64encode(urandom(512)).decode('ascii') + '\n')
+    return load_token(path)
+
+
+def simulation_args(args):
+    """return args without a --token option, and the token of a simulated server: that of the option, else the saved
+    token, else a random one, printed for the clients, e.g. off the Pi where there is no /home/pi to save it in"""
+    args = list(args)
+    if '--token' in args:
+        index = args.index('--token')
+        return args[:index] + args[index + 2:], args[index + 1]
+    try:
+        return args, server_token()
+    except (IOError, OSError):
+        token = b64encode(urandom(24)).decode('ascii')
+        print('token {}'.format(token))
+        return args, token
+
+
+def local_socket_dir(local):
+    """return True if the directory of unix socket path local is owned by the server and other users may not write to
+    it, making it with mode 0750 if there is none yet, False if it cannot be made, e.g. in /run without root, where a
+    systemd RuntimeDirectory=motor_server makes it for the server user"""
+    directory = path.dirname(local)
+    try:
+        mkdir(directory, 0o750)
+    except OSError as e:
+        if e.errno != EEXIST: return False
+    status = stat(directory)
+    return status.st_uid == getuid() and not status.st_mode & 0o022
+
+
+def local_peer(sock):
+    """return True if the peer of unix socket sock runs as root, or as the user or in the group of the server"""
+    pid, uid, gid = PEERCRED.unpack(sock.getsockopt(SOL_SOCKET, SO_PEERCRED, PEERCRED.size))
+    return uid in (0, getuid()) or gid == getgid()
+
+
+def signed_pwm(cmd):
+    """return the PWM of a motor command, negative in reverse"""
+    return -cmd[1] if cmd[0] in (SET_A_REV, SET_B_REV) else cmd[1]
+
+
 def norm_pwm(duty_factor):
     """return int duty_factor bounded within ± Maximum Pulse Width Modulatin"""
     return int(min(max(duty_factor, -PWM_MAX), PWM_MAX))
 
 
-def read_i2c(offset):
-    """read block of data at address given by 'offset' from PicoBorgRev module"""
-    return i2c_bus.read_i2c_block_data(I2CADDRESS, offset, I2C_MAX_LEN)
+class SMBusBackend(object):
+    """PicoBorgRev module on an i2c bus, accessed through smbus"""
+
+    def __init__(self, bus=I2CBUS, address=I2CADDRESS):
+        """:param bus: i2c bus number, default is 1
+        :param address: i2c address of the PicoBorgRev, default is 0x44
+        """
+        try:
+            from smbus import SMBus
+        except ImportError:
+            raise ImportError('smbus is not installed, use SimulatedPicoBorgRev off the robot')
+        self.__bus__, self.__address__ = SMBus(bus), address
 
+    def read(self, offset):
+        """read block of data at address given by 'offset' from PicoBorgRev module"""
+        return self.__bus__.read_i2c_block_data(self.__address__, offset, I2C_MAX_LEN)
 
-def write_i2c(offset, byteVal):
-    """write byte given by 'byteVal' to PicoBorgRev module at address given by 'offset'"""
-    try:
-        i2c_bus.write_byte_data(I2CADDRESS, offset, byteVal)
-    except:
-        return False
-    else:
-        return True
+    def write(self, offset, byteVal):
+        """write byte given by 'byteVal' to PicoBorgRev module at address given by 'offset'"""
+        try:
+            self.__bus__.write_byte_data(self.__address__, offset, byteVal)
+        except:
+            return False
+        else:
+            return True
+
+
+class SimulatedPicoBorgRev(object):
+    """In-memory PicoBorgRev module, a drop-in replacement for SMBusBackend off the robot
+    Models the motor, LED, failsafe and EPO registers, the board identifier and a per-transaction bus latency
+    Example:
+    from motor_server import MotorControlServer, SimulatedPicoBorgRev
+    pbr = SimulatedPicoBorgRev(latency=0.0005)
+    MotorControlServer(bus=pbr).start()
+    """
+    MOTORS = {SET_A_REV: (GET_A, 1), SET_A_FWD: (GET_A, 2), SET_B_FWD: (GET_B, 1), SET_B_REV: (GET_B, 2)}  # board dir
+
+    def __init__(self, latency=0.0):
+        """:param latency: seconds each i2c transaction takes, default is 0.0"""
+        self.latency = latency
+        self.__lock__ = Lock()
+        self.__motors__ = {GET_A: (0, 0), GET_B: (0, 0)}  # direction, pwm
+        self.__last__ = monotonic()
+        self.led = self.failsafe = self.epo = 0
+        self.reads = self.writes = self.failsafe_trips = 0
+
+    def __transaction__(self):
+        """wait for the bus latency, apply the failsafe if it expired and register the command time"""
+        if self.latency: sleep(self.latency)
+        now = monotonic()
+        if self.failsafe and now - self.__last__ > FAILSAFE_TIMEOUT and any(self.__motors__[m][1] for m in (GET_A, GET_B)):
+            self.__motors__ = {GET_A: (0, 0), GET_B: (0, 0)}
+            self.failsafe_trips += 1
+        self.__last__ = now
+
+    def read(self, offset):
+        """read block of data at address given by 'offset'"""
+        with self.__lock__:
+            self.__transaction__()
+            self.reads += 1
+            if offset in (GET_A, GET_B):
+                value = self.__motors__[offset]
+            else:
+                value = {GET_LED: self.led, GET_FAILSAFE: self.failsafe, GET_EPO: self.epo,
+                         GET_ID: I2C_ID_PICOBORG_REV}.get(offset, 0),
+            return ([offset] + list(value) + [0] * I2C_MAX_LEN)[:I2C_MAX_LEN]
+
+    def write(self, offset, byteVal):
+        """write byte given by 'byteVal' at address given by 'offset', motors are held off while the EPO is tripped"""
+        with self.__lock__:
+            self.__transaction__()
+            self.writes += 1
+            if offset in self.MOTORS:
+                motor, direction = self.MOTORS[offset]
+                self.__motors__[motor] = (0, 0) if self.epo else (direction, byteVal)
+            elif offset == SET_LED:
+                self.led = 1 if byteVal else 0
+            elif offset == SET_FAILSAFE:
+                self.failsafe = 1 if byteVal else 0
+            elif offset == RESET_EPO:
+                self.epo = 0
+            return True
+
+    def trip_epo(self):
+        """simulate the emergency power off switch, motors stop until RESET_EPO is written"""
+        with self.__lock__:
+            self.epo = 1
+            self.__motors__ = {GET_A: (0, 0), GET_B: (0, 0)}
+
+    @property
+    def motors(self):
+        """return (direction, pwm) of motor A and motor B, as seen by the PicoBorgRev"""
+        with self.__lock__:
+            if self.failsafe and monotonic() - self.__last__ > FAILSAFE_TIMEOUT:
+                self.__motors__ = {GET_A: (0, 0), GET_B: (0, 0)}
+            return self.__motors__[GET_A], self.__motors__[GET_B]
+
+
+class ShadowRegisters(object):
+    """Shadow of the last value written to each PicoBorgRev register, so that only changes are sent over i2c
+    Example:
+    shadow = ShadowRegisters(SMBusBackend().write)
+    shadow.sync(((SET_A_FWD, 10), (SET_B_FWD, 10), (SET_LED, 1)), True)  # 3 writes
+    shadow.sync(((SET_A_FWD, 10), (SET_B_FWD, 10), (SET_LED, 1)), True)  # 1 keep-alive write, 2 saved
+    shadow.sync(((SET_A_FWD, 0), (SET_B_FWD, 0), (SET_LED, 1)), True)  # 2 writes, 1 saved
+    shadow.sync(((SET_A_FWD, 0), (SET_B_FWD, 0), (SET_LED, 1)), True)  # 0 writes with the motors off, 3 saved
+    """
+
+    def __init__(self, write, written=None):
+        """:param write: function(offset, byteVal) returning True when the i2c write succeeded
+        :param written: function(register) called when the value of a state register changes, e.g. to invalidate a
+                        cache of it
+        """
+        self.__write__, self.__written__ = write, written
+        self.__shadow__ = {}
+        self.__last__ = 0.0
+        self.writes = self.saved = self.keepalives = self.failures = 0
+
+    def invalidate(self):
+        """forget the shadowed values, the next sync writes every register"""
+        self.__shadow__.clear()
+
+    def sync(self, cmds, heartbeat=False):
+        """write the (offset, byteVal) commands in cmds whose value differs from the shadow
+        on a heartbeat that wrote nothing while a motor runs, write one motor register as keep-alive for the PicoBorgRev
+        failsafe, and if nothing was written for FAILSAFE_TIMEOUT, rewrite both motor registers as the failsafe may
+        have switched them off
+        :param heartbeat: True once per HEARTBEAT, the writes skipped then are counted as saved, as every command used
+                          to be written on each heartbeat
+        returns number of i2c writes sent
+        """
+        now = monotonic()
+        if now - self.__last__ > FAILSAFE_TIMEOUT and any(self.__shadow__.get(r, (0, 0))[1] for r in (GET_A, GET_B)):
+            for register in (GET_A, GET_B): self.__shadow__.pop(register, None)
+        sent = 0
+        for offset, value in cmds:
+            register = REGISTERS.get(offset, offset)
+            if self.__shadow__.get(register) == (offset, value):
+                continue
+            sent += 1
+            if self.__write__(offset, value):
+                self.__shadow__[register] = offset, value
+            else:
+                self.__shadow__.pop(register, None)
+                self.failures += 1
+            if self.__written__ is not None: self.__written__(register)
+        if heartbeat and not sent:
+            running = [cmd for cmd in cmds if REGISTERS.get(cmd[0]) in (GET_A, GET_B) and cmd[1]]
+            if running:
+                sent = 1
+                self.keepalives += 1
+                if not self.__write__(*running[0]):
+                    self.__shadow__.pop(REGISTERS[running[0][0]], None)
+                    self.failures += 1
+        if sent: self.__last__ = now
+        self.writes += sent
+        if heartbeat: self.saved += len(cmds) - sent
+        return sent
+
+    def current(self, cmds):
+        """return True if every (offset, byteVal) command in cmds has been written"""
+        return all(self.__shadow__.get(REGISTERS.get(offset, offset)) == (offset, value) for offset, value in cmds)
+
+    @property
+    def stats(self):
+        """return number of i2c writes sent, keep-alive writes, writes saved and failed writes"""
+        return ('writes', self.writes), ('keepalives', self.keepalives), ('saved', self.saved), (
+            'failures', self.failures)
+
+
+class TelemetryCache(object):
+    """Last block read from the PicoBorgRev motor and LED registers, read on demand, and refreshed by the heartbeat at a
+    configurable rate while clients poll, so that read-only verbs cost no i2c transaction while the cached block is
+    younger than the ttl"""
+    REGISTERS = GET_A, GET_B, GET_LED
+
+    def __init__(self, read, rate=0.0, ttl=2 * HEARTBEAT):
+        """:param read: function(offset) returning the block read from the PicoBorgRev
+        :param rate: refreshes per second by the heartbeat while a client polled within the ttl, at most one per
+                     heartbeat, default is 0 (no refreshing)
+        :param ttl: seconds a cached block is served
+        """
+        self.__read__, self.__period__, self.__ttl__ = read, 1.0 / rate if rate else None, ttl
+        self.__cache__ = {}  # offset: (time read, block)
+        self.__due__ = self.__polled__ = 0.0
+        self.hits = self.misses = self.reads = 0
+
+    def refresh(self):
+        """read every register if the refresh is due and a client polled within the ttl"""
+        now = monotonic()
+        if self.__period__ is None or now < self.__due__ or now - self.__polled__ > self.__ttl__: return
+        self.__due__ = now + self.__period__
+        for offset in self.REGISTERS: self.__cache__[offset] = now, self.__read__(offset)
+        self.reads += len(self.REGISTERS)
+
+    def invalidate(self, offset):
+        """forget the cached block at offset"""
+        self.__cache__.pop(offset, None)
+
+    def cached(self, offset):
+        """return the block at offset if it is younger than the ttl, None otherwise, without reading the bus"""
+        now = monotonic()
+        self.__polled__ = now
+        at, block = self.__cache__.get(offset, (None, None))
+        if at is None or now - at > self.__ttl__:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return block
+
+    def read(self, offset):
+        """return the block at offset read from the bus, and cache it"""
+        block = self.__read__(offset)
+        self.__cache__[offset] = monotonic(), block
+        self.reads += 1
+        return block
+
+    @property
+    def stats(self):
+        """return number of reads served by the cache, reads it could not serve, and blocks read from the bus"""
+        return ('cache_hits', self.hits), ('cache_misses', self.misses), ('bus_reads', self.reads)
+
+
+class MotionProfile(object):
+    """Acceleration and jerk limited ramp of (linear, angular) towards a target velocity, stepped on a clock
+    Each axis accelerates at up to accel, changes its acceleration by up to jerk per second, and starts braking in time
+    to reach its target without overshoot.
+    Example:
+    profile = MotionProfile()
+    profile.start((0.0, 0.0), (1.0, 0.0), accel=1.0, jerk=10.0, now=monotonic())
+    while profile.active: set_velocity(*profile.step())  # about 1.1 s from standstill to full speed
+    """
+
+    def __init__(self):
+        self.__lock__ = Lock()
+        self.__values__, self.__rates__, self.__targets__ = [0.0, 0.0], [0.0, 0.0], (0.0, 0.0)
+        self.__accel__, self.__jerk__, self.__time__ = ACCEL, JERK, 0.0
+        self.active = False
+        self.profiles = self.steps = 0
+
+    def start(self, current, target, accel=ACCEL, jerk=JERK, now=None):
+        """ramp from current to target (linear, angular), keeping the rates of a ramp in progress
+        :param accel: largest rate of change of velocity per second
+        :param jerk: largest rate of change of acceleration per second, None for no jerk limit
+        """
+        with self.__lock__:
+            if not self.active: self.__rates__ = [0.0, 0.0]
+            self.__values__, self.__targets__ = list(current), tuple(target)
+            self.__accel__, self.__jerk__ = accel, jerk
+            self.__time__ = monotonic() if now is None else now
+            self.active = True
+            self.profiles += 1
+
+    def step(self, now=None):
+        """advance the ramp to now, return the (linear, angular) velocity, or None if the ramp is not active"""
+        with self.__lock__:
+            if not self.active: return None
+            now = monotonic() if now is None else now
+            dt, self.__time__ = max(0.0, now - self.__time__), now
+            accel, jerk = self.__accel__, self.__jerk__
+            for axis in (0, 1):
+                value, rate, target = self.__values__[axis], self.__rates__[axis], self.__targets__[axis]
+                error = target - value
+                desired = min(accel, sqrt(2.0 * jerk * abs(error))) if jerk else accel  # brake before the target
+                desired = desired if error > 0 else -desired
+                if jerk: desired = min(max(desired, rate - jerk * dt), rate + jerk * dt)
+                value += desired * dt
+                if (target - value) * error <= 0: value, desired = target, 0.0  # reached or crossed the target
+                self.__values__[axis], self.__rates__[axis] = value, desired
+            self.active = tuple(self.__values__) != self.__targets__
+            self.steps += 1
+            return tuple(self.__values__)
+
+    def cancel(self):
+        """stop ramping, the velocity stays where it is"""
+        with self.__lock__:
+            self.active = False
+
+    @property
+    def target(self):
+        """return the target (linear, angular) velocity"""
+        return self.__targets__
+
+
+class MotionSequence(object):
+    """Timed (linear, angular, duration) steps with deadlines fixed from the start time, so lateness never accumulates
+    Example:
+    sequence = MotionSequence()
+    sequence.start([(1.0, 0, 1), (0, 1.0, 0.5), (0, 0, 0.1)])
+    while sequence.active: velocity = sequence.due(); time.sleep(...)  # velocity is None until the next step is due
+    """
+
+    def __init__(self):
+        self.__lock__ = Lock()
+        self.__steps__, self.__deadlines__, self.__index__, self.__start__ = (), (), 0, 0.0
+        self.__stopped__ = None  # monotonic time a cancel stopped the sequence
+        self.active = False
+        self.late = Histogram()
+
+    def start(self, steps, now=None):
+        """start running steps, return the velocity of the first step"""
+        with self.__lock__:
+            self.__start__ = monotonic() if now is None else now
+            deadlines, deadline = [], self.__start__
+            for step in steps:
+                deadline += step[2]
+                deadlines.append(deadline)
+            self.__steps__, self.__deadlines__, self.__index__ = tuple(steps), tuple(deadlines), 0
+            self.__stopped__, self.active = None, True
+            return self.__steps__[0][:2]
+
+    def due(self, now=None):
+        """return the velocity of the step due at now if it has not been returned yet, (0.0, 0.0) after the last step,
+        otherwise None"""
+        with self.__lock__:
+            if not self.active: return None
+            now = monotonic() if now is None else now
+            index = self.__index__
+            while index < len(self.__deadlines__) and now >= self.__deadlines__[index]: index += 1
+            if index == self.__index__: return None
+            self.late.add(now - self.__deadlines__[index - 1])
+            self.__index__ = index
+            if index == len(self.__steps__):
+                self.active = False
+                return 0.0, 0.0
+            return self.__steps__[index][:2]
+
+    @property
+    def deadline(self):
+        """return the monotonic time the next step is due"""
+        return self.__deadlines__[min(self.__index__, len(self.__deadlines__) - 1)] if self.__deadlines__ else 0.0
+
+    def cancel(self):
+        """stop running, return True if a sequence was running"""
+        with self.__lock__:
+            active, self.active = self.active, False
+            if active: self.__stopped__ = monotonic()
+            return active
+
+    @property
+    def status(self):
+        """return whether running, current step, number of steps, seconds elapsed and remaining, and step lateness,
+        a cancelled sequence reports its progress when cancelled"""
+        with self.__lock__:
+            end = self.__deadlines__[-1] if self.__deadlines__ else self.__start__
+            stopped = monotonic() if self.active else end if self.__stopped__ is None else self.__stopped__
+            elapsed = stopped - self.__start__
+            return ('running', self.active), ('step', self.__index__), ('steps', len(self.__steps__)), (
+                'elapsed', elapsed), ('remaining', max(0.0, end - self.__start__ - elapsed)), ('late', self.late.stats)
+
+
+class Histogram(object):
+    """Histogram of durations in power of two microsecond buckets, cheap enough for the hot path"""
+    BUCKETS = 32  # bucket i counts durations below 2 ** i microseconds, the last one counts everything longer
+
+    def __init__(self):
+        self.__lock__ = Lock()
+        self.counts, self.count, self.total, self.max = [0] * self.BUCKETS, 0, 0.0, 0.0
+
+    def add(self, seconds):
+        """count one duration, in seconds"""
+        with self.__lock__:
+            self.counts[min(int(seconds * 1e6).bit_length(), self.BUCKETS - 1)] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max: self.max = seconds
+
+    def quantile(self, q):
+        """return the upper bound in microseconds of the bucket holding quantile q"""
+        rank, seen = q * self.count, 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank: return 2 ** bucket
+        return 0
+
+    @property
+    def stats(self):
+        """return count, and mean, median, 99th percentile and maximum durations in microseconds"""
+        max_us = int(1e6 * self.max)
+        return ('count', self.count), ('mean_us', int(1e6 * self.total / self.count) if self.count else 0), (
+            'p50_us', min(self.quantile(0.5), max_us)), ('p99_us', min(self.quantile(0.99), max_us)), ('max_us', max_us)
+
+
+class Metrics(object):
+    """Latency and throughput instrumentation of the Motor Control Server
+    Per verb request latency (received to replied), i2c transaction durations, scheduler deadline lateness, watchdog
+    trips, lease expiries and connected clients; the server only takes timestamps when enabled
+    """
+
+    def __init__(self, enabled=True):
+        """:param enabled: whether latencies are measured, default is True"""
+        self.enabled = enabled
+        self.__lock__ = Lock()
+        self.verbs, self.i2c_read, self.i2c_write, self.heartbeat = {}, Histogram(), Histogram(), Histogram()
+        self.clients = self.watchdog_trips = self.lease_expiries = 0
+
+    def request(self, verb, seconds):
+        """count the latency of a request for verb"""
+        histogram = self.verbs.get(verb)
+        if histogram is None: histogram = self.verbs.setdefault(verb, Histogram())
+        histogram.add(seconds)
+
+    def connected(self, clients):
+        """count clients connecting (positive) or disconnecting (negative)"""
+        with self.__lock__:
+            self.clients += clients
+
+    @property
+    def stats(self):
+        """return connected clients, watchdog trips, lease expiries, and histograms of scheduler deadline lateness
+        (heartbeat jitter), i2c reads, i2c writes and request latency per verb"""
+        return ('enabled', self.enabled), ('clients', self.clients), ('watchdog_trips', self.watchdog_trips), (
+            'lease_expiries', self.lease_expiries), ('heartbeat_jitter', self.heartbeat.stats), ('i2c_read', self.i2c_read.stats), (
+            'i2c_write', self.i2c_write.stats), ('verbs', tuple((v, h.stats) for v, h in sorted(self.verbs.items())))
+
+
+class TimedBus(object):
+    """PicoBorgRev backend wrapper recording the duration of every i2c transaction in Metrics"""
+
+    def __init__(self, bus, metrics):
+        self.__bus__, self.__metrics__ = bus, metrics
+
+    def read(self, offset):
+        """read block of data at address given by 'offset', timed"""
+        start = monotonic()
+        try:
+            return self.__bus__.read(offset)
+        finally:
+            self.__metrics__.i2c_read.add(monotonic() - start)
+
+    def write(self, offset, byteVal):
+        """write byte given by 'byteVal' at address given by 'offset', timed"""
+        start = monotonic()
+        try:
+            return self.__bus__.write(offset, byteVal)
+        finally:
+            self.__metrics__.i2c_write.add(monotonic() - start)
+
+
+class DriveChannel(object):
+    """Latest-wins filter of udp drive datagrams
+    Datagrams are authenticated with an HMAC derived from the token, and numbered per client session; sessions are
+    random numbers issued to clients over their authenticated connection, and only the DRIVE_SESSIONS most recently
+    issued are accepted, so datagrams captured before a restart or of a forgotten session cannot be replayed;
+    of a batch of datagrams only the newest valid command is returned, stale and replayed ones are dropped
+    """
+
+    def __init__(self, token):
+        """:param token: authkey shared with the clients"""
+        self.__key__ = drive_key(token)
+        self.__sessions__ = OrderedDict()  # session: last seq applied, 0 before the first
+        self.__lock__ = Lock()
+        self.received = self.applied = self.stale = self.rejected = 0
+
+    def issue(self):
+        """return a new session number, forgetting the least recently used session if there are too many"""
+        session = SESSION.unpack(urandom(SESSION.size))[0]
+        with self.__lock__:
+            self.__sessions__[session] = 0
+            if len(self.__sessions__) > DRIVE_SESSIONS: self.__sessions__.popitem(last=False)
+        return session
+
+    def newest(self, datagrams):
+        """return (linear, angular) of the newest command in datagrams, or None if none is valid and newer"""
+        command = None
+        for data in datagrams:
+            self.received += 1
+            drive = decode_drive(self.__key__, data)
+            if drive is None:
+                self.rejected += 1
+                continue
+            session, seq, linear, angular = drive
+            with self.__lock__:
+                last = self.__sessions__.get(session)
+                if last is None:  # not issued, or forgotten
+                    self.rejected += 1
+                    continue
+                if seq <= last:
+                    self.stale += 1
+                    continue
+                if command is not None: self.stale += 1
+                del self.__sessions__[session]
+                self.__sessions__[session] = seq
+            command = linear, angular
+        if command is not None: self.applied += 1
+        return command
+
+    @property
+    def stats(self):
+        """return number of udp drive datagrams received, applied, dropped as stale and rejected"""
+        return ('received', self.received), ('applied', self.applied), ('stale', self.stale), (
+            'rejected', self.rejected)
+
+
+class Lease(object):
+    """How long the motor commands of a client stay in force without hearing from it
+    With a lease, the scheduler stops the motors when the client that sent the last motion command has been silent for
+    the lease seconds, or at once when it disconnects; without one only the TIMEOUT watchdog applies.
+    """
+
+    def __init__(self, seconds=None):
+        """:param seconds: lease in seconds, None for no lease"""
+        self.seconds, self.closed = seconds, False
+        self.last = monotonic()
+
+    def renew(self):
+        """the client was heard from"""
+        self.last = monotonic()
+
+    def close(self):
+        """the client disconnected"""
+        self.closed = True
+
+    @property
+    def deadline(self):
+        """return the monotonic time the lease expires, None if it never does"""
+        if self.seconds is None: return None
+        return self.last if self.closed else self.last + self.seconds
 
 
 class MotorControlServer():
@@ -70,103 +655,273 @@ class MotorControlServer():
     mcs.start()
     """
 
-    def __init__(self, ip_address=IP, ip_port=PORT, token=TOKEN):
+    def __init__(self, ip_address=IP, ip_port=PORT, token=None, bus=None, udp_port=None,
+                 telemetry_rate=0.0, telemetry_ttl=2 * HEARTBEAT, metrics=True, control_rate=CONTROL_RATE,
+                 accel=ACCEL, jerk=JERK, lease=None, local=True, log=None):
         """Initialize Motor Control Server
         :param ip_address: IP address (localhost or external IP address), default is 127.0.0.1
         :param ip_port: port number, default is 1092
-        :param token: authkey, default is read from /home/pi/.motion
+        :param token: authkey, default is read from /home/pi/.motor_server, a random one is saved there if missing
+        :param bus: PicoBorgRev backend with read(offset) and write(offset, byteVal), default is SMBusBackend()
+        :param udp_port: udp port on which to receive drive datagrams, default is None (no udp drive channel)
+        :param telemetry_rate: refreshes per second of the motor and LED state cache by the heartbeat while clients
+                               poll, default is 0, read-only verbs then answer from the commands once the cache expires
+        :param telemetry_ttl: seconds the cached motor and LED state is served by read-only verbs, default 2 * HEARTBEAT
+        :param metrics: whether request, i2c and heartbeat latencies are measured for the metrics verb, default is True
+        :param control_rate: heartbeat steps per second while a set_target_velocity ramp runs, default is 50
+        :param accel: largest acceleration of set_target_velocity ramps, full scale per second, default is 2.0
+        :param jerk: largest jerk of set_target_velocity ramps, full scale per second squared, default is 20.0
+        :param lease: seconds the motion commands of a client stay in force without hearing from it, they also expire
+                      when it disconnects, default is None (only the TIMEOUT watchdog), clients may set their own lease
+        :param local: whether to also listen on the unix socket unix_socket_path(ip_port) for clients on the same Pi,
+                      which are let in by their user or group instead of the token, it is not opened when
+                      local_socket_dir refuses its directory, default is True
+        :param log: TelemetryLog the scheduler appends changes of velocity, motor PWM and LED state to, closed when the
+                    server stops, default is None (no telemetry log)
         """
+        token = server_token() if token is None else token
         self.__ip__, self.__port__, self.__token__ = ip_address, ip_port, token
-        self.__cmds__ = (SET_A_FWD, 0), (SET_B_FWD, 0), (SET_LED, 0)
+        self.__udp_port__, self.__drive__ = udp_port, DriveChannel(token)
+        self.__local__ = unix_socket_path(ip_port)
+        if not (local and local_socket_dir(self.__local__)): self.__local__ = None
+        self.__metrics__ = Metrics(metrics)
+        self.__bus__ = SMBusBackend() if bus is None else bus
+        if metrics: self.__bus__ = TimedBus(self.__bus__, self.__metrics__)
+        self.__cmds__ = OFF_CMDS  # motor A, motor B and LED commands, in this order
+        self.__velocity__ = (0.0, 0.0)  # linear and angular velocity of the motor commands
+        self.__profile__, self.__control_period__ = MotionProfile(), 1.0 / control_rate
+        self.__accel__, self.__jerk__ = accel, jerk
+        self.__sequence__ = MotionSequence()
+        self.__drive_lock__ = Lock()  # orders every update of the motor and LED commands, velocity, ramp and sequence
+        self.__lease__, self.__owner__ = lease, None  # default lease, and Lease of the client of the motor commands
+        self.__activity__ = monotonic()  # time of the last request, the watchdog stops the motors TIMEOUT after it
+        self.__telemetry__ = TelemetryCache(self.__bus__.read, telemetry_rate, telemetry_ttl)
+        self.__shadow__ = ShadowRegisters(self.__bus__.write, written=self.__telemetry__.invalidate)
+        self.__log__ = log
         self.__run__ = Event()
         self.__updated__ = Event()
-        self.__timeout__ = Event()
         self.__funcs__ = dict([(f[24:], getattr(self, f)) for f in dir(self) if f[0:24] == '_MotorControlServer__x__'])
         self.__pid__ = getpid()
         signal(SIGTERM, self.__sigterm__)
 
     def start(self):
         """start the Motor Control Server
-        Start three threads:
-            heartbeat - communicates with the PicoBorgRev
-            watchdog - stops the motors if inactive for timeout
+        Start threads:
+            scheduler - communicates with the PicoBorgRev, steps ramps and sequences, and stops the motors if inactive
+                        for timeout or when the lease of the client of the motor commands expires
             listener - listen for connections (daemon) and starts new daemon thread to handle client requests
                        Connections authkey authenticated by token
-        Wait for heartbeat and watchdog to finish
+            local - listen on the unix socket (daemon), connections authenticated by the peer user or group
+            udp - receive drive datagrams (daemon), when a udp port is given
+        Wait for the scheduler to finish
         """
         # if self.__connect_pbr__: # to be debugged
         self.__run__.set()
         self.__updated__.set()
-        self.__timeout__.set()
-        heartbeat = Thread(target=self.__heartbeat__)
-        watchdog = Thread(target=self.__watchdog__)
+        self.__activity__ = monotonic()
+        scheduler = Thread(target=self.__scheduler__)
         listener = Thread(target=self.__listen__)
         listener.daemon = True
-        watchdog.start()
-        heartbeat.start()
+        scheduler.start()
         listener.start()
-        heartbeat.join()
-        watchdog.join()
+        if self.__local__ is not None:
+            local = Thread(target=self.__listen_local__)
+            local.daemon = True
+            local.start()
+        if self.__udp_port__ is not None:
+            udp = Thread(target=self.__udp__)
+            udp.daemon = True
+            udp.start()
+        scheduler.join()
+        if self.__local__ is not None and path.exists(self.__local__): unlink(self.__local__)
+        if self.__log__ is not None: self.__log__.close()
         # else:
         #     print('check hardware')
         #     exit(1)
 
-    def __heartbeat__(self):
-        """Send motor PWM and LED state to the PicoBorgRev module when updated, otherwise every HEARTBEAT interval"""
-        while read_i2c(GET_FAILSAFE) == 0: write_i2c(SET_FAILSAFE, 1)
+    def __scheduler__(self):
+        """Single timer thread running off monotonic deadlines:
+            heartbeat - send changed motor PWM and LED state to the PicoBorgRev when updated, and one keep-alive write
+                        per HEARTBEAT while a motor runs and nothing changed, so the failsafe never trips
+            control - step a set_target_velocity ramp at the control rate and a run_sequence on its step deadlines
+            watchdog - set motor PWM and LED state to 0 (off) if no interaction for more than TIMEOUT interval
+            lease - stop the motors when the lease of the client of the motor commands expires
+            log - queue velocity, motor PWM and LED state to the telemetry log when they change
+        Deadlines are kept on a fixed grid, so the periods do not drift with processing time, and the lateness of each
+        timed wake-up is recorded as heartbeat jitter"""
+        while self.__bus__.read(GET_FAILSAFE)[1] == 0: self.__bus__.write(SET_FAILSAFE, 1)
+        self.__shadow__.invalidate()
+        tick, control = monotonic() + HEARTBEAT, 0.0
+        logged = (None, None, None)  # motor A, motor B and LED commands last logged
         while self.__run__.is_set():
-            if self.__updated__.wait(HEARTBEAT): self.__updated__.clear()
-            for cmd in self.__cmds__: write_i2c(*cmd)
-        write_i2c(SET_FAILSAFE, 0)
-        write_i2c(RESET_EPO, 0)
-        write_i2c(SET_A_FWD, 0)
-        write_i2c(SET_B_FWD, 0)
-        write_i2c(SET_LED, 0)
-
-    def __watchdog__(self):
-        """Set motor PWM and LED State to 0 (off) if no interaction for more than TIMEOUT interval"""
-        while self.__run__.is_set():
-            if self.__timeout__.wait(TIMEOUT):
-                self.__timeout__.clear()
-            else:
-                self.__cmds__ = (SET_A_FWD, 0), (SET_B_FWD, 0), (SET_LED, 0)
+            owner = self.__owner__
+            lease = None if owner is None else owner.deadline
+            ramping = self.__profile__.active
+            start = monotonic()
+            if not ramping: control = start + self.__control_period__
+            deadline = min(tick, self.__activity__ + TIMEOUT, control if ramping else tick,
+                           self.__sequence__.deadline if self.__sequence__.active else tick,
+                           tick if lease is None else lease)
+            if self.__updated__.wait(max(0.0, deadline - start)): self.__updated__.clear()
+            now = monotonic()
+            if now >= deadline and self.__metrics__.enabled: self.__metrics__.heartbeat.add(now - max(deadline, start))
+            heartbeat = now >= tick
+            if heartbeat: tick += HEARTBEAT * (1 + int((now - tick) / HEARTBEAT))
+            lease = None if owner is None else owner.deadline  # renewed while waiting
+            if now >= self.__activity__ + TIMEOUT:
+                self.__activity__ = now
+                if self.__stop_motors__(led=False): self.__metrics__.watchdog_trips += 1
+            elif lease is not None and now >= lease and owner is self.__owner__:
+                self.__owner__ = None
+                if self.__stop_motors__(): self.__metrics__.lease_expiries += 1
+            with self.__drive_lock__:
+                velocity = self.__sequence__.due(now)
+                if velocity is None and ramping and now >= control:
+                    velocity = self.__profile__.step(now)
+                    control += self.__control_period__ * (1 + int((now - control) / self.__control_period__))
+                if velocity is not None: self.__drive_velocity__(*velocity)
+            cmds = self.__cmds__
+            self.__shadow__.sync(cmds, heartbeat)
+            self.__telemetry__.refresh()
+            if self.__log__ is not None and cmds != logged:
+                if cmds[:2] != logged[:2]: self.__log__.append('drive', self.__velocity__[0], self.__velocity__[1],
+                                                               signed_pwm(cmds[0]), signed_pwm(cmds[1]))
+                if cmds[2] != logged[2]: self.__log__.append('led', cmds[2][1])
+                logged = cmds
+        self.__shadow__.invalidate()
+        self.__bus__.write(SET_FAILSAFE, 0)
+        self.__bus__.write(RESET_EPO, 0)
+        self.__bus__.write(SET_A_FWD, 0)
+        self.__bus__.write(SET_B_FWD, 0)
+        self.__bus__.write(SET_LED, 0)
+        if self.__log__ is not None and logged != OFF_CMDS:
+            self.__log__.append('drive', 0.0, 0.0, 0, 0)
+            self.__log__.append('led', 0)
+
+    def __stop_motors__(self, led=None):
+        """cancel ramp and sequence and switch the motors off, return True if the motors were running
+        :param led: False to also switch the LED off, None keeps the LED state
+        """
+        with self.__drive_lock__:
+            running = self.__cmds__[:2] != OFF_CMDS[:2]
+            self.__profile__.cancel()
+            self.__sequence__.cancel()
+            self.__cmds__ = OFF_CMDS[:2] + (self.__cmds__[2:] if led is None else ((SET_LED, 1 if led else 0),))
+            self.__velocity__ = 0.0, 0.0
+        return running
 
     def __listen__(self):
         """Start listening for connections and assign handler thread for new connections"""
-        server = Listener((self.__ip__, self.__port__), authkey=self.__token__)
+        server = Listener((self.__ip__, self.__port__), authkey=authkey(self.__token__))
         while self.__run__.is_set():
             try:
                 connect = server.accept()
                 thread = Thread(target=self.__handle__, args=(connect,))
                 thread.daemon = True
                 thread.start()
-            except AuthenticationError:
+            except (AuthenticationError, EOFError, IOError):  # failed the handshake, or gone during it
                 pass
         server.close()
 
+    def __listen_local__(self):
+        """Listen on the unix socket, welcome the connections of local_peer clients and assign them a handler thread"""
+        if path.exists(self.__local__): unlink(self.__local__)
+        server = socket(AF_UNIX, SOCK_STREAM)
+        server.bind(self.__local__)
+        chmod(self.__local__, 0o660)
+        server.listen(8)
+        while self.__run__.is_set():
+            conn = SocketConnection(server.accept()[0])
+            try:
+                welcome = local_peer(conn.sock)
+                conn.send_bytes(WELCOME if welcome else FAILURE)
+            except (EOFError, IOError):  # gone before it was let in
+                welcome = False
+            if not welcome:
+                conn.close()
+                continue
+            thread = Thread(target=self.__handle__, args=(conn,))
+            thread.daemon = True
+            thread.start()
+        server.close()
+
+    def __udp__(self):
+        """Receive drive datagrams, and apply the newest command of those queued on the socket"""
+        sock = socket(AF_INET, SOCK_DGRAM)
+        sock.bind((self.__ip__, self.__udp_port__))
+        sock.settimeout(HEARTBEAT)
+        while self.__run__.is_set():
+            try:
+                datagrams = [sock.recv(DRIVE.size + DRIVE_MAC + 1)]
+            except SocketTimeout:
+                continue
+            sock.setblocking(False)
+            try:
+                while True: datagrams.append(sock.recv(DRIVE.size + DRIVE_MAC + 1))
+            except SocketError:
+                pass
+            sock.settimeout(HEARTBEAT)
+            self.__apply_drive__(datagrams)
+        sock.close()
+
+    def __apply_drive__(self, datagrams):
+        """set the velocity of the newest valid drive command among datagrams"""
+        command = self.__drive__.newest(datagrams)
+        if command is not None:
+            self.__activity__, self.__owner__ = monotonic(), None
+            try:
+                self.__x__set_velocity(*command)
+            except AssertionError:
+                self.__drive__.rejected += 1
+
     def __handle__(self, conn):
         """accept commands via connection (conn), handle and respond; recieve verb aka function to execute, arguments and named arguments; send result object or exception"""
-        inuse = True
+        inuse, lease = True, Lease(self.__lease__)
+        self.__metrics__.connected(1)
         while inuse:
             try:
-                verb, args, kwargs = conn.recv()
+                data = conn.recv_bytes()
+                start = monotonic() if self.__metrics__.enabled else None
+                opcode, seq, ack, verb, args, kwargs = decode_request(data)
+            except (EOFError, IOError):
+                inuse = False
             except:
                 conn.send(Exception('bad request'))
             else:
-                self.__timeout__.set()
                 if verb in ('bye', 'close', 'exit'):
+                    self.__activity__ = monotonic()
                     inuse = False
                 else:
-                    try:
-                        conn.send(self.__funcs__[verb](*args, **kwargs))
-                    except Exception as e:
-                        conn.send(e)
+                    result = self.__rpc__(verb, args, kwargs, lease)
+                    if ack: conn.send_bytes(encode_reply(opcode, seq, result))
+                    if start is not None: self.__metrics__.request(verb, monotonic() - start)
+        self.__disconnected__(lease)
         conn.close()
 
+    def __rpc__(self, verb, args, kwargs, lease=None):
+        """execute verb(*args, **kwargs) requested by a client, return the result object or exception
+        :param lease: Lease of the client, renewed by the request, the client owns the motor commands it sets
+        """
+        self.__activity__ = monotonic()
+        if lease is not None: lease.renew()
+        try:
+            if verb in LEASE_VERBS: kwargs = dict(kwargs, client=lease)
+            result = self.__funcs__[verb](*args, **kwargs)
+        except Exception as e:
+            return e
+        if verb in MOTION_VERBS: self.__owner__ = lease
+        return result
+
+    def __disconnected__(self, lease):
+        """a client disconnected, its lease expires now"""
+        lease.close()
+        self.__metrics__.connected(-1)
+        self.__updated__.set()
+
     @property
     def __connect_pbr__(self):
         """return whether i2c module at I2CADDRESS is PicoBorgRev (True) or not (False) based on ID"""
-        i2c_data = read_i2c(GET_ID)
+        i2c_data = self.__bus__.read(GET_ID)
         return len(i2c_data) == I2C_MAX_LEN and i2c_data[1] == I2C_ID_PICOBORG_REV
 
     def __sigterm__(self, signum, frame):
@@ -176,42 +931,139 @@ class MotorControlServer():
     def __x__stop(self):
         """send stop event to all active threads, returns pid and number of active threads"""
         self.__run__.clear()
-        self.__timeout__.set()
+        self.__profile__.cancel()
+        self.__sequence__.cancel()
         self.__updated__.set()
         return ('pid', self.__pid__), ('threads', active_count())
 
-    def __x__status(self):
-        """return motor direction and PWM setting, LED state, pid, and number of active threads"""
-        return self.__x__get_velocity() + self.__x__get_led() + (('pid', self.__pid__), ('threads', active_count()))
+    def __x__status(self, fresh=False):
+        """return motor direction and PWM setting, LED state, pid, and number of active threads, read from the bus if
+        fresh"""
+        return self.__x__get_velocity(fresh) + self.__x__get_led(fresh) + (('pid', self.__pid__),
+                                                                          ('threads', active_count()))
 
-    def __x__get_velocity(self):
-        """return motor direction and PWM setting"""
-        a, b = read_i2c(GET_A), read_i2c(GET_B)
+    def __x__get_velocity(self, fresh=False):
+        """return motor direction and PWM setting, read from the bus if fresh, otherwise cached while the commands are
+        written, else the motor commands, so that it never waits for the bus"""
+        cmds = self.__cmds__
+        if fresh:
+            a, b = self.__telemetry__.read(GET_A), self.__telemetry__.read(GET_B)
+        else:
+            a, b = (self.__telemetry__.cached(GET_A), self.__telemetry__.cached(GET_B)) if self.__shadow__.current(
+                cmds[:2]) else (None, None)
+            if a is None or b is None: return ('motorA', signed_pwm(cmds[0])), ('motorB', signed_pwm(cmds[1]))
         return ('motorA', A_DIR[a[1]] * a[2]), ('motorB', B_DIR[b[1]] * b[2])
 
+    def __drive_velocity__(self, linear, angular):
+        """set the motor commands of linear and angular velocity, return the PWM of motor A and motor B"""
+        pwm_r, pwm_l = norm_pwm(PWM_MAX * (linear + angular)), norm_pwm(PWM_MAX * (linear - angular))
+        self.__cmds__ = (SET_A_REV, -pwm_r) if pwm_r < 0 else (SET_A_FWD, pwm_r), (
+            SET_B_REV, -pwm_l) if pwm_l < 0 else (SET_B_FWD, pwm_l), self.__cmds__[2]
+        self.__velocity__ = linear, angular
+        return pwm_r, pwm_l
+
     def __x__set_velocity(self, linear, angular=0.0):
         """set linear velocity and angular velocity, accept values between -1.0 and 1.0, default angular is 0.0"""
         assert is_norm_one(linear) and is_norm_one(angular)
-        pwm_r, pwm_l = norm_pwm(PWM_MAX * (linear + angular)), norm_pwm(PWM_MAX * (linear - angular))
-        self.__cmds__ = (SET_A_REV, -pwm_r) if pwm_r < 0 else (SET_A_FWD, pwm_r), (
-            SET_B_REV, -pwm_l) if pwm_l < 0 else (SET_B_FWD, pwm_l)
+        with self.__drive_lock__:
+            self.__profile__.cancel()
+            self.__sequence__.cancel()
+            pwm_r, pwm_l = self.__drive_velocity__(linear, angular)
         self.__updated__.set()
         return ('linear', linear), ('angular', angular), ('motorA', pwm_r), ('motorB', pwm_l)
 
-    def __x__get_led(self):
-        """return LED state"""
-        return ('led', 'ON' if read_i2c(GET_LED)[1] == 1 else 'OFF'),
+    def __x__set_target_velocity(self, linear, angular=0.0, accel=None, jerk=None):
+        """ramp to linear and angular velocity between -1.0 and 1.0 at the control rate, accel (per second) and jerk
+        (per second squared) default to and are capped by the server limits, set_velocity or stop end the ramp"""
+        assert is_norm_one(linear) and is_norm_one(angular)
+        accel = self.__accel__ if accel is None else min(abs(accel), self.__accel__)
+        jerk = self.__jerk__ if jerk is None else min(abs(jerk), self.__jerk__)
+        assert accel > 0 and jerk > 0
+        with self.__drive_lock__:
+            self.__sequence__.cancel()
+            self.__profile__.start(self.__velocity__, (linear, angular), accel, jerk)
+        self.__updated__.set()
+        return ('linear', linear), ('angular', angular), ('accel', accel), ('jerk', jerk)
+
+    def __x__get_target_velocity(self):
+        """return the velocity and target velocity, and whether a set_target_velocity ramp is running"""
+        return ('linear', self.__velocity__[0]), ('angular', self.__velocity__[1]), (
+            'target', self.__profile__.target), ('ramping', self.__profile__.active)
+
+    def __x__run_sequence(self, steps):
+        """run a list of (linear, angular, duration) steps on the server clock, linear and angular between -1.0 and 1.0,
+        duration in seconds; the motors stop after the last step, set_velocity and set_target_velocity cancel it, and
+        the watchdog stops it unless a client keeps in touch, e.g. by polling sequence_status"""
+        steps = [(float(linear), float(angular), float(duration)) for linear, angular, duration in steps]
+        assert 0 < len(steps) <= SEQUENCE_STEPS
+        assert all(is_norm_one(linear) and is_norm_one(angular) and duration > 0 for linear, angular, duration in steps)
+        with self.__drive_lock__:
+            self.__profile__.cancel()
+            self.__drive_velocity__(*self.__sequence__.start(steps))
+        self.__updated__.set()
+        return ('steps', len(steps)), ('duration', sum(step[2] for step in steps))
+
+    def __x__cancel_sequence(self):
+        """cancel a running sequence and stop the motors, return its progress"""
+        with self.__drive_lock__:
+            if self.__sequence__.cancel(): self.__drive_velocity__(0.0, 0.0)
+        self.__updated__.set()
+        return self.__sequence__.status
+
+    def __x__sequence_status(self):
+        """return whether a sequence is running, its current step and number of steps, seconds elapsed and remaining,
+        and how late steps started in microseconds"""
+        return self.__sequence__.status
+
+    def __x__get_led(self, fresh=False):
+        """return LED state, read from the bus if fresh, otherwise cached while the command is written, else the LED
+        command"""
+        cmds = self.__cmds__
+        led = self.__telemetry__.read(GET_LED) if fresh else self.__telemetry__.cached(
+            GET_LED) if self.__shadow__.current(cmds[2:]) else None
+        return ('led', 'ON' if (cmds[2] if led is None else led)[1] == 1 else 'OFF'),
 
     def __x__set_led(self, on_off_num):
         """set LED state, accept any number 0 -> OFF and non-zero number -> ON"""
         on_off = 1 if on_off_num else 0
-        self.__cmds__ += (SET_LED, on_off),
+        with self.__drive_lock__:
+            self.__cmds__ = self.__cmds__[:2] + ((SET_LED, on_off),)
         self.__updated__.set()
         return ('led', 'ON' if on_off == 1 else 'OFF'),
 
+    def __x__bus_stats(self):
+        """return number of i2c writes sent, keep-alive writes, writes saved by the shadow registers and failed writes,
+        and number of reads served by the telemetry cache, answered from the commands instead, and read from the bus"""
+        return self.__shadow__.stats + self.__telemetry__.stats
+
+    def __x__drive_session(self):
+        """return a new session number for udp drive datagrams, the channel accepts only the sessions it issued"""
+        return ('session', self.__drive__.issue()),
+
+    def __x__udp_stats(self):
+        """return number of udp drive datagrams received, applied, dropped as stale and rejected"""
+        return self.__drive__.stats
+
+    def __x__metrics(self):
+        """return connected clients, watchdog trips, and latency histograms in microseconds of heartbeat jitter, i2c
+        reads, i2c writes and requests per verb"""
+        return self.__metrics__.stats
+
+    def __x__lease(self, seconds=None, client=None):
+        """set the seconds the motion commands of this client stay in force without hearing from it, they also expire
+        when it disconnects, None for no lease, return the lease"""
+        assert seconds is None or seconds > 0
+        if client is not None: client.seconds = seconds
+        self.__updated__.set()
+        return ('lease', seconds),
+
+    def __x__protocol(self, version=PROTOCOL_BINARY):
+        """return the wire protocol to use, the highest supported by both client and server"""
+        return ('protocol', min(version, PROTOCOL_PIPELINE)),
+
     def __x__get_id(self):
         """return board identifier"""
-        return ('id', read_i2c(GET_ID)),
+        return ('id', self.__bus__.read(GET_ID)),
 
     def __x__get_pid(self):
         """return pid"""
@@ -219,112 +1071,41 @@ class MotorControlServer():
 
     def __x__help(self):
         """return docstrings of available functions"""
-        return tuple((n + '(' + ', '.join(f.__code__.co_varnames[1:f.__code__.co_argcount]) + ')', f.__doc__)
+        return tuple((n + '(' + ', '.join(v for v in f.__code__.co_varnames[1:f.__code__.co_argcount] if v != 'client') +
+                      ')', f.__doc__)
                      for (n, f) in sorted(self.__funcs__.items(), key=lambda x: x[1].__code__.co_firstlineno))
 
 
-class MotorController(object):
-    """Client for Motor Control Server for DiddyBorg
-    Example:
-    from motor_server import MotorController
-    try:
-        list_steps = [(1.0,0),(-1.0,0),(0,1.0),(0,-1.0),(0,0)] # forward, reverse, spin clockwise, spin counter, stop
-        with MotorController() as mc:
-            mc.set_led(1)
-            for linear, angular in list_steps:
-                mc.set_velocity(linear, angular)
-                time.sleep(1)
-            mc.set_led(0)
-    Except Exception as e:
-        print(e.msg)
-
-    Example:
-    from motor_server import MotorController
-    remote_host='192.168.1.1'
-    token='shared authToken'
-    try:
-        with MotorController(remote_host, 1092, token) as mc:
-            print(mc.help())
-            mc.set_velocity(0.0,0.0)
-    Except Exception as e:
-        print(e.msg)
-    """
-
-    def __init__(self, ip_address=IP, ip_port=PORT, token=TOKEN):
-        """connect to Motor Control Server at ip_address:ip_port using AuthKey token
-        :param ip_address: IP address (localhost or external IP address), default is 127.0.0.1
-        :param ip_port: port number, default is 1092
-        :param token: authkey, default is read from /home/pi/.motion
-        """
-        try:
-            self.connection = Client((ip_address, ip_port), authkey=token)
-        except AuthenticationError as e:
-            e.msg = 'failed to authenticate, check the token used by the client is the same as that used by the server ... default token is saved at /home/pi/.motion'
-            raise
-        except IOError as e:
-            e.msg = 'failed to connect to the server, default server is 127.0.0.1:1092'
-            raise
-
-    def __enter__(self):
-        """definition of __enter__ for use by context mangaer"""
-        return self
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        """definition of __exit__ for use by context manager"""
-        return self.close()
-
-    def close(self):
-        """close connection with Motor Control Server and return False"""
-        try:
-            self.connection.send(('bye', None, None))
-            self.connection.close()
-        except:
-            pass
-        finally:
-            return False
-
-    def __getattr__(self, item):
-        """custom attribute getter
-        attribute(args) = RPC(args)
-        RPC: send attribute and arguments to Motor Control Server over connection and return received object or raise received exception
-        """
-
-        def attribute(*args, **kwargs):
-            self.connection.send((item, args, kwargs))
-            val = self.connection.recv()
-            if isinstance(val, Exception): raise val
-            return val
-
-        return attribute
-
-
 if __name__ == '__main__':
     __doc__ = """Command line interface for Motor Control Server
     Usage:
     motor_server                        -> display CLI usage
     motor_server help|h|-h              -> display CLI and library usage
     motor_server start|s|-s             -> start the Motor Control Server (to be used within a start-up script), by default listens on 127.0.0.1:1092
-    motor_server cmd [nums]             -> RPC execute cmd(*nums) on Motor Control Server and print returned object """
+                                           and logs telemetry to /home/pi/motor_server.tlog, see telemetry_log.py
+    motor_server simulate [latency]     -> start the Motor Control Server on a simulated PicoBorgRev with i2c latency seconds
+                                           and the token of a --token token option, by default the saved token, or if
+                                           none can be saved a random one, printed for the clients
+    motor_server metrics                -> print latency and throughput metrics of the Motor Control Server
+    motor_server cmd [nums]             -> RPC execute cmd(*nums) on Motor Control Server and print returned object
+    motor_server batch                  -> execute the cmd [nums] lines read from stdin over one connection
+    motor_client.py runs metrics, cmd and batch without loading the server """
     from sys import argv
+    from motor_client import cli
 
     if len(argv) == 1:
         print(__doc__)
     elif argv[1] in ('h', '-h', 'help'):
         print(__doc__)
         print("Available commands:")
-        try:
-            with MotorController() as m:
-                for item in m.help(): print('    {0:<30s}-> {1}'.format(*item))
-        except Exception as e:
-            print(str(e))
+        cli(argv[1:2])
         print('\nLibrary usage:')
         print(MotorControlServer.__doc__)
         print(MotorController.__doc__)
     elif argv[1] in ('s', '-s', 'start'):
-        MotorControlServer().start()
+        MotorControlServer(log=TelemetryLog(MOTOR_LOG)).start()
+    elif argv[1] == 'simulate':
+        args, token = simulation_args(argv[2:])
+        MotorControlServer(token=token, bus=SimulatedPicoBorgRev(*[float(i) for i in args[:1]])).start()
     else:
-        try:
-            with MotorController() as m:
-                print(getattr(m, argv[1])(*[float(i) for i in argv[2:]]))
-        except Exception as e:
-            print(str(e))
+        cli(argv[1:])
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" asyncio Motor Control Server for DiddyBorg, all client connections are served by one event loop """
+import asyncio
+import hmac
+import os
+import pickle
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from time import monotonic
+
+from motor_client import CHALLENGE, FAILURE, MESSAGE_LENGTH, WELCOME, AuthenticationError, split_digest
+from motor_server import (IP, PORT, PICKLE_PROTOCOL, Lease, MotorControlServer, SimulatedPicoBorgRev, authkey,
+                          decode_request, encode_reply, local_peer, simulation_args)
+
+AUTH_TIMEOUT = 5.0  # seconds a new connection has to complete the handshake
+
+
+class StreamConnection(object):
+    """multiprocessing.connection.Connection framing (4 byte length prefix and pickle) over asyncio streams"""
+
+    def __init__(self, reader, writer):
+        self.reader, self.writer = reader, writer
+
+    async def recv_bytes(self, maxlength=None):
+        """receive one length prefixed message"""
+        size, = struct.unpack('!i', await self.reader.readexactly(4))
+        if size == -1: size, = struct.unpack('!Q', await self.reader.readexactly(8))
+        if maxlength is not None and size > maxlength: raise IOError('bad message length')
+        return await self.reader.readexactly(size)
+
+    def send_bytes(self, buf):
+        """queue one length prefixed message on the transport"""
+        header = struct.pack('!i', len(buf)) if len(buf) <= 0x7fffffff else struct.pack('!iQ', -1, len(buf))
+        self.writer.write(header + buf)
+
+    def send(self, obj):
+        """queue one pickled object on the transport"""
+        self.send_bytes(pickle.dumps(obj, PICKLE_PROTOCOL))
+
+    def close(self):
+        """close the transport"""
+        self.writer.close()
+
+    async def deliver_challenge(self, key):
+        """challenge the client to prove it holds key, raise AuthenticationError if it does not"""
+        message = os.urandom(MESSAGE_LENGTH)
+        self.send_bytes(CHALLENGE + message)
+        digest, response = split_digest(await self.recv_bytes(256))
+        if not hmac.compare_digest(hmac.new(key, message, digest).digest(), response):
+            self.send_bytes(FAILURE)
+            raise AuthenticationError('digest received was wrong')
+        self.send_bytes(WELCOME)
+
+    async def answer_challenge(self, key):
+        """answer the challenge of the client, raise AuthenticationError if it does not welcome the answer"""
+        message = await self.recv_bytes(256)
+        if not message.startswith(CHALLENGE): raise AuthenticationError('message = {!r}'.format(message))
+        message = message[len(CHALLENGE):]
+        digest = split_digest(message)[0]
+        response = hmac.new(key, message, digest).digest()
+        self.send_bytes(response if len(message) == MESSAGE_LENGTH else b'{' + digest.encode('ascii') + b'}' + response)
+        if await self.recv_bytes(256) != WELCOME: raise AuthenticationError('digest sent was rejected')
+
+
+class DriveProtocol(asyncio.DatagramProtocol):
+    """udp drive channel, of the datagrams received in one event loop iteration only the newest command is applied"""
+
+    def __init__(self, server):
+        self.server, self.batch = server, []
+
+    def datagram_received(self, data, addr):
+        if not self.batch: asyncio.get_running_loop().call_soon(self.apply)
+        self.batch.append(data)
+
+    def apply(self):
+        batch, self.batch = self.batch, []
+        self.server.__apply_drive__(batch)
+
+
+class AsyncMotorControlServer(MotorControlServer):
+    """Motor Control Server for DiddyBorg serving every client connection on a single asyncio event loop
+    Same verbs, authentication and wire format as MotorControlServer, so MotorController clients are unchanged,
+    but the number of threads stays constant however many clients connect.
+    Example:
+    from motor_server_asyncio import AsyncMotorControlServer
+    mcs = AsyncMotorControlServer()
+    mcs.start()
+    """
+    BUS_VERBS = ('get_id',)  # verbs reading the i2c bus, run on the bus executor
+    CACHED_VERBS = ('status', 'get_velocity', 'get_led')  # verbs reading the telemetry cache, or the bus when fresh
+
+    def start(self):
+        """start the Motor Control Server
+        Run on the event loop of the calling thread:
+            listener - accept and authenticate connections, and serve the requests of every client
+            local - accept connections on the unix socket, authenticated by the peer user or group
+            udp - receive drive datagrams, when a udp port is given
+        Run on a dedicated executor:
+            scheduler - communicates with the PicoBorgRev, steps ramps and sequences, and stops the motors if inactive
+                        for timeout or when a client lease expires
+        Return when the scheduler finishes
+        """
+        asyncio.run(self.__serve__())
+
+    async def __serve__(self):
+        """run the scheduler on its executor and serve clients until stopped"""
+        loop = asyncio.get_running_loop()
+        self.__run__.set()
+        self.__updated__.set()
+        self.__activity__ = monotonic()
+        self.__bus_executor__ = ThreadPoolExecutor(max_workers=1, thread_name_prefix='motor-bus')
+        self.__connections__ = set()  # tasks serving a client connection
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='motor-scheduler') as executor:
+            scheduler = loop.run_in_executor(executor, self.__scheduler__)
+            servers = [await asyncio.start_server(partial(self.__connection__, self.__client__), self.__ip__,
+                                                  self.__port__)]
+            if self.__local__ is not None:
+                if os.path.exists(self.__local__): os.unlink(self.__local__)
+                servers.append(await asyncio.start_unix_server(partial(self.__connection__, self.__local_client__),
+                                                               self.__local__))
+                os.chmod(self.__local__, 0o660)
+            if self.__udp_port__ is not None:
+                udp = (await loop.create_datagram_endpoint(lambda: DriveProtocol(self),
+                                                           local_addr=(self.__ip__, self.__udp_port__)))[0]
+            await scheduler
+            if self.__udp_port__ is not None: udp.close()
+            for server in servers: server.close()
+            connections = list(self.__connections__)  # idle clients would keep wait_closed waiting
+            for connection in connections: connection.cancel()
+            await asyncio.gather(*connections, return_exceptions=True)
+            for server in servers: await server.wait_closed()
+            if self.__local__ is not None and os.path.exists(self.__local__): os.unlink(self.__local__)
+        self.__bus_executor__.shutdown()
+
+    async def __connection__(self, handler, reader, writer):
+        """serve a client connection with handler(reader, writer), the server cancels it when it stops"""
+        task = asyncio.current_task()
+        self.__connections__.add(task)
+        try:
+            await handler(reader, writer)
+        except asyncio.CancelledError:  # the server stopped, the handler closed the connection
+            pass
+        finally:
+            self.__connections__.discard(task)
+
+    async def __client__(self, reader, writer):
+        """authenticate a new connection and handle its requests until the client says bye or disconnects"""
+        conn, key = StreamConnection(reader, writer), authkey(self.__token__)
+        try:
+            await asyncio.wait_for(conn.deliver_challenge(key), AUTH_TIMEOUT)
+            await asyncio.wait_for(conn.answer_challenge(key), AUTH_TIMEOUT)
+            await self.__session__(conn)
+        except (AuthenticationError, asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            conn.close()
+
+    async def __local_client__(self, reader, writer):
+        """let in a unix socket connection of a local_peer and handle its requests until it says bye or disconnects"""
+        conn = StreamConnection(reader, writer)
+        try:
+            if not local_peer(writer.get_extra_info('socket')):
+                conn.send_bytes(FAILURE)
+                return
+            conn.send_bytes(WELCOME)
+            await self.__session__(conn)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            conn.close()
+
+    async def __session__(self, conn):
+        """handle the requests of an authenticated connection, its Lease expires when it ends"""
+        self.__metrics__.connected(1)
+        lease = Lease(self.__lease__)
+        try:
+            await self.__requests__(conn, lease)
+        finally:
+            self.__disconnected__(lease)
+
+    async def __requests__(self, conn, lease):
+        """handle the requests of an authenticated connection until the client says bye or disconnects"""
+        while self.__run__.is_set():
+            try:
+                data = await conn.recv_bytes()
+                start = monotonic() if self.__metrics__.enabled else None
+                opcode, seq, ack, verb, args, kwargs = decode_request(data)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                break
+            except Exception:
+                conn.send(Exception('bad request'))
+                continue
+            if verb in ('bye', 'close', 'exit'):
+                self.__activity__ = monotonic()
+                break
+            result = await self.__execute__(verb, args, kwargs, lease)
+            if ack:
+                conn.send_bytes(encode_reply(opcode, seq, result))
+                await conn.writer.drain()
+            if start is not None: self.__metrics__.request(verb, monotonic() - start)
+
+    async def __execute__(self, verb, args, kwargs, lease):
+        """execute a client request, on the bus executor if it reads the i2c bus, otherwise on the event loop"""
+        if verb in self.BUS_VERBS or verb in self.CACHED_VERBS and (args or kwargs):
+            return await asyncio.get_running_loop().run_in_executor(self.__bus_executor__, self.__rpc__, verb, args,
+                                                                    kwargs, lease)
+        return self.__rpc__(verb, args, kwargs, lease)
+
+
+if __name__ == '__main__':
+    __doc__ = """Command line interface for the asyncio Motor Control Server
+    Usage:
+    motor_server_asyncio                        -> display CLI usage
+    motor_server_asyncio start|s|-s             -> start the Motor Control Server, by default listens on {0}:{1}
+    motor_server_asyncio simulate [latency]     -> start the Motor Control Server on a simulated PicoBorgRev
+                                                   with the token of a --token token option, see motor_server help
+    motor_server cmd [nums]                     -> RPC clients are unchanged, see motor_server help """.format(IP, PORT)
+    from sys import argv
+
+    if len(argv) == 1 or argv[1] in ('h', '-h', 'help'):
+        print(__doc__)
+    elif argv[1] in ('s', '-s', 'start'):
+        AsyncMotorControlServer().start()
+    elif argv[1] == 'simulate':
+        args, token = simulation_args(argv[2:])
+        AsyncMotorControlServer(token=token, bus=SimulatedPicoBorgRev(*[float(i) for i in args[:1]])).start()
+    else:
+        print(__doc__)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pre-roll recorder, keeps the last frames of the camera in a fixed size memory mapped file and exports them on demand
+File layout:
+    header  - magic, version, index entries, data size, frames appended, bytes appended
+    index   - per frame: sequence number, logical position, length and wall clock timestamp, entry = frame % entries
+    data    - circular frame bytes, a frame never wraps, it starts over at offset 0 if it does not fit before the end
+The file is allocated once and written front to back, so the SD card only sees sequential writes of fixed extent.
+Usage:
+    preroll.py export [ring] [seconds] [clip]   -> export the last seconds of a ring file, e.g. after a crash
+"""
+import mmap
+import os
+from struct import Struct
+from threading import Event, Lock, Thread
+from time import strftime, time
+
+PATH = '/home/pi/preroll.ring'
+CLIPS = '/home/pi/preroll'
+MAGIC, VERSION = b'PBPR', 1
+HEADER = Struct('<4sIIQQQ')  # magic, version, index entries, data size, frames appended, bytes appended
+ENTRY = Struct('<QQId')  # sequence number, logical position, length, timestamp
+HEADER_SIZE, ENTRY_SIZE = 64, 32
+
+
+class PrerollRing(object):
+    """circular frame store in a preallocated memory mapped file"""
+
+    def __init__(self, path=PATH, size=64 * 1024 * 1024, entries=4096):
+        """
+        :param path: ring file, reused if it has the same geometry, otherwise recreated
+        :param size: bytes of frame data, 64 MiB is about 40 s of 800x600 mjpeg at 30 fps
+        :param entries: frames indexed, at least the frames that fit in size
+        """
+        self.path, self.size, self.entries = path, size, entries
+        self.data_offset = HEADER_SIZE + entries * ENTRY_SIZE
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != self.data_offset + size:
+                os.ftruncate(fd, 0)
+                os.posix_fallocate(fd, 0, self.data_offset + size)
+            self.map = mmap.mmap(fd, self.data_offset + size)
+        finally:
+            os.close(fd)
+        magic, version, old_entries, old_size, self.frames, self.position = HEADER.unpack_from(self.map, 0)
+        if (magic, version, old_entries, old_size) != (MAGIC, VERSION, entries, size):
+            self.frames = self.position = 0
+            HEADER.pack_into(self.map, 0, MAGIC, VERSION, entries, size, 0, 0)
+        self.lock = Lock()
+
+    @classmethod
+    def open(cls, path=PATH):
+        """return the ring in an existing file, with the geometry recorded in its header"""
+        with open(path, 'rb') as ring:
+            magic, version, entries, size = HEADER.unpack(ring.read(HEADER.size))[:4]
+        if (magic, version) != (MAGIC, VERSION): raise ValueError('{} is not a version {} pre-roll'.format(path, VERSION))
+        return cls(path, size, entries)
+
+    def append(self, seq, frame, timestamp):
+        """copy frame after the previous one, starting over at the front of the data if it does not fit"""
+        if len(frame) > self.size: return
+        with self.lock:
+            offset = self.position % self.size
+            if offset + len(frame) > self.size: self.position += self.size - offset
+            offset = self.position % self.size
+            start = self.data_offset + offset
+            self.map[start:start + len(frame)] = frame
+            ENTRY.pack_into(self.map, HEADER_SIZE + (self.frames % self.entries) * ENTRY_SIZE, seq, self.position,
+                            len(frame), timestamp)
+            self.position += len(frame)
+            self.frames += 1
+            HEADER.pack_into(self.map, 0, MAGIC, VERSION, self.entries, self.size, self.frames, self.position)
+
+    def window(self, seconds):
+        """return (seq, position, length, timestamp) of the frames of the last seconds still in the ring, oldest first"""
+        with self.lock:
+            index, newest = [], None
+            for frame in range(self.frames - 1, max(self.frames - self.entries, 0) - 1, -1):
+                seq, position, length, timestamp = ENTRY.unpack_from(self.map, HEADER_SIZE + (frame % self.entries) *
+                                                                     ENTRY_SIZE)
+                if position < self.position - self.size: break  # overwritten
+                if newest is None: newest = timestamp
+                if timestamp < newest - seconds: break
+                index.append((seq, position, length, timestamp))
+        return index[::-1]
+
+    def export(self, seconds, clip):
+        """write the frames of the last seconds to clip as concatenated JPEGs, return the number of frames written"""
+        frames = self.window(seconds)
+        with open(clip, 'wb') as out:
+            for seq, position, length, timestamp in frames:
+                start = self.data_offset + position % self.size
+                out.write(self.map[start:start + length])
+        return len(frames)
+
+    def close(self):
+        """flush and unmap the ring"""
+        self.map.flush()
+        self.map.close()
+
+
+class PrerollRecorder(object):
+    """append every frame of a StreamingOutput to a PrerollRing, and export the pre-roll window on trigger
+    The recorder runs on its own thread, pinning each new frame just long enough to copy it into the ring, so the
+    encoder never waits on it. While a clip is exported appending pauses, so the window is not overwritten.
+    """
+
+    def __init__(self, output, ring, capture=None, clips=CLIPS):
+        """
+        :param output: StreamingOutput to record
+        :param ring: PrerollRing to record to
+        :param capture: CaptureManager to hold while recording, the camera then records continuously
+        :param clips: directory exported clips are written to
+        """
+        self.output, self.ring, self.capture, self.clips = output, ring, capture, clips
+        self.running, self.frozen = Event(), Lock()
+        self.exports = 0
+        self.running.set()
+        if capture is not None: capture.acquire()
+        self.thread = Thread(target=self.record, daemon=True)
+        self.thread.start()
+
+    def record(self):
+        """copy new frames into the ring until closed"""
+        seq = self.output.seq
+        while self.running.is_set():
+            seq, frame = self.output.acquire(seq, timeout=1.0)
+            if frame is None: continue
+            try:
+                with self.frozen:
+                    self.ring.append(seq, frame, time())
+            finally:
+                self.output.release(frame)
+
+    def trigger(self, seconds=10.0):
+        """export the last seconds to a new clip on a separate thread and return the clip path, waits for an export
+        already running to finish"""
+        if not os.path.isdir(self.clips): os.makedirs(self.clips)
+        clip = os.path.join(self.clips, 'clip-{}-{}.mjpeg'.format(strftime('%Y%m%d-%H%M%S'), self.exports))
+        self.exports += 1
+        self.frozen.acquire()
+        Thread(target=self.export, args=(seconds, clip), daemon=True).start()
+        return clip
+
+    def export(self, seconds, clip):
+        """export the window to clip, then resume appending"""
+        try:
+            self.ring.export(seconds, clip)
+        finally:
+            self.frozen.release()
+
+    def close(self):
+        """stop recording and close the ring"""
+        self.running.clear()
+        self.thread.join()
+        if self.capture is not None: self.capture.release()
+        self.ring.close()
+
+
+if __name__ == '__main__':
+    from sys import argv
+
+    if argv[1:2] == ['export']:
+        ring = PrerollRing.open(*argv[2:3])
+        clip = argv[4] if len(argv) > 4 else 'clip-{}.mjpeg'.format(strftime('%Y%m%d-%H%M%S'))
+        print('{} frames exported to {}'.format(ring.export(float(argv[3]) if len(argv) > 3 else 10.0, clip), clip))
+        ring.close()
+    else:
+        print(__doc__)
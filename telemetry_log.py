@@ -0,0 +1,229 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""
+Telemetry log, an append-only file of fixed size binary records written on a background thread and rotated by size
+File layout:
+    header  - magic, version and record size, padded to one record
+    records - per record: wall clock timestamp, kind and four values, in order of appending
+Kinds and their values:
+    drive   - linear and angular velocity, motor A and motor B PWM, negative in reverse
+    led     - LED state, 1 is ON
+    ups     - battery volts, Pi supply volts, celsius and power mode, 1 on Pi supply and 2 on battery
+append() only queues the record, so the loops logging never wait on the SD card, and records the queue cannot hold are
+counted as dropped. When a file reaches its size limit it is renamed path.1, older files move up to path.2 and so on.
+Usage:
+    telemetry_log.py query path [field] [start] [end]    -> print the records of a kind or kind.field from start to end
+    telemetry_log.py summary path [field] [start] [end]  -> print count, min, mean and max of each field
+    start and end are seconds since the epoch, negative values are seconds before the last record, field 'all' is every
+    kind
+"""
+import mmap
+import os
+from datetime import datetime
+from struct import Struct
+from threading import Event, Thread
+from time import time
+
+try:
+    from queue import Queue, Empty, Full
+except ImportError:  # python2
+    from Queue import Queue, Empty, Full
+
+MOTOR_LOG, UPS_LOG = '/home/pi/motor_server.tlog', '/home/pi/ups.tlog'
+MAGIC, VERSION = b'PBTL', 1
+RECORD = Struct('<dB3x4f')  # timestamp, kind, values
+HEADER = Struct('<4sII{}x'.format(RECORD.size - 12))  # magic, version, record size
+TIMESTAMP = Struct('<d')
+KINDS = ('drive', 'led', 'ups')
+FIELDS = {'drive': ('linear', 'angular', 'motorA', 'motorB'), 'led': ('led',),
+          'ups': ('battery', 'rpi', 'celsius', 'power')}
+PADDING = (0.0,) * 4
+MAX_BYTES, BACKUPS = 4 * 1024 * 1024, 4  # bytes per file, about 150000 records, and rotated files kept
+QUEUE_SIZE, FLUSH = 4096, 1.0  # records waiting to be written, and seconds between writes
+
+
+def files(path):
+    """return the rotated files of path and path itself, those that exist, oldest first"""
+    rotated, n = [], 1
+    while os.path.exists('{}.{}'.format(path, n)):
+        rotated.append('{}.{}'.format(path, n))
+        n += 1
+    return rotated[::-1] + ([path] if os.path.exists(path) else [])
+
+
+def first_at(data, count, start):
+    """return the index of the first of count records in data stamped at or after start"""
+    low, high = 0, count
+    while low < high:
+        middle = (low + high) // 2
+        if TIMESTAMP.unpack_from(data, (middle + 1) * RECORD.size)[0] < start:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def records(path, start=None, end=None, kinds=KINDS):
+    """yield (timestamp, kind, values) of the records of path and its rotated files stamped between start and end
+    :param path: telemetry log, read through memory maps
+    :param start: seconds since the epoch of the first record, default is the oldest
+    :param end: seconds since the epoch of the last record, default is the newest
+    :param kinds: kinds of records to yield, default is every kind
+    """
+    codes = tuple(KINDS.index(kind) for kind in kinds)
+    for name in files(path):
+        with open(name, 'rb') as log:
+            if os.fstat(log.fileno()).st_size <= HEADER.size: continue
+            data = mmap.mmap(log.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if HEADER.unpack_from(data, 0) != (MAGIC, VERSION, RECORD.size): continue
+            count = len(data) // RECORD.size - 1
+            for n in range(0 if start is None else first_at(data, count, start), count):
+                record = RECORD.unpack_from(data, (n + 1) * RECORD.size)
+                if end is not None and record[0] > end: return
+                if record[1] in codes:
+                    kind = KINDS[record[1]]
+                    yield record[0], kind, record[2:2 + len(FIELDS[kind])]
+        finally:
+            data.close()
+
+
+def last(path):
+    """return the timestamp of the newest record of path, None if there is none"""
+    for name in files(path)[::-1]:
+        with open(name, 'rb') as log:
+            size = os.fstat(log.fileno()).st_size // RECORD.size * RECORD.size
+            if size <= HEADER.size: continue
+            log.seek(size - RECORD.size)
+            return RECORD.unpack(log.read(RECORD.size))[0]
+    return None
+
+
+class TelemetryLog(object):
+    """binary log of fixed size records, appended without blocking and rotated by size
+    Example:
+    from telemetry_log import TelemetryLog, records
+    log = TelemetryLog('/tmp/robot.tlog')
+    log.append('ups', 4.12, 5.08, 35, 1)
+    log.close()
+    for timestamp, kind, values in records('/tmp/robot.tlog'): print(timestamp, kind, values)
+    """
+
+    def __init__(self, path, max_bytes=MAX_BYTES, backups=BACKUPS, queue_size=QUEUE_SIZE, flush=FLUSH):
+        """
+        :param path: file to append to, continued if it is a log of this version, otherwise rotated away
+        :param max_bytes: size at which the file is rotated
+        :param backups: rotated files kept, the oldest is deleted
+        :param queue_size: records waiting to be written, more are dropped
+        :param flush: seconds between writes, the records of the interval are written together
+        """
+        self.path, self.max_bytes, self.backups, self.flush = path, max_bytes, backups, flush
+        self.queue = Queue(queue_size)
+        self.written = self.dropped = self.failed = self.rotations = 0
+        self.file, self.size = None, 0
+        self.open()
+        self.stopped = Event()
+        self.thread = Thread(target=self.write)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def open(self):
+        """open the file for appending, rotating away a file that is not a log of this version, and cutting off a
+        record left partly written"""
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if size:
+            with open(self.path, 'rb') as log:
+                header = log.read(HEADER.size)
+            if len(header) < HEADER.size or HEADER.unpack(header) != (MAGIC, VERSION, RECORD.size):
+                self.rotate()
+                size = 0
+        self.file = open(self.path, 'ab')
+        if size % RECORD.size:
+            size -= size % RECORD.size
+            self.file.truncate(size)
+        if not size:
+            self.file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+            self.file.flush()
+            size = HEADER.size
+        self.size = size
+
+    def rotate(self):
+        """rename the file to path.1 and move the older files up, deleting the oldest"""
+        if self.file is not None: self.file.close()
+        self.file = None
+        for n in range(self.backups, 0, -1):
+            older = '{}.{}'.format(self.path, n - 1) if n > 1 else self.path
+            if os.path.exists(older): os.rename(older, '{}.{}'.format(self.path, n))  # replaces the oldest
+        if not self.backups and os.path.exists(self.path): os.remove(self.path)
+        self.rotations += 1
+
+    def append(self, kind, *values):
+        """queue a record of kind with up to four values, stamped now, drop it if the queue is full"""
+        try:
+            self.queue.put_nowait((time(), KINDS.index(kind), values))
+        except Full:
+            self.dropped += 1
+
+    def write(self):
+        """write the queued records every flush interval until closed, then the records left"""
+        while not self.stopped.wait(self.flush): self.drain()
+        self.drain()
+
+    def drain(self):
+        """write the records in the queue with one write, rotating the file first if it is full"""
+        batch = []
+        try:
+            while True: batch.append(self.queue.get_nowait())
+        except Empty:
+            pass
+        if not batch: return
+        try:
+            if self.size >= self.max_bytes:
+                self.rotate()
+                self.open()
+            self.file.write(b''.join(RECORD.pack(timestamp, code, *(values + PADDING)[:4])
+                                     for timestamp, code, values in batch))
+            self.file.flush()
+            self.size += len(batch) * RECORD.size
+            self.written += len(batch)
+        except (IOError, OSError):  # e.g. SD card full, keep logging loops running and count the loss
+            self.failed += len(batch)
+
+    @property
+    def stats(self):
+        """return number of records written, dropped by a full queue, lost to failed writes, and file rotations"""
+        return (('written', self.written), ('dropped', self.dropped), ('failed', self.failed),
+                ('rotations', self.rotations))
+
+    def close(self):
+        """write the records left and close the file"""
+        self.stopped.set()
+        self.thread.join()
+        if self.file is not None: self.file.close()
+
+
+if __name__ == '__main__':
+    from sys import argv
+
+    if len(argv) > 2 and argv[1] in ('query', 'summary'):
+        field = argv[3] if len(argv) > 3 else 'all'
+        kind, _, name = field.partition('.')
+        kinds = KINDS if kind == 'all' else (kind,)
+        newest = last(argv[2]) or 0.0
+        start, end = (tuple(float(t) if float(t) >= 0 else newest + float(t) for t in argv[4:6]) + (None, None))[:2]
+        if argv[1] == 'query':
+            for timestamp, kind, values in records(argv[2], start, end, kinds):
+                print('{0}\t{1}\t{2}'.format(datetime.fromtimestamp(timestamp), kind, '\t'.join(
+                    '{0}={1:g}'.format(f, v) for f, v in zip(FIELDS[kind], values) if not name or f == name)))
+        else:
+            totals = {}  # kind.field -> [count, min, sum, max]
+            for timestamp, kind, values in records(argv[2], start, end, kinds):
+                for f, v in zip(FIELDS[kind], values):
+                    if name and f != name: continue
+                    total = totals.setdefault(kind + '.' + f, [0, v, 0.0, v])
+                    total[:] = total[0] + 1, min(total[1], v), total[2] + v, max(total[3], v)
+            for f in sorted(totals):
+                count, low, total, high = totals[f]
+                print('{0:<16s}count={1} min={2:g} mean={3:g} max={4:g}'.format(f, count, low, total / count, high))
+    else:
+        print(__doc__)
@@ -0,0 +1,52 @@
+import sys
+from os import path
+from socket import socket
+from threading import Thread
+from time import monotonic, sleep
+
+import pytest
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from motor_client import MotorController
+from motor_server import MotorControlServer, SimulatedPicoBorgRev
+
+TOKEN = 'test-token'
+
+
+def free_port():
+    """return a tcp port nothing listens on"""
+    sock = socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+@pytest.fixture
+def motor_server():
+    """factory starting a MotorControlServer on a simulated PicoBorgRev, returning its port and bus, the servers are
+    stopped after the test"""
+    started = []
+
+    def start(**kwargs):
+        port, bus = free_port(), SimulatedPicoBorgRev()
+        kwargs.setdefault('local', False)
+        server = MotorControlServer('127.0.0.1', port, token=TOKEN, bus=bus, **kwargs)
+        thread = Thread(target=server.start)
+        thread.daemon = True
+        thread.start()
+        started.append((port, thread))
+        deadline = monotonic() + 5.0
+        while True:
+            try:
+                MotorController('127.0.0.1', port, TOKEN, local=False).close()
+                return port, bus
+            except IOError:
+                if monotonic() > deadline: raise
+                sleep(0.05)
+
+    yield start
+    for port, thread in started:
+        with MotorController('127.0.0.1', port, TOKEN, local=False) as mc: mc.stop()
+        thread.join(5.0)
@@ -0,0 +1,141 @@
+import sys
+from socket import create_connection, timeout as socket_timeout
+from subprocess import check_output
+from threading import Thread
+from time import monotonic, sleep
+
+import pytest
+
+import camera
+from camera import AsyncStreamingServer, CaptureManager, FakeCameraBackend, RenditionCache, StreamingOutput
+from conftest import free_port
+
+
+def jpeg(n, size=64):
+    """return a JPEG-framed payload of size bytes, distinct for each n"""
+    return b'\xff\xd8' + bytes([n]) * (size - 4) + b'\xff\xd9'
+
+
+def publish(output, frame):
+    """write frame to output and publish it"""
+    output.write(frame)
+    output.flush()
+
+
+def test_frames_in_sequence():
+    output, seqs = StreamingOutput(slots=3, slot_size=16), []
+    output.subscribe(seqs.append)
+    publish(output, jpeg(1))
+    seq, frame = output.acquire()
+    assert seq == 1 and frame == jpeg(1)
+    output.release(frame)
+    assert output.acquire(after=1, timeout=0.05) == (1, None)
+    publish(output, jpeg(2, 1024))  # grows its slot
+    seq, frame = output.acquire(after=1)
+    assert seq == 2 and frame == jpeg(2, 1024)
+    output.release(frame)
+    assert seqs == [1, 2]
+
+
+def test_pinned_frame_is_not_overwritten():
+    output = StreamingOutput(slots=2, slot_size=64)
+    publish(output, jpeg(1))
+    seq, frame = output.acquire()
+    publish(output, jpeg(2))
+    for n in range(3, 6): publish(output, jpeg(n))  # no free slot, dropped
+    assert frame == jpeg(1) and output.dropped >= 3
+    output.release(frame)
+    publish(output, jpeg(6))
+    publish(output, jpeg(7))
+    seq, frame = output.acquire(after=seq)
+    assert frame == jpeg(7) and output.pins == [1 if s is frame.obj else 0 for s in output.slots]
+    output.release(frame)
+    assert output.pins == [0, 0]
+
+
+def test_grace_lifecycle():
+    output, backend = StreamingOutput(), FakeCameraBackend(framerate=100, size=1024)
+    capture = CaptureManager(backend, output, grace=0.2)
+    assert capture.acquire()
+    capture.release()
+    sleep(0.05)
+    assert not capture.acquire()  # back within the grace period, still recording
+    assert (capture.recording, capture.starts, capture.stops) == (True, 1, 0)
+    capture.release()
+    sleep(0.4)
+    assert (capture.recording, capture.starts, capture.stops) == (False, 1, 1)
+    assert output.seq and backend.frames
+    assert capture.acquire()
+    assert capture.starts == 2
+    capture.close()
+    assert not capture.recording
+
+
+def test_etags_differ_across_restarts():
+    assert camera.etag(1, None) != camera.etag(2, None) != camera.etag(2, (320, 240, 50))
+    restarted = check_output([sys.executable, '-c', 'import camera; print(camera.etag(1, None))'],
+                             cwd=camera.__file__.rpartition('/')[0]).decode('ascii').strip()
+    assert restarted != camera.etag(1, None)
+
+
+class SlowCache(RenditionCache):
+    """renditions encoded by a slow fake encoder, rendition (1, 1, 1) cannot be decoded"""
+    encodes = []
+
+    @staticmethod
+    def encode(frame, key):
+        SlowCache.encodes.append(key)
+        sleep(0.2)
+        if key == (1, 1, 1): raise OSError('cannot identify image file')
+        return b'\xff\xd8' + '{}x{}q{}'.format(*key).encode('ascii') + b'\xff\xd9'
+
+
+def test_renditions_encoded_once_outside_the_lock(monkeypatch):
+    monkeypatch.setattr(camera, 'Image', object())
+    cache, results = SlowCache(), []
+    SlowCache.encodes[:] = []
+    threads = [Thread(target=lambda key=key: results.append(cache.get(1, jpeg(1), key)))
+               for key in ((320, 240, 50), (320, 240, 50), (160, 120, 50))]
+    start = monotonic()
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    assert monotonic() - start < 0.35
+    assert sorted(SlowCache.encodes) == [(160, 120, 50), (320, 240, 50)]
+    assert sorted(results) == sorted([b'\xff\xd8320x240q50\xff\xd9'] * 2 + [b'\xff\xd8160x120q50\xff\xd9'])
+    with pytest.raises(OSError): cache.get(1, jpeg(1), (1, 1, 1))
+    assert (1, 1, 1) not in cache.renditions
+
+
+def viewer(port, query, frames, duration):
+    """append the number of frames /stream.mjpg?query delivers in duration seconds to frames"""
+    sock = create_connection(('127.0.0.1', port))
+    sock.sendall('GET /stream.mjpg?{} HTTP/1.1\r\nHost: localhost\r\n\r\n'.format(query).encode('ascii'))
+    sock.settimeout(0.1)
+    received, end = b'', monotonic() + duration
+    while monotonic() < end:
+        try:
+            received += sock.recv(65536)
+        except socket_timeout:
+            pass
+    sock.close()
+    frames.append(received.count(b'--FRAME\r\n'))
+
+
+def test_broadcast_encodes_off_the_event_loop(monkeypatch):
+    monkeypatch.setattr(camera, 'Image', object())
+    output, port = StreamingOutput(), free_port()
+    server = AsyncStreamingServer(('127.0.0.1', port), output, cache=SlowCache())
+    Thread(target=server.serve_forever, daemon=True).start()
+    sleep(0.2)
+    source, scaled, broken = [], [], []
+    viewers = [Thread(target=viewer, args=(port, query, frames, 1.0))
+               for query, frames in (('', source), ('size=320x240', scaled), ('size=1x1&quality=1', broken))]
+    for thread in viewers: thread.start()
+    sleep(0.1)
+    for n in range(40):
+        publish(output, jpeg(n))
+        sleep(0.02)
+    for thread in viewers: thread.join()
+    assert source[0] >= 30  # not held up by the encoder
+    assert 1 <= scaled[0] <= 6  # one frame per encoding
+    assert broken == [0]
@@ -0,0 +1,67 @@
+from socket import create_connection, socket, SOL_SOCKET, SO_LINGER
+from struct import pack
+from time import monotonic, sleep
+
+import pytest
+
+from conftest import TOKEN
+from fleet import Fleet
+from motor_server import PWM_MAX
+
+
+@pytest.fixture
+def silent():
+    """address of a socket that accepts connections but never answers the handshake"""
+    sock = socket()
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(8)
+    yield sock.getsockname()
+    sock.close()
+
+
+def test_unresponsive_robot_costs_one_timeout(motor_server, silent):
+    port, bus = motor_server()
+    with Fleet({'live': ('127.0.0.1', port), 'silent': silent}, TOKEN, timeout=0.3) as fleet:
+        start = monotonic()
+        results = dict(fleet.get_velocity())
+        assert monotonic() - start < 1.0
+        assert dict(results['live']) == {'motorA': 0, 'motorB': 0}
+        assert isinstance(results['silent'], IOError)
+        assert dict(dict(fleet.stats)['live'])['failures'] == 0
+
+
+def test_backoff_doubles_up_to_max(silent):
+    with Fleet({'silent': silent}, TOKEN, timeout=0.1, backoff=0.2, max_backoff=0.3) as fleet:
+        robot = fleet.robots['silent']
+        fleet.get_velocity()
+        assert (robot.failures, robot.delay) == (1, 0.2)
+        start = monotonic()
+        assert 'retrying' in str(dict(fleet.get_velocity())['silent'])
+        assert monotonic() - start < 0.1 and robot.failures == 1
+        sleep(0.2)
+        fleet.get_velocity()
+        assert (robot.failures, robot.delay) == (2, 0.3)
+        sleep(0.3)
+        fleet.get_velocity()
+        assert (robot.failures, robot.delay) == (3, 0.3)
+
+
+def test_server_exception_is_a_result(motor_server):
+    port, bus = motor_server()
+    with Fleet({'live': ('127.0.0.1', port)}, TOKEN) as fleet:
+        assert isinstance(dict(fleet.set_velocity(2.0))['live'], AssertionError)
+        assert dict(dict(fleet.stats)['live']) == {'connected': True, 'connects': 1, 'calls': 1, 'failures': 0}
+
+
+def test_reconnect_after_a_connection_dropped_mid_handshake(motor_server):
+    port, bus = motor_server()
+    with Fleet({'live': ('127.0.0.1', port)}, TOKEN, backoff=0.01) as fleet:
+        fleet.set_velocity(0.5)
+        dropped = create_connection(('127.0.0.1', port))
+        dropped.recv(64)  # the challenge
+        dropped.setsockopt(SOL_SOCKET, SO_LINGER, pack('ii', 1, 0))
+        dropped.close()  # reset instead of answering
+        fleet.robots['live'].failed()
+        sleep(0.05)
+        assert dict(dict(fleet.get_velocity())['live'])['motorA'] == int(PWM_MAX * 0.5)
+        assert dict(dict(fleet.stats)['live'])['connects'] == 2
@@ -0,0 +1,73 @@
+import os
+from threading import Timer
+from time import monotonic
+
+import pytest
+
+import frame_bus
+from camera import StreamingOutput
+from frame_bus import HEADER_SIZE, NOTIFY, SEQ_OFFSET, SLOT, SLOT_HEADER_SIZE, FrameBusReader, FrameBusWriter
+
+NAME = 'piborg-frames-test-{}'.format(os.getpid())
+
+
+def jpeg(n, size=64):
+    """return a JPEG-framed payload of size bytes, distinct for each n"""
+    return b'\xff\xd8' + bytes([n]) * (size - 4) + b'\xff\xd9'
+
+
+@pytest.fixture
+def bus(monkeypatch, tmp_path):
+    monkeypatch.setattr(frame_bus, 'SOCKET_DIR', str(tmp_path / 'camera'))
+    writer = FrameBusWriter(StreamingOutput(), name=NAME, slots=3, slot_size=1024, group=None)
+    reader = FrameBusReader(NAME)
+    yield writer, reader
+    reader.close()
+    writer.close()
+
+
+def test_socket_dir_is_private(monkeypatch, tmp_path):
+    monkeypatch.setattr(frame_bus, 'SOCKET_DIR', str(tmp_path))
+    os.chmod(str(tmp_path), 0o777)
+    with pytest.raises(PermissionError): FrameBusWriter(StreamingOutput(), name=NAME, group=None)
+
+
+def test_reader_gets_newest_frame(bus):
+    writer, reader = bus
+    assert os.stat(frame_bus.SOCKET_DIR).st_mode & 0o777 == 0o750
+    for seq in (1, 2, 3): writer.publish(seq, jpeg(seq))
+    frame = reader.wait(0, timeout=1)
+    assert (frame.seq, bytes(frame.data)) == (3, jpeg(3)) and frame.valid()
+    frame.release()
+    assert reader.wait(3, timeout=0.05) is None
+    writer.publish(4, jpeg(4, 2048))  # larger than a slot
+    assert writer.stats['oversized'] == 1 and reader.wait(3, timeout=0.05) is None
+
+
+def test_lapped_frame_is_invalid(bus):
+    writer, reader = bus
+    writer.publish(1, jpeg(1))
+    frame = reader.wait(0, timeout=1)
+    writer.publish(2, jpeg(2))
+    writer.publish(3, jpeg(3))
+    assert frame.valid()  # slots - 1 frames later it is still intact
+    writer.publish(4, jpeg(4))
+    assert not frame.valid() and bytes(frame.data) == jpeg(4)
+    frame.release()
+    frame = reader.newest()
+    assert (frame.seq, bytes(frame.data)) == (4, jpeg(4))
+    frame.release()
+
+
+def test_frame_being_written_is_not_read(bus):
+    writer, reader = bus
+    writer.publish(2, jpeg(2))
+    offset = HEADER_SIZE + (5 % writer.slots) * (SLOT_HEADER_SIZE + writer.slot_size)
+    SLOT.pack_into(writer.shm.buf, offset, 2 * 5 + 1, 0, 0.0)  # writer preempted while copying frame 5
+    NOTIFY.pack_into(writer.shm.buf, SEQ_OFFSET, 5)
+    Timer(0.1, writer.publish, (5, jpeg(5))).start()
+    start = monotonic()
+    frame = reader.newest()
+    assert monotonic() - start >= 0.1
+    assert (frame.seq, bytes(frame.data)) == (5, jpeg(5)) and frame.valid()
+    frame.release()
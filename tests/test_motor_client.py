@@ -0,0 +1,74 @@
+import pickle
+
+from conftest import TOKEN
+from motor_client import (OPCODES, PROTOCOL_BINARY, MotorController, decode_reply, decode_request, encode_reply,
+                          encode_request)
+from motor_server import PWM_MAX
+
+REPLIES = {
+    'set_velocity': (('linear', 0.5), ('angular', -0.25), ('motorA', 42), ('motorB', -127)),
+    'set_led': (('led', 'ON'),),
+    'get_velocity': (('motorA', 0), ('motorB', 85)),
+}
+
+
+def test_request_round_trip():
+    assert decode_request(encode_request('set_velocity', (0.5, -0.25), {})) == (
+        OPCODES['set_velocity'], None, True, 'set_velocity', (0.5, -0.25), {})
+    assert decode_request(encode_request('set_velocity', (0.5,), {}))[4] == (0.5, 0.0)
+    assert decode_request(encode_request('set_velocity', (), {'angular': 0.1, 'linear': 0.2}))[4] == (0.2, 0.1)
+    assert decode_request(encode_request('get_velocity', (), {}))[3:5] == ('get_velocity', ())
+
+
+def test_pickled_requests():
+    assert encode_request('status', (), {}) is None
+    assert encode_request('set_velocity', ('fast',), {}) is None
+    assert encode_request('set_velocity', (0.5,), {'speed': 1}) is None
+    assert decode_request(pickle.dumps(('status', (), {'fresh': True}))) == (None, None, True, 'status', (),
+                                                                            {'fresh': True})
+
+
+def test_reply_round_trip():
+    for verb, reply in REPLIES.items():
+        frame = encode_reply(OPCODES[verb], None, reply)
+        assert len(frame) < len(pickle.dumps(reply, 2))
+        assert decode_reply(frame) == (None, reply)
+
+
+def test_exception_replies():
+    seq, error = decode_reply(encode_reply(OPCODES['set_velocity'], None, AssertionError('out of range')))
+    assert seq is None and isinstance(error, AssertionError) and error.args == ('out of range',)
+    seq, error = decode_reply(encode_reply(OPCODES['get_velocity'], None, (('motorA', 'fast'), ('motorB', 0))))
+    assert isinstance(error, Exception)
+    assert decode_reply(encode_reply(None, None, (('pid', 1),))) == (None, (('pid', 1),))
+
+
+def test_binary_protocol_matches_pickle(motor_server):
+    port, bus = motor_server()
+    with MotorController('127.0.0.1', port, TOKEN, local=False) as binary:
+        with MotorController('127.0.0.1', port, TOKEN, protocol=0, local=False) as pickled:
+            assert binary.protocol >= PROTOCOL_BINARY and pickled.protocol == 0
+            assert binary.set_velocity(0.5, 0.1) == pickled.set_velocity(0.5, 0.1)
+            assert binary.set_led(1) == pickled.set_led(1) == (('led', 'ON'),)
+            assert binary.get_velocity() == pickled.get_velocity()
+
+
+def test_pipelined_frames():
+    opcode, seq, ack, verb, args, kwargs = decode_request(encode_request('set_led', (1,), {}, 7, ack=False))
+    assert (opcode, seq, ack, verb, args) == (OPCODES['set_led'], 7, False, 'set_led', (1.0,))
+    assert decode_reply(encode_reply(opcode, 7, REPLIES['set_led']), sequenced=True) == (7, REPLIES['set_led'])
+    assert decode_reply(encode_reply(None, 8, (('pid', 1),)), sequenced=True) == (8, (('pid', 1),))
+
+
+def test_pipelined_replies_in_order(motor_server):
+    port, bus = motor_server()
+    with MotorController('127.0.0.1', port, TOKEN, local=False, pipelined=True, ack_velocity=False, window=4) as mc:
+        for n in range(20): assert mc.set_velocity(n / 40.0) is None
+        led, velocity, error, status = mc.set_led(1), mc.get_velocity(), mc.set_target_velocity(2.0), mc.status()
+        assert not led.done()
+        replies = mc.flush()
+        assert replies[0] == (('led', 'ON'),) and led.result() == replies[0]
+        pwm = int(PWM_MAX * 19 / 40.0)
+        assert velocity.result() == replies[1] == (('motorA', pwm), ('motorB', pwm))
+        assert isinstance(replies[2], AssertionError)
+        assert dict(status.result())['led'] == 'ON'
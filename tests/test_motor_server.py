@@ -0,0 +1,266 @@
+import os
+from random import Random
+from socket import socket, AF_INET, AF_UNIX, SOCK_DGRAM, SOCK_STREAM
+from time import sleep
+
+import pytest
+
+import motor_client
+from conftest import TOKEN, free_port
+from motor_client import MotorController, drive_key, encode_drive
+from motor_server import (DRIVE_SESSIONS, FAILSAFE_TIMEOUT, GET_A, GET_LED, HEARTBEAT, PWM_MAX, SET_A_FWD, SET_B_FWD,
+                          SET_B_REV, SET_LED, DriveChannel, MotionProfile, MotionSequence, ShadowRegisters,
+                          TelemetryCache, local_peer)
+
+
+def shadow():
+    """return ShadowRegisters recording its writes, and the list of writes"""
+    writes = []
+    return ShadowRegisters(lambda offset, value: writes.append((offset, value)) or True), writes
+
+
+def test_sync_writes_only_changes():
+    registers, writes = shadow()
+    assert registers.sync(((SET_A_FWD, 10), (SET_B_FWD, 10), (SET_LED, 1))) == 3
+    assert registers.sync(((SET_A_FWD, 10), (SET_B_REV, 20), (SET_LED, 1))) == 1
+    assert writes[3:] == [(SET_B_REV, 20)]
+
+
+def test_one_keepalive_per_heartbeat_while_running():
+    registers, writes = shadow()
+    running, off = ((SET_A_FWD, 10), (SET_B_FWD, 10), (SET_LED, 1)), ((SET_A_FWD, 0), (SET_B_FWD, 0), (SET_LED, 1))
+    registers.sync(running, True)
+    assert registers.sync(running) == 0
+    assert registers.sync(running, True) == 1 and writes[-1] == (SET_A_FWD, 10)
+    assert registers.sync(off, True) == 2
+    assert registers.sync(off, True) == 0
+    assert dict(registers.stats) == {'writes': 6, 'keepalives': 1, 'saved': 6, 'failures': 0}
+
+
+def test_rewrite_both_motors_after_failsafe_timeout():
+    registers, writes = shadow()
+    running = ((SET_A_FWD, 10), (SET_B_FWD, 10), (SET_LED, 1))
+    registers.sync(running)
+    sleep(FAILSAFE_TIMEOUT + 0.05)
+    assert registers.sync(running) == 2
+    assert writes[3:] == [(SET_A_FWD, 10), (SET_B_FWD, 10)]
+
+
+def test_keepalive_between_offgrid_commands(motor_server):
+    port, bus = motor_server(metrics=False)
+    pace = Random(1)
+    with MotorController('127.0.0.1', port, TOKEN, local=False) as mc:
+        for n in range(12):
+            mc.set_velocity(0.5 if n % 2 else 0.4)
+            sleep(pace.uniform(0.05, 0.3))
+        assert bus.failsafe == 1
+        assert bus.failsafe_trips == 0
+        assert all(pwm for direction, pwm in bus.motors)
+
+
+def test_idle_bus_writes(motor_server):
+    port, bus = motor_server(metrics=False)
+    with MotorController('127.0.0.1', port, TOKEN, local=False) as mc:
+        writes = bus.writes
+        sleep(1.0)
+        assert bus.writes == writes
+        mc.set_velocity(0.5)
+        sleep(0.1)
+        writes = bus.writes
+        sleep(1.0)
+        assert bus.writes - writes <= 1.0 / HEARTBEAT + 1
+        assert bus.failsafe_trips == 0
+
+
+def test_telemetry_ttl():
+    blocks = []
+    cache = TelemetryCache(lambda offset: blocks.append(offset) or [offset, 2, 10], ttl=0.1)
+    assert cache.cached(GET_A) is None
+    assert cache.read(GET_A) == [GET_A, 2, 10]
+    assert cache.cached(GET_A) == [GET_A, 2, 10]
+    sleep(0.15)
+    assert cache.cached(GET_A) is None
+    cache.read(GET_A)
+    cache.invalidate(GET_A)
+    assert cache.cached(GET_A) is None
+    assert blocks == [GET_A, GET_A]
+
+
+def test_telemetry_refreshed_only_while_polled():
+    blocks = []
+    cache = TelemetryCache(lambda offset: blocks.append(offset) or [offset, 0, 0], rate=100.0, ttl=0.1)
+    cache.refresh()
+    assert not blocks
+    cache.cached(GET_LED)
+    cache.refresh()
+    assert blocks == list(TelemetryCache.REGISTERS)
+    assert cache.cached(GET_LED) == [GET_LED, 0, 0]
+    sleep(0.15)
+    cache.refresh()
+    assert len(blocks) == len(TelemetryCache.REGISTERS)
+
+
+def test_reads_answer_the_last_command_without_the_bus(motor_server):
+    port, bus = motor_server(metrics=False)
+    with MotorController('127.0.0.1', port, TOKEN, local=False) as mc:
+        reads = bus.reads
+        sleep(0.5)
+        assert bus.reads == reads
+        pwm = dict(mc.set_velocity(0.5, 0.1))
+        mc.set_led(1)
+        assert dict(mc.get_velocity()) == {'motorA': pwm['motorA'], 'motorB': pwm['motorB']}
+        assert dict(mc.status())['led'] == 'ON'
+        assert bus.reads == reads
+        sleep(0.3)
+        assert dict(mc.get_velocity(True)) == {'motorA': pwm['motorA'], 'motorB': pwm['motorB']}
+        assert bus.reads == reads + 2
+
+
+def test_drive_channel_latest_wins_and_replays():
+    channel, key = DriveChannel(TOKEN), drive_key(TOKEN)
+    session = channel.issue()
+    assert channel.newest([encode_drive(key, session, 1, 0.1, 0.0), encode_drive(key, session, 3, 0.3, 0.0),
+                           encode_drive(key, session, 2, 0.2, 0.0)]) == (0.3, 0.0)
+    assert channel.newest([encode_drive(key, session, 3, 0.3, 0.0)]) is None
+    assert dict(channel.stats) == {'received': 4, 'applied': 1, 'stale': 3, 'rejected': 0}
+
+
+def test_drive_channel_rejects_unknown_sessions():
+    channel, key = DriveChannel(TOKEN), drive_key(TOKEN)
+    session = channel.issue()
+    captured = encode_drive(key, session, 1, 0.5, 0.0)
+    assert channel.newest([encode_drive(key, session + 1, 1, 0.5, 0.0)]) is None
+    assert channel.newest([encode_drive(drive_key('other'), session, 1, 0.5, 0.0)]) is None
+    assert DriveChannel(TOKEN).newest([captured]) is None  # a restarted server issued no sessions yet
+    for n in range(DRIVE_SESSIONS): channel.issue()
+    assert channel.newest([captured]) is None  # forgotten
+    assert dict(channel.stats)['rejected'] == 3
+
+
+def test_udp_drive(motor_server):
+    udp_port = free_port()
+    port, bus = motor_server(udp_port=udp_port)
+    with MotorController('127.0.0.1', port, TOKEN, local=False, udp_port=udp_port) as mc:
+        mc.drive(0.5)
+        sleep(0.2)
+        assert dict(mc.get_velocity())['motorA'] == int(PWM_MAX * 0.5)
+        forged = socket(AF_INET, SOCK_DGRAM)
+        forged.sendto(encode_drive(drive_key(TOKEN), 1, 1, 1.0, 0.0), ('127.0.0.1', udp_port))
+        forged.close()
+        sleep(0.2)
+        assert dict(mc.get_velocity())['motorA'] == int(PWM_MAX * 0.5)
+        assert dict(mc.udp_stats()) == {'received': 2, 'applied': 1, 'stale': 0, 'rejected': 1}
+
+
+def test_motion_profile_limits():
+    profile, dt, values = MotionProfile(), 0.01, [(0.0, 0.0)]
+    profile.start((0.0, 0.0), (1.0, -0.5), accel=1.0, jerk=10.0, now=0.0)
+    while profile.active: values.append(profile.step(len(values) * dt))
+    rates = [(b[0] - a[0]) / dt for a, b in zip(values, values[1:])]
+    assert 1.05 <= len(values) * dt <= 1.2  # about accel / jerk longer than without a jerk limit
+    assert values[-1] == (1.0, -0.5) and all(0.0 <= value[0] <= 1.0 and -0.5 <= value[1] <= 0.0 for value in values)
+    assert max(rates) <= 1.0 + 1e-9 and all(abs(b - a) <= 10.0 * dt + 1e-9 for a, b in zip(rates[:-1], rates[1:-1]))
+    assert profile.step(10.0) is None
+    profile.start((0.0, 0.0), (-1.0, 0.0), accel=1.0, jerk=None, now=0.0)
+    assert profile.step(0.5) == (-0.5, 0.0) and profile.step(1.5) == (-1.0, 0.0) and not profile.active
+
+
+def test_target_velocity_ramp(motor_server):
+    port, bus = motor_server()
+    with MotorController('127.0.0.1', port, TOKEN, local=False) as mc:
+        mc.set_target_velocity(1.0)
+        sleep(0.2)
+        status = dict(mc.get_target_velocity())
+        assert status['ramping'] and 0.0 < status['linear'] < 1.0
+        sleep(0.8)
+        assert dict(mc.get_target_velocity()) == {'linear': 1.0, 'angular': 0.0, 'target': (1.0, 0.0),
+                                                  'ramping': False}
+        assert dict(mc.get_velocity())['motorA'] == PWM_MAX
+
+
+def test_sequence_deadlines_from_the_start():
+    sequence = MotionSequence()
+    assert sequence.start([(1.0, 0.0, 1.0), (0.0, 1.0, 0.5), (0.5, 0.0, 0.5)], now=10.0) == (1.0, 0.0)
+    assert sequence.due(10.9) is None and sequence.deadline == 11.0
+    assert sequence.due(11.2) == (0.0, 1.0)  # late, the next deadline stays 11.5
+    assert sequence.deadline == 11.5
+    assert sequence.due(12.1) == (0.0, 0.0) and not sequence.active  # the last two deadlines passed
+    assert dict(sequence.status)['step'] == 3 and dict(sequence.status)['remaining'] == 0.0
+
+
+def test_cancelled_sequence_status(motor_server):
+    port, bus = motor_server()
+    with MotorController('127.0.0.1', port, TOKEN, local=False) as mc:
+        assert dict(mc.run_sequence([(0.5, 0.0, 0.2), (0.0, 0.5, 5.0)])) == {'steps': 2, 'duration': 5.2}
+        sleep(0.4)
+        status = dict(mc.cancel_sequence())
+        assert not status['running'] and (status['step'], status['steps']) == (1, 2)
+        assert 0.35 < status['elapsed'] < 1.0 and 4.0 < status['remaining'] < 4.85
+        sleep(0.2)
+        assert dict(mc.sequence_status())['elapsed'] == status['elapsed']
+        assert dict(mc.get_velocity()) == {'motorA': 0, 'motorB': 0}
+
+
+def test_motors_kept_on_disconnect_without_lease(motor_server):
+    port, bus = motor_server()
+    with MotorController('127.0.0.1', port, TOKEN, local=False) as mc: mc.set_velocity(0.5)
+    sleep(0.5)
+    assert all(pwm for direction, pwm in bus.motors)
+
+
+def test_lease_expires_on_disconnect(motor_server):
+    port, bus = motor_server()
+    with MotorController('127.0.0.1', port, TOKEN, local=False) as mc:
+        mc.lease(5.0)
+        mc.set_velocity(0.5)
+    sleep(0.3)
+    assert not any(pwm for direction, pwm in bus.motors)
+
+
+def test_lease_expires_without_requests(motor_server):
+    port, bus = motor_server()
+    with MotorController('127.0.0.1', port, TOKEN, local=False) as mc:
+        mc.lease(0.3)
+        mc.set_velocity(0.5)
+        assert all(pwm for motor, pwm in mc.get_velocity())
+        sleep(0.6)
+        assert not any(pwm for direction, pwm in bus.motors)
+        assert dict(mc.metrics())['lease_expiries'] == 1
+
+
+@pytest.mark.skipif(os.geteuid() != 0, reason='connecting as another user needs root')
+def test_local_peer():
+    server, client = socket(AF_UNIX, SOCK_STREAM), socket(AF_UNIX, SOCK_STREAM)
+    server.bind('\0piborg-test-{}'.format(os.getpid()))  # abstract, no file modes keep the other user out
+    server.listen(2)
+    client.connect(server.getsockname())
+    conn = server.accept()[0]
+    assert local_peer(conn)
+    conn.close()
+    client.close()
+    client = socket(AF_UNIX, SOCK_STREAM)
+    os.setegid(65534)
+    os.seteuid(65534)  # nobody
+    try:
+        client.connect(server.getsockname())
+    finally:
+        os.seteuid(0)
+        os.setegid(0)
+    conn = server.accept()[0]
+    assert not local_peer(conn)
+    conn.close()
+    client.close()
+    server.close()
+
+
+def test_local_clients_over_the_unix_socket(motor_server, monkeypatch, tmp_path):
+    monkeypatch.setattr(motor_client, 'SOCKET_DIR', str(tmp_path / 'motor_server'))
+    port, bus = motor_server(local=True)
+    assert os.stat(motor_client.SOCKET_DIR).st_mode & 0o777 == 0o750
+    for n in range(20):  # gone before they are let in
+        sock = socket(AF_UNIX, SOCK_STREAM)
+        sock.connect(motor_client.unix_socket_path(port))
+        sock.close()
+    with MotorController('127.0.0.1', port) as mc:  # no token
+        assert mc.connection.sock.family == AF_UNIX
+        assert dict(mc.set_velocity(0.5))['motorA'] == int(PWM_MAX * 0.5)
@@ -0,0 +1,41 @@
+from preroll import PrerollRing
+
+
+def jpeg(n, size=300):
+    """return a JPEG-framed payload of size bytes, distinct for each n"""
+    return b'\xff\xd8' + bytes([n]) * (size - 4) + b'\xff\xd9'
+
+
+def test_frame_that_does_not_fit_wraps_to_the_front(tmp_path):
+    ring = PrerollRing(str(tmp_path / 'preroll.ring'), size=1000, entries=16)
+    for seq in range(1, 5): ring.append(seq, jpeg(seq), 100.0 + seq)
+    assert (ring.frames, ring.position) == (4, 1300)  # frame 4 skipped the 100 bytes at the end, and overwrote frame 1
+    assert [(seq, position) for seq, position, length, timestamp in ring.window(10)] == [(2, 300), (3, 600), (4, 1000)]
+    clip = tmp_path / 'clip.mjpeg'
+    assert ring.export(10, str(clip)) == 3
+    assert clip.read_bytes() == jpeg(2) + jpeg(3) + jpeg(4)
+    ring.append(5, jpeg(5, 2000), 106.0)  # larger than the ring
+    assert ring.frames == 4
+    ring.close()
+
+
+def test_window(tmp_path):
+    ring = PrerollRing(str(tmp_path / 'preroll.ring'), size=10000, entries=4)
+    for seq in range(1, 7): ring.append(seq, jpeg(seq, 100), 100.0 + seq)
+    assert [entry[0] for entry in ring.window(1.5)] == [5, 6]
+    assert [entry[0] for entry in ring.window(60)] == [3, 4, 5, 6]  # older frames are no longer indexed
+    ring.close()
+
+
+def test_reopened_after_a_crash(tmp_path):
+    path = str(tmp_path / 'preroll.ring')
+    ring = PrerollRing(path, size=1000, entries=16)
+    for seq in range(1, 5): ring.append(seq, jpeg(seq), 100.0 + seq)
+    ring.close()
+    ring = PrerollRing.open(path)
+    assert (ring.size, ring.entries) == (1000, 16)
+    assert [entry[0] for entry in ring.window(10)] == [2, 3, 4]
+    ring.close()
+    ring = PrerollRing(path, size=2000, entries=16)  # another geometry starts over
+    assert ring.frames == 0 and ring.window(10) == []
+    ring.close()
@@ -0,0 +1,61 @@
+import mmap
+import os
+
+import telemetry_log
+from telemetry_log import HEADER, RECORD, TelemetryLog, files, first_at, last, records
+
+
+def stamped(monkeypatch, timestamps):
+    """make records appended next stamped with timestamps, in order"""
+    timestamps = iter(timestamps)
+    monkeypatch.setattr(telemetry_log, 'time', lambda: next(timestamps))
+
+
+def test_round_trip(tmp_path, monkeypatch):
+    path = str(tmp_path / 'robot.tlog')
+    stamped(monkeypatch, [100.0, 101.0, 102.0])
+    log = TelemetryLog(path, flush=60.0)
+    log.append('drive', 0.5, -0.25, 127, -64)
+    log.append('led', 1)
+    log.append('ups', 4.125, 5.0, 35.5, 2)
+    log.close()
+    assert list(records(path)) == [(100.0, 'drive', (0.5, -0.25, 127.0, -64.0)), (101.0, 'led', (1.0,)),
+                                   (102.0, 'ups', (4.125, 5.0, 35.5, 2.0))]
+    assert [kind for timestamp, kind, values in records(path, kinds=('led',))] == ['led']
+    assert last(path) == 102.0 and dict(log.stats)['written'] == 3
+    with open(path, 'ab') as damaged: damaged.write(b'\x00' * 5)  # cut off mid-record
+    stamped(monkeypatch, [103.0])
+    log = TelemetryLog(path, flush=60.0)
+    log.append('led', 0)
+    log.close()
+    assert [timestamp for timestamp, kind, values in records(path)] == [100.0, 101.0, 102.0, 103.0]
+
+
+def test_rotation(tmp_path, monkeypatch):
+    path = str(tmp_path / 'robot.tlog')
+    stamped(monkeypatch, [float(t) for t in range(1, 13)])
+    log = TelemetryLog(path, max_bytes=HEADER.size + 3 * RECORD.size, backups=2, flush=60.0)
+    for n in range(4):
+        for m in range(3): log.append('led', m)
+        log.drain()  # writes the three records to a file of their own
+    log.close()
+    assert files(path) == [path + '.2', path + '.1', path] and dict(log.stats)['rotations'] == 3
+    assert [timestamp for timestamp, kind, values in records(path)] == [float(t) for t in range(4, 13)]  # 1-3 deleted
+
+
+def test_query_by_time(tmp_path, monkeypatch):
+    path = str(tmp_path / 'robot.tlog')
+    stamped(monkeypatch, [float(t) for t in range(100)])
+    log = TelemetryLog(path, max_bytes=HEADER.size + 40 * RECORD.size, flush=60.0)
+    for n in range(100):
+        log.append('drive', n / 100.0, 0.0, n, n)
+        if n % 40 == 39: log.drain()
+    log.close()
+    with open(path + '.1', 'rb') as rotated:
+        data = mmap.mmap(rotated.fileno(), 0, access=mmap.ACCESS_READ)
+    assert [first_at(data, 40, start) for start in (-1.0, 40.0, 55.5, 79.0, 80.0)] == [0, 0, 16, 39, 40]
+    data.close()
+    assert [timestamp for timestamp, kind, values in records(path, 37.5, 42.0)] == [38.0, 39.0, 40.0, 41.0, 42.0]
+    assert [timestamp for timestamp, kind, values in records(path, 95.0)] == [95.0, 96.0, 97.0, 98.0, 99.0]
+    assert list(records(path, 100.0)) == [] and len(list(records(path, end=10.0))) == 11
+    assert os.path.getsize(path) == HEADER.size + 20 * RECORD.size
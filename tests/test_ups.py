@@ -0,0 +1,46 @@
+from threading import Event, Thread
+from time import monotonic, sleep
+
+from ups import SimulatedPIco, UpsMonitor
+
+
+def monitor(pico, **kwargs):
+    """run a UpsMonitor of pico on a thread, return it, its thread, the shutdown reasons and the stop event"""
+    reasons, stopped = [], Event()
+    ups = UpsMonitor(pico, pico, rate=50.0, shutdown=reasons.append, **kwargs)
+    thread = Thread(target=ups.run, args=(stopped,))
+    thread.daemon = True
+    thread.start()
+    return ups, thread, reasons, stopped
+
+
+def test_shutdown_after_grace():
+    pico = SimulatedPIco()
+    ups, thread, reasons, stopped = monitor(pico, grace=0.3)
+    sleep(0.1)
+    start = monotonic()
+    pico.set(powered=False)
+    thread.join(2.0)
+    assert reasons == ['received ups power out']
+    assert monotonic() - start >= 0.3
+    assert pico.pulses and ups.series[-1][1] == 'BAT'
+
+
+def test_power_back_within_grace():
+    pico = SimulatedPIco()
+    ups, thread, reasons, stopped = monitor(pico, grace=0.3)
+    pico.set(powered=False)
+    sleep(0.1)
+    pico.set(powered=True)
+    sleep(0.4)
+    assert thread.is_alive() and not reasons
+    stopped.set()
+    thread.join(2.0)
+    assert not thread.is_alive() and not reasons
+
+
+def test_low_battery():
+    pico = SimulatedPIco(battery=3.2, powered=False)
+    ups, thread, reasons, stopped = monitor(pico, grace=60.0)
+    thread.join(2.0)
+    assert reasons == ['battery at 3.2 V']
@@ -0,0 +1,34 @@
+from wiimote import BTN_UP, BTNS_SHUTDOWN, ScriptedSource, WiimoteBridge
+
+
+class Controller(object):
+    """records the velocity commands of the bridge"""
+
+    def __init__(self):
+        self.commands = []
+
+    def set_velocity(self, linear, angular=0.0):
+        self.commands.append((linear, angular))
+
+
+def test_sends_only_on_change():
+    controller = Controller()
+    bridge = WiimoteBridge(ScriptedSource([(0.2, 0), (0.05, BTN_UP), (0.3, 0)]), controller, keepalive=10.0)
+    assert bridge.run() is None
+    ramp, stop = controller.commands[:-1], controller.commands[-1]
+    assert ramp and all(a != b for a, b in zip(ramp, ramp[1:]))
+    assert all(linear > 0 and angular == 0 for linear, angular in ramp)
+    assert stop == (0.0, 0.0) and bridge.sent == len(ramp)
+
+
+def test_keepalive_while_moving():
+    controller = Controller()
+    WiimoteBridge(ScriptedSource([(0.02, BTN_UP), (0.35, 0)]), controller, keepalive=0.1).run()
+    ramp = controller.commands[:-1]
+    assert ramp.count(ramp[-1]) >= 3
+
+
+def test_shutdown_buttons():
+    controller = Controller()
+    assert WiimoteBridge(ScriptedSource([(0.05, BTNS_SHUTDOWN)]), controller).run() == 'reboot'
+    assert controller.commands == [(0.0, 0.0)]
@@ -2,15 +2,36 @@
 #
 # PIco UPS module
 #
-
+"""
+PIco UPS monitor
+The PIco is kept told the Pi is running by a pulse train on P_OUT. Power loss on P_IN is an edge interrupt that wakes
+the monitor at once, and the monitor shuts the Pi down once power has been lost for the grace period. Battery and Pi
+supply voltage, temperature and power mode are sampled in one i2c pass at a set rate into a bounded time series, and
+the Pi is also shut down when on battery below the battery threshold, or above the temperature threshold.
+Usage:
+    ups.py start [grace]    -> monitor the UPS and shut down on power loss after grace seconds, run as root, telemetry
+                               is logged to /home/pi/ups.tlog, see telemetry_log.py
+    ups.py status           -> print one telemetry sample
+    ups.py simulate         -> monitor a simulated PIco that loses power, without shutting down
+"""
+from collections import deque
 from datetime import datetime
 from os import system, getuid
 from signal import signal, SIGTERM
-from smbus import SMBus
 from sys import exit, argv
-from time import sleep
+from threading import Event, Thread
+from time import monotonic, sleep, time
+
+from telemetry_log import UPS_LOG, TelemetryLog
 
-from RPi import GPIO
+try:
+    from smbus import SMBus
+except ImportError:  # only the simulated PIco is available
+    SMBus = None
+try:
+    from RPi import GPIO
+except ImportError:  # only the simulated PIco is available
+    GPIO = None
 
 # PIco constants
 BYTE, WORD, BUS = 0, 1, 1
@@ -20,41 +41,227 @@ MODE = (0x69, 0x00, BYTE)
 BATLEVEL = (0x69, 0x01, WORD)
 RPILEVEL = (0x69, 0x03, WORD)
 TCELCIUS = (0x69, 0x0C, BYTE)
+REGISTERS = (MODE, BATLEVEL, RPILEVEL, TCELCIUS)  # sampled registers, read by one block read of BLOCK bytes
+BLOCK = TCELCIUS[1] + 1
 # PIco GPIO BCM pins
 P_IN, P_OUT = 27, 22
-
-i2c_bus = SMBus(BUS)
+PULSE = 0.25  # seconds between P_OUT toggles
+RATE, HISTORY = 1.0, 3600  # telemetry samples per second, and samples kept
+MIN_BATTERY, MAX_CELSIUS = 3.4, 70.0  # shutdown thresholds, battery volts while on battery, and temperature
 
 
 def now():
     return str(datetime.now())
 
 
-def sigterm_handler(_signo, _stack_frame):
-    print('[{0}] cleaning up pins!'.format(now()))
-    GPIO.cleanup()
-    exit(0)
+def bcd(value):
+    """return the number the PIco encodes as binary coded decimal value"""
+    number, scale = 0, 1
+    while value:
+        number, value, scale = number + (value & 0xF) * scale, value >> 4, scale * 10
+    return number
 
 
-if __name__ == '__main__':
-    signal(SIGTERM, sigterm_handler)
-    if argv[1] == 'start' and getuid() == 0:
-        print('[{0}] set up pins!'.format(now()))
+def shutdown(reason):
+    """halt the Pi"""
+    print('[{0}] {1}, initiating shutdown...'.format(now(), reason))
+    system('shutdown -h now')
+
+
+class RPiGPIOBackend(object):
+    """PIco pins through RPi.GPIO"""
+
+    def setup(self):
+        """set P_IN as pulled up input and P_OUT as output"""
         GPIO.setwarnings(False)
         GPIO.setmode(GPIO.BCM)
         GPIO.setup(P_IN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
         GPIO.setup(P_OUT, GPIO.OUT)
+
+    def watch(self, callback):
+        """call callback from the GPIO thread on every edge of P_IN"""
+        GPIO.add_event_detect(P_IN, GPIO.BOTH, callback=lambda pin: callback(), bouncetime=10)
+
+    def powered(self):
+        """return True while the PIco has external power"""
+        return bool(GPIO.input(P_IN))
+
+    def pulse(self, level):
+        GPIO.output(P_OUT, level)
+
+    def cleanup(self):
+        print('[{0}] cleaning up pins!'.format(now()))
+        GPIO.cleanup()
+
+
+class SimulatedPIco(object):
+    """PIco pins and registers for running without the UPS, power and readings are changed with set()"""
+
+    def __init__(self, battery=4.12, rpi=5.08, celsius=35, powered=True):
+        self.callback, self.power, self.pulses, self.reads = None, powered, 0, 0
+        self.registers = bytearray(BLOCK)
+        self.set(battery, rpi, celsius)
+
+    def set(self, battery=None, rpi=None, celsius=None, powered=None):
+        """change readings, and raise the P_IN edge when powered changes"""
+        def encode(number):
+            return int(str(int(round(number))), 16)
+        if battery is not None: self.registers[1:3] = encode(battery * 100).to_bytes(2, 'little')
+        if rpi is not None: self.registers[3:5] = encode(rpi * 100).to_bytes(2, 'little')
+        if celsius is not None: self.registers[TCELCIUS[1]] = encode(celsius)
+        changed = powered is not None and powered != self.power
+        if changed: self.power = powered
+        self.registers[MODE[1]] = POWER.index('RPI' if self.power else 'BAT')
+        if changed and self.callback is not None: self.callback()
+
+    def setup(self):
+        pass
+
+    def watch(self, callback):
+        self.callback = callback
+
+    def powered(self):
+        return self.power
+
+    def pulse(self, level):
+        self.pulses += 1
+
+    def cleanup(self):
+        pass
+
+    def read_i2c_block_data(self, address, offset, length):
+        self.reads += 1
+        return list(self.registers[offset:offset + length])
+
+    def read_word_data(self, address, offset):
+        self.reads += 1
+        return self.registers[offset] | self.registers[offset + 1] << 8
+
+    def read_byte_data(self, address, offset):
+        self.reads += 1
+        return self.registers[offset]
+
+
+class UpsMonitor(object):
+    """keeps the PIco pulse, samples its telemetry and shuts down on power loss or a threshold
+    Example:
+    from ups import UpsMonitor, SimulatedPIco
+    pico = SimulatedPIco()
+    monitor = UpsMonitor(pico, pico, shutdown=print)
+    Thread(target=monitor.run).start()
+    pico.set(powered=False)  # monitor.run calls shutdown('received ups power out') and returns it
+    """
+
+    def __init__(self, gpio, bus, rate=RATE, history=HISTORY, grace=0.0, min_battery=MIN_BATTERY,
+                 max_celsius=MAX_CELSIUS, shutdown=shutdown, batched=True, log=None):
+        """
+        :param gpio: RPiGPIOBackend or SimulatedPIco
+        :param bus: SMBus(BUS) or SimulatedPIco
+        :param rate: telemetry samples per second
+        :param history: telemetry samples kept, the oldest are dropped
+        :param grace: seconds on battery after power loss before shutting down, power coming back cancels it
+        :param min_battery: battery volts below which to shut down while on battery
+        :param max_celsius: temperature above which to shut down
+        :param shutdown: called with the reason to shut down
+        :param batched: read the registers in one block read, False reads them one at a time
+        :param log: TelemetryLog every sample is appended to, closed when the run ends
+        """
+        self.gpio, self.bus, self.period, self.grace, self.batched = gpio, bus, 1.0 / rate, grace, batched
+        self.min_battery, self.max_celsius, self.shutdown, self.log = min_battery, max_celsius, shutdown, log
+        self.series = deque(maxlen=history)  # (time, power, battery volts, rpi volts, celsius)
+        self.wake = Event()
+        self.lost = None
+
+    def sample(self):
+        """read MODE, BATLEVEL, RPILEVEL and TCELCIUS, append and return the sample"""
+        if self.batched:
+            data = self.bus.read_i2c_block_data(MODE[0], MODE[1], BLOCK)
+        else:
+            data = [0] * BLOCK
+            for address, offset, size in REGISTERS:
+                if size == WORD:
+                    word = self.bus.read_word_data(address, offset)
+                    data[offset:offset + 2] = word & 0xFF, word >> 8
+                else:
+                    data[offset] = self.bus.read_byte_data(address, offset)
+
+        def register(reg):
+            return bcd(data[reg[1]] | data[reg[1] + 1] << 8 if reg[2] == WORD else data[reg[1]])
+        mode = data[MODE[1]]
+        battery, rpi, celsius = register(BATLEVEL) / 100.0, register(RPILEVEL) / 100.0, register(TCELCIUS)
+        self.series.append((time(), POWER[mode] if mode < len(POWER) else '', battery, rpi, celsius))
+        if self.log is not None: self.log.append('ups', battery, rpi, celsius, mode)
+        return self.series[-1]
+
+    def reason(self, at):
+        """return why to shut down at monotonic time at, None to keep running"""
+        if self.lost is not None and at >= self.lost + self.grace: return 'received ups power out'
+        if not self.series: return None
+        power, battery, celsius = self.series[-1][1], self.series[-1][2], self.series[-1][4]
+        if power == 'BAT' and battery < self.min_battery: return 'battery at {} V'.format(battery)
+        if celsius > self.max_celsius: return 'ups at {} C'.format(celsius)
+        return None
+
+    def run(self, stopped=None):
+        """pulse, sample and watch until a shutdown reason or stopped is set, return the reason or None
+        :param stopped: Event that ends the run when set, e.g. on SIGTERM
+        """
+        stopped = Event() if stopped is None else stopped
+        self.gpio.setup()
+        self.gpio.watch(self.wake.set)
+        pulse = sample = monotonic()
+        level = False
         try:
-            while GPIO.input(P_IN):
-                GPIO.output(P_OUT, True)
-                sleep(0.25)
-                GPIO.output(P_OUT, False)
-                sleep(0.25)
-            print('[{0}] received ups power out, initiating shutdown...'.format(now()))
-            system('shutdown -h now')
+            while not stopped.is_set():
+                deadline = min(pulse, sample, pulse if self.lost is None else self.lost + self.grace)
+                if self.wake.wait(max(0.0, deadline - monotonic())): self.wake.clear()
+                at = monotonic()
+                if at >= pulse:
+                    level = not level
+                    self.gpio.pulse(level)
+                    pulse += PULSE * (1 + int((at - pulse) / PULSE))
+                if at >= sample:
+                    try:
+                        self.sample()
+                    except IOError:  # the PIco missed a transaction, sample again next period
+                        pass
+                    sample += self.period * (1 + int((at - sample) / self.period))
+                if self.gpio.powered():
+                    if self.lost is not None: print('[{0}] ups power back'.format(now()))
+                    self.lost = None
+                elif self.lost is None:
+                    print('[{0}] ups power lost'.format(now()))
+                    self.lost = at
+                reason = self.reason(at)
+                if reason is not None:
+                    self.shutdown(reason)
+                    return reason
+        finally:
+            self.gpio.cleanup()
+            if self.log is not None: self.log.close()
+
+
+if __name__ == '__main__':
+    stopped = Event()
+    signal(SIGTERM, lambda *args: stopped.set())
+    command = argv[1] if len(argv) > 1 else ''
+    if command == 'start' and getuid() == 0:
+        print('[{0}] set up pins!'.format(now()))
+        try:
+            UpsMonitor(RPiGPIOBackend(), SMBus(BUS), grace=float(argv[2]) if len(argv) > 2 else 0.0,
+                       log=TelemetryLog(UPS_LOG)).run(stopped)
         except KeyboardInterrupt:
             print('[{0}] received interrupt, exiting...'.format(now()))
-        finally:
-            print('[{0}] cleaning up pins!'.format(now()))
-            GPIO.cleanup()
-            exit(0)
+        exit(0)
+    elif command == 'status':
+        print(UpsMonitor(None, SMBus(BUS)).sample())
+    elif command == 'simulate':
+        pico = SimulatedPIco()
+        monitor = UpsMonitor(pico, pico, rate=10.0, grace=0.5, shutdown=lambda reason: print('would shut down:', reason))
+        Thread(target=lambda: (sleep(1.0), pico.set(battery=4.0, powered=False)), daemon=True).start()
+        start = monotonic()
+        print(monitor.run(stopped), 'after {:.3f} s'.format(monotonic() - start))
+        for sample in list(monitor.series)[-3:]: print(sample)
+        print('{} pulses, {} i2c reads'.format(pico.pulses, pico.reads))
+    else:
+        print(__doc__)
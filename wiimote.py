@@ -1,96 +1,227 @@
 #!/usr/bin/env python2
 # -*- coding: utf-8 -*-
-""" Wiimote controller for DiddiBorg """
-import cwiid
+""" Wiimote controller for DiddiBorg
+Button events come from an input source, cwiid callbacks on the robot or a scripted sequence of button states.
+The drive loop ticks only while the velocity is ramping, and sends set_velocity only when (linear, angular) changes
+or a keep-alive is due while moving. Logging happens on its own thread.
+Usage:
+    wiimote.py          -> drive with the wii remote
+    wiimote.py demo     -> drive with a scripted button sequence
+"""
+import logging
 from os import system
 from signal import signal, SIGTERM
+from threading import Event, Thread
 from time import sleep
 
-from motor_server import MotorController
+try:
+    from queue import Queue, Empty
+except ImportError:  # python2
+    from Queue import Queue, Empty
+try:
+    from time import monotonic
+except ImportError:  # python2
+    from time import time as monotonic
+try:
+    import cwiid
+except ImportError:  # scripted input only
+    cwiid = None
 
+from motor_client import MotorController, TIMEOUT
+
+BTN_2, BTN_1, BTN_B, BTN_A, BTN_MINUS, BTN_HOME = 0x0001, 0x0002, 0x0004, 0x0008, 0x0010, 0x0080  # cwiid values
+BTN_LEFT, BTN_RIGHT, BTN_DOWN, BTN_UP, BTN_PLUS = 0x0100, 0x0200, 0x0400, 0x0800, 0x1000
 WII_LED = 9  # LEDs to light up on connected wii remote
-BTNS_DISCONNECT = cwiid.BTN_PLUS + cwiid.BTN_MINUS
-BTNS_FWD = cwiid.BTN_UP | cwiid.BTN_1
-BTNS_REV = cwiid.BTN_DOWN | cwiid.BTN_2
-BTNS_RIGHT = cwiid.BTN_RIGHT | cwiid.BTN_PLUS
-BTNS_LEFT = cwiid.BTN_LEFT | cwiid.BTN_MINUS
-BTNS_TURN = cwiid.BTN_RIGHT | cwiid.BTN_PLUS | cwiid.BTN_LEFT | cwiid.BTN_MINUS | cwiid.BTN_A
-BTNS_STOP = cwiid.BTN_B
-BTNS_NO_TURN = cwiid.BTN_HOME | cwiid.BTN_A
-BTNS_SHUTDOWN = cwiid.BTN_1 + cwiid.BTN_2 + cwiid.BTN_A + cwiid.BTN_B
+BTNS_DISCONNECT = BTN_PLUS + BTN_MINUS
+BTNS_FWD = BTN_UP | BTN_1
+BTNS_REV = BTN_DOWN | BTN_2
+BTNS_RIGHT = BTN_RIGHT | BTN_PLUS
+BTNS_LEFT = BTN_LEFT | BTN_MINUS
+BTNS_TURN = BTN_RIGHT | BTN_PLUS | BTN_LEFT | BTN_MINUS | BTN_A
+BTNS_STOP = BTN_B
+BTNS_NO_TURN = BTN_HOME | BTN_A
+BTNS_SHUTDOWN = BTN_1 + BTN_2 + BTN_A + BTN_B
+TICK = 0.01  # seconds per ramp step of held buttons
+KEEPALIVE = min(1.0, TIMEOUT / 4.0)  # seconds between repeated commands while moving, well within the server timeout
+DISCONNECTED = -1  # button state an input source reports when the remote is gone
+LOG = logging.getLogger('wiimote')
 
 
-def rumble(wii, n):
-    wii.rumble = 1
-    sleep(n)
-    wii.rumble = 0
+def step(buttons, linear, angular):
+    """return (linear, angular) in percent after one tick with buttons held"""
+    if buttons & BTNS_STOP: linear = 0
+    if buttons & BTNS_NO_TURN: angular = 0
+    if buttons & BTNS_FWD: linear += 1 if linear < 100 else 0
+    if buttons & BTNS_REV: linear -= 1 if linear > -100 else 0
+    if buttons & BTNS_RIGHT: angular += 1 if angular < 100 else 0
+    if buttons & BTNS_LEFT: angular -= 1 if angular > -100 else 0
+    if angular != 0 and not (buttons & BTNS_TURN): angular -= 1 if angular > 0 else -1
+    return linear, angular
 
 
-if __name__ == '__main__':
-    restart = running = True
+class CwiidSource(object):
+    """wii remote over bluetooth, button changes are delivered by the cwiid message callback"""
+
+    def connect(self, stopped=None):
+        """wait until a remote pairs, return False if stopped is set first"""
+        self.wii = None
+        while self.wii is None:
+            if stopped is not None and stopped.is_set(): return False
+            try:
+                self.wii = cwiid.Wiimote()
+            except RuntimeError:
+                sleep(1)
+        self.wii.rpt_mode = cwiid.RPT_BTN
+        self.wii.led = WII_LED
+        self.rumble(0.2)
+        return True
+
+    def start(self, callback):
+        """call callback with the button state on every change, and DISCONNECTED if the remote is lost"""
+        def messages(mesg_list, timestamp):
+            for mesg in mesg_list:
+                if mesg[0] == cwiid.MESG_BTN: callback(mesg[1])
+                elif mesg[0] == cwiid.MESG_ERROR: callback(DISCONNECTED)
+        self.wii.mesg_callback = messages
+        self.wii.enable(cwiid.FLAG_MESG_IFC)
+
+    def rumble(self, n):
+        self.wii.rumble = 1
+        sleep(n)
+        self.wii.rumble = 0
+
+    def close(self):
+        """rumble, switch off the LEDs and release the remote"""
+        try:
+            self.wii.disable(cwiid.FLAG_MESG_IFC)
+            self.rumble(0.2)
+            self.wii.led = 0
+            self.wii.close()
+        except (RuntimeError, ValueError):  # already gone
+            pass
+
+
+class ScriptedSource(object):
+    """replays a script of (seconds, buttons) steps, holding each button state for its seconds, for tests and demos"""
+
+    def __init__(self, script):
+        self.script = script
+
+    def connect(self, stopped=None):
+        return True
 
+    def start(self, callback):
+        """replay the script on a thread, then report DISCONNECTED"""
+        def replay():
+            for seconds, buttons in self.script:
+                callback(buttons)
+                sleep(seconds)
+            callback(DISCONNECTED)
+        thread = Thread(target=replay)
+        thread.daemon = True
+        thread.start()
 
-    def sigterm(*args, **kwargs):
-        global running
-        global restart
-        running = restart = False
+    def close(self):
+        pass
 
 
-    signal(SIGTERM, sigterm)
+class WiimoteBridge(object):
+    """turns button events into velocity commands
+    Example:
+    from motor_client import MotorController
+    from wiimote import WiimoteBridge, ScriptedSource, BTN_UP
+    with MotorController() as mc:
+        WiimoteBridge(ScriptedSource([(0.5, BTN_UP), (1.0, 0)]), mc).run()
+    """
 
-    wii = None
-    linear = angular = 0
+    def __init__(self, source, controller, tick=TICK, keepalive=KEEPALIVE):
+        """
+        :param source: CwiidSource, ScriptedSource or any object with connect(stopped), start(callback) and close()
+        :param controller: MotorController
+        :param tick: seconds per ramp step while buttons are held
+        :param keepalive: seconds between repeated commands while moving
+        """
+        self.source, self.controller, self.tick, self.keepalive = source, controller, tick, keepalive
+        self.events = Queue()
+        self.linear = self.angular = 0
+        self.sent = self.ticks = 0
+
+    def run(self, stopped=None):
+        """drive until the remote disconnects or asks to, return 'reboot' if the shutdown buttons were pressed
+        :param stopped: Event that ends the run when set, e.g. on SIGTERM
+        """
+        self.source.start(self.events.put)
+        buttons, result, last, next_send = 0, None, (0, 0), monotonic()
+        try:
+            while stopped is None or not stopped.is_set():
+                ramping = buttons or self.angular
+                try:
+                    buttons = self.events.get(timeout=self.tick if ramping else self.keepalive)
+                    while not self.events.empty(): buttons = self.events.get_nowait()  # only the newest state matters
+                except Empty:
+                    pass
+                if buttons == DISCONNECTED: break
+                if buttons == BTNS_SHUTDOWN:
+                    result = 'reboot'
+                    break
+                if buttons == BTNS_DISCONNECT: break
+                self.linear, self.angular = step(buttons, self.linear, self.angular)
+                self.ticks += 1
+                now = monotonic()
+                if (self.linear, self.angular) != last or (last != (0, 0) and now >= next_send):
+                    last, next_send = (self.linear, self.angular), now + self.keepalive
+                    reply = self.controller.set_velocity(self.linear / 100.0, self.angular / 100.0)
+                    self.sent += 1
+                    LOG.debug('buttons %#06x velocity %s -> %s', buttons, last, reply)
+        finally:
+            self.linear = self.angular = 0
+            self.controller.set_velocity(0.0, 0.0)
+            LOG.info('stopped after %d ticks, %d commands', self.ticks, self.sent)
+        return result
+
+
+def log_in_background(level=logging.INFO):
+    """route log records through a queue to a thread that writes them, so the drive loop never waits on the journal"""
+    records = Queue()
+
+    class QueueHandler(logging.Handler):
+        def emit(self, record):
+            records.put(record)
+
+    def writer(handler):
+        while True:
+            handler.handle(records.get())
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(asctime)s %(name)s %(message)s'))
+    thread = Thread(target=writer, args=(handler,))
+    thread.daemon = True
+    thread.start()
+    logging.getLogger().addHandler(QueueHandler())
+    logging.getLogger().setLevel(level)
+
+
+if __name__ == '__main__':
+    from sys import argv
+
+    log_in_background()
+    stopped = Event()
+    signal(SIGTERM, lambda *args: stopped.set())
+    demo = argv[1:2] == ['demo']
     reboot = False
-    while restart:
-        running = True
-        while wii is None and restart:
-            try:
-                wii = cwiid.Wiimote()
-            except RuntimeError as e:
-                sleep(1)
-            except KeyboardInterrupt:
-                running = restart = False
-        if wii is not None:
-            wii.rpt_mode = cwiid.RPT_BTN
-            wii.led = WII_LED
-            rumble(wii, 0.2)
+    try:
+        while not stopped.is_set():
+            source = ScriptedSource([(1.0, BTN_UP), (0.5, BTN_RIGHT), (2.0, 0), (0.1, BTN_B)]) if demo else CwiidSource()
+            if not source.connect(stopped): break
             try:
                 with MotorController() as mc:
-                    while running:
-                        try:
-                            buttons = wii.state['buttons']
-                            if buttons - BTNS_SHUTDOWN == 0:
-                                running = restart = False
-                                reboot = True
-                            if buttons - BTNS_DISCONNECT == 0:
-                                running = False
-                            if (buttons & BTNS_STOP):
-                                linear = 0
-                            if (buttons & BTNS_NO_TURN):
-                                angular = 0
-                            if (buttons & BTNS_FWD):
-                                linear += 1 if linear < 100 else 0
-                            if (buttons & BTNS_REV):
-                                linear -= 1 if linear > -100 else 0
-                            if (buttons & BTNS_RIGHT):
-                                angular += 1 if angular < 100 else 0
-                            if (buttons & BTNS_LEFT):
-                                angular -= 1 if angular > -100 else 0
-                            if angular != 0 and not (buttons & BTNS_TURN):
-                                angular -= abs(angular) / angular
-                            if buttons != 0 or angular != 0:
-                                print(wii.state)
-                                print(mc.set_velocity(linear / 100.0, angular / 100.0))
-                            sleep(0.01)
-                        except KeyboardInterrupt:
-                            running = restart = False
-                    mc.set_velocity(0.0, 0.0)
-                    rumble(wii, 0.2)
-                    wii.led = 0
-                    wii = None
+                    reboot = WiimoteBridge(source, mc).run(stopped) == 'reboot'
             except IOError:
                 pass
-            except KeyboardInterrupt:
-                running = restart = False
+            finally:
+                source.close()
+            if reboot or demo: break
+    except KeyboardInterrupt:
+        pass
     if reboot:
         system('/usr/bin/sudo /sbin/reboot')